@@ -0,0 +1,466 @@
+"""Offline benchmark for the music bot's audio pipeline.
+
+Drives testbot.AudioPlayer against a fake voice client that consumes AudioSource.read() either at
+the real 20 ms cadence or as fast as possible, using audio generated locally with ffmpeg, so no
+Discord connection is needed. Results are written as JSON so runs can be compared:
+
+    python benchmark.py --guilds 8 --seconds 10 --output bench.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import threading
+import time
+
+import discord
+import ffmpeg
+
+import testbot
+
+
+class FakePlayer(threading.Thread):
+    """Mirrors discord.player.AudioPlayer: reads the current source every frame until it runs dry or is stopped."""
+
+    def __init__(self, voice_client, source, after):
+        super().__init__(daemon=True)
+        self.voice_client = voice_client
+        self.source = source
+        self.after = after
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._lock = threading.Lock()
+
+    def run(self):
+        voice_client = self.voice_client
+        error = None
+        next_frame = time.perf_counter()
+        try:
+            while not self._end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    next_frame = time.perf_counter()
+                    continue
+                data = self.source.read()
+                if not data:
+                    self.stop()
+                    break
+                if voice_client.encoder and not self.source.is_opus():
+                    voice_client.encoder.encode(data, voice_client.encoder.SAMPLES_PER_FRAME)
+                voice_client.frame_times.append(time.perf_counter())
+                if voice_client.realtime:
+                    next_frame += 0.02
+                    delay = next_frame - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        except Exception as e:
+            error = e
+            self.stop()
+        finally:
+            if self.after:
+                self.after(error)
+            self.source.cleanup()
+
+    def stop(self):
+        self._end.set()
+        self._resumed.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def set_source(self, source):
+        # discord.py swaps by pausing and resuming, which also resumes a player that was paused
+        with self._lock:
+            self.pause()
+            self.source = source
+            self.resume()
+
+    def is_playing(self):
+        return self._resumed.is_set() and not self._end.is_set()
+
+    def is_paused(self):
+        return not self._end.is_set() and not self._resumed.is_set()
+
+
+class FakeVoiceClient:
+    """Stands in for discord.VoiceClient: a thread pulling frames from the source like the real player."""
+
+    def __init__(self, realtime=True, encode=False):
+        self.realtime = realtime
+        self.encoder = discord.opus.Encoder() if encode else None
+        self._player = None
+        self._thread = None  # the last player started, kept after stop() so wait() can join it
+        self.frame_times = []
+
+    @property
+    def source(self):
+        return self._player.source if self._player else None
+
+    @source.setter
+    def source(self, value):
+        if self._player is None:
+            raise ValueError('Not playing anything.')
+        self._player.set_source(value)
+
+    def play(self, source, after=None):
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        self.frame_times = []
+        self._player = self._thread = FakePlayer(self, source, after)
+        self._player.start()
+
+    def is_playing(self):
+        return self._player is not None and self._player.is_playing()
+
+    def is_paused(self):
+        return self._player is not None and self._player.is_paused()
+
+    def pause(self):
+        if self._player:
+            self._player.pause()
+
+    def resume(self):
+        if self._player:
+            self._player.resume()
+
+    def stop(self):
+        # Like discord.py, detaches the player at once; its thread finishes and calls after on its own
+        if self._player:
+            self._player.stop()
+            self._player = None
+
+    def wait(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    async def disconnect(self, force=False):
+        self.stop()
+
+    async def wait_for_frames(self, count=1, since=0.0, timeout=10.0):
+        """Wait until ``count`` frames were read after ``since``; return the first one's timestamp."""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            frames = [t for t in self.frame_times if t >= since]
+            if len(frames) >= count:
+                return frames[0]
+            await asyncio.sleep(0.001)
+        return None
+
+
+def generate_audio(directory, seconds):
+    """Write a stereo test tone as mp3 (decoded path) and opus (passthrough path)."""
+    files = {}
+    for name, codec in (('tone.mp3', 'libmp3lame'), ('tone.opus', 'libopus')):
+        path = os.path.join(directory, name)
+        (
+            ffmpeg.input(f'sine=frequency=440:duration={seconds}', format='lavfi')
+            .output(path, acodec=codec, ac=2, ar=48000)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+        files[name] = path
+    return files
+
+
+def summarize(samples, scale=1000.0):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50': statistics.median(ordered) * scale,
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * scale,
+        'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * scale,
+        'max': ordered[-1] * scale,
+    }
+
+
+def child_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def self_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def drain(player):
+    voice_client = player.voice_client
+    player.queue.clear()
+    player.cleanup()
+    if voice_client:
+        voice_client.wait(5)
+    await asyncio.sleep(0.05)
+
+
+async def bench_play_next(path, trials, opus):
+    samples = []
+    for _ in range(trials):
+        player = testbot.AudioPlayer(guild_id=1, prewarm_seconds=0, opus_passthrough=opus)
+        player.voice_client = FakeVoiceClient(realtime=True)
+        player.queue.append((path, 'bench', True))
+        start = time.perf_counter()
+        await player.play_next()
+        first = await player.voice_client.wait_for_frames(since=start)
+        if first:
+            samples.append(first - start)
+        await drain(player)
+    return summarize(samples)
+
+
+async def bench_gap(path, trials, prewarm):
+    """Silence between two queued tracks: last frame of the first to first frame of the second."""
+    samples = []
+    for _ in range(trials):
+        player = testbot.AudioPlayer(guild_id=1, prewarm_seconds=5.0 if prewarm else 0, opus_passthrough=False)
+        player.voice_client = FakeVoiceClient(realtime=True)
+        player.queue.extend([(path, 'first', True), (path, 'second', True)])
+        await player.play_next()
+        first = player.voice_client.frame_times
+        # play() starts a new frame list for the second track
+        while player.voice_client.frame_times is first:
+            await asyncio.sleep(0.001)
+        start = await player.voice_client.wait_for_frames()
+        if start and first:
+            samples.append(max(0.0, start - first[-1] - 0.02))
+        await drain(player)
+    return summarize(samples)
+
+
+async def bench_play_effect(path, trials, over_music=False):
+    """Click to first mixed frame of a sound effect, from the soundboard cache and decoded by ffmpeg.
+
+    With ``over_music`` a track is already playing and the effect is layered over it.
+    """
+    pcm = testbot.decode_to_pcm(path)
+    samples = {'cached': [], 'uncached': []}
+    for _ in range(trials):
+        for kind in samples:
+            player = testbot.AudioPlayer(guild_id=1, prewarm_seconds=0, opus_passthrough=False)
+            player.voice_client = FakeVoiceClient(realtime=True)
+            if over_music:
+                player.queue.append((path, 'music', True))
+                await player.play_next()
+                await player.voice_client.wait_for_frames(count=5)
+            start = time.perf_counter()
+            await player.play_effect(path, 'bench', True, pcm=pcm if kind == 'cached' else None)
+            effect = player.mixer.effects[-1][0]
+            if await wait_for_samples(effect, 0):
+                samples[kind].append(time.perf_counter() - start)
+            await drain(player)
+    return {kind: summarize(values) for kind, values in samples.items()}
+
+
+async def bench_adjust(path, trials, opus):
+    """Time from adjust_audio() to the first frame produced under the new settings."""
+    samples = []
+    player = testbot.AudioPlayer(guild_id=1, prewarm_seconds=0, opus_passthrough=opus)
+    player.voice_client = FakeVoiceClient(realtime=True)
+    player.queue.append((path, 'bench', True))
+    await player.play_next()
+    await player.voice_client.wait_for_frames(count=10)
+    for i in range(trials):
+        player.volume = 0.3 if i % 2 else 0.5
+        start = time.perf_counter()
+        await player.adjust_audio()
+        first = await player.voice_client.wait_for_frames(since=start)
+        if first:
+            samples.append(first - start)
+        await asyncio.sleep(0.1)
+    await drain(player)
+    return summarize(samples)
+
+
+def bench_transform_cpu(pcm, speeds=(1.0, 0.75, 1.25, 1.5)):
+    """CPU time PCMTransformSource spends per 20 ms frame, at unity speed and time-stretched."""
+    results = {}
+    for speed in speeds:
+        source = testbot.PCMTransformSource(io.BytesIO(pcm), volume=0.5, speed=speed)
+        frames = 0
+        start = time.process_time()
+        while source.read():
+            frames += 1
+        cpu = time.process_time() - start
+        results[str(speed)] = {'frames': frames, 'cpu_us_per_frame': cpu / frames * 1e6 if frames else None}
+    return results
+
+
+def bench_mixer_cpu(pcm, effect_counts=(0, 1, 2, 4, 8)):
+    """CPU time MixerSource spends per 20 ms frame mixing music under N simultaneous effects."""
+    results = {}
+    for count in effect_counts:
+        mixer = testbot.MixerSource(discord.PCMAudio(io.BytesIO(pcm)), max_effects=max(count, 1))
+        for _ in range(count):
+            mixer.add(discord.PCMAudio(io.BytesIO(pcm)), gain=0.8)
+        frames = 0
+        start = time.process_time()
+        while mixer.read():
+            frames += 1
+        cpu = time.process_time() - start
+        results[str(count)] = {'frames': frames, 'cpu_us_per_frame': cpu / frames * 1e6 if frames else None}
+    return results
+
+
+async def wait_for_samples(source, past, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while source.samples_read <= past and time.perf_counter() < deadline:
+        await asyncio.sleep(0.0005)
+    return source.samples_read > past
+
+
+async def bench_change_latency(path, trials):
+    """Time until a speed change is audible: applied in-process vs restarting ffmpeg at the position.
+
+    Both are quantized by the 20 ms frame clock, so the restart is also timed to the new decoder
+    having filled its pre-roll, which is what a slower (e.g. remote) source stretches out.
+    """
+    samples = {'in_process': [], 'restart': [], 'restart_decoder_ready': []}
+    player = testbot.AudioPlayer(guild_id=1, prewarm_seconds=0, opus_passthrough=False)
+    player.voice_client = FakeVoiceClient(realtime=True)
+    player.queue.append((path, 'bench', True))
+    await player.play_next()
+    await player.voice_client.wait_for_frames(count=10)
+    for i in range(trials):
+        player.speed = 1.25 if i % 2 == 0 else 1.0
+        source = player.audio_source
+        past = source.samples_read
+        start = time.perf_counter()
+        await player.adjust_audio()
+        if await wait_for_samples(source, past):
+            samples['in_process'].append(time.perf_counter() - start)
+
+        # What changing speed used to cost: a new ffmpeg process with the setting baked in
+        start = time.perf_counter()
+        player.restart_at(player.position)
+        buffer = player.audio_source.stream
+        ready = None
+        while time.perf_counter() - start < 10:
+            if ready is None and (buffer.received >= buffer.preroll or buffer.eof):
+                ready = time.perf_counter() - start
+            if player.audio_source.samples_read:
+                samples['restart'].append(time.perf_counter() - start)
+                break
+            await asyncio.sleep(0.0005)
+        if ready is not None:
+            samples['restart_decoder_ready'].append(ready)
+        await asyncio.sleep(0.1)
+    await drain(player)
+    return {kind: summarize(values) for kind, values in samples.items()}
+
+
+async def bench_concurrency(path, guilds, realtime, opus, encode):
+    """Play one track in ``guilds`` players at once and measure CPU per stream and frame jitter.
+
+    Each player starts through play_next, so the jitter buffer and mixer are part of the cost.
+    """
+    players = []
+    cpu_before, children_before = self_cpu(), child_cpu()
+    wall_start = time.perf_counter()
+    for guild_id in range(guilds):
+        player = testbot.AudioPlayer(guild_id=guild_id, prewarm_seconds=0, opus_passthrough=opus)
+        player.voice_client = FakeVoiceClient(realtime=realtime, encode=encode)
+        player.queue.append((path, 'bench', True))
+        await player.play_next()
+        players.append(player)
+    # The track ending runs play_next on the empty queue, which clears playing
+    while any(player.playing for player in players):
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - wall_start
+
+    jitter = []
+    frames = 0
+    for player in players:
+        times = player.voice_client.frame_times
+        frames += len(times)
+        if realtime:
+            jitter.extend(abs((b - a) - 0.02) for a, b in zip(times, times[1:]))
+        player.cleanup()
+    # Let the supervisor reap the decoders so their CPU shows up in RUSAGE_CHILDREN
+    deadline = time.perf_counter() + 5
+    while testbot.ffmpeg_supervisor.stats()['reaping'] and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    cpu = (self_cpu() - cpu_before) + (child_cpu() - children_before)
+
+    audio_seconds = frames * 0.02
+    cpu_per_audio_second = cpu / audio_seconds if audio_seconds else None
+    result = {
+        'guilds': guilds,
+        'mode': 'opus' if opus else 'pcm',
+        'realtime': realtime,
+        'encode_pcm_to_opus': encode,
+        'wall_seconds': wall,
+        'frames': frames,
+        'cpu_seconds': cpu,
+        'cpu_per_stream': cpu_per_audio_second,
+        'max_guilds_per_core': 1 / cpu_per_audio_second if cpu_per_audio_second else None,
+        'jitter_ms': summarize(jitter) if realtime else None,
+    }
+    if not opus and not encode:
+        # discord.py Opus-encodes every PCM frame; without libopus that cost is missing from the figures
+        result['note'] = "libopus not loaded: PCM frames were not encoded, cpu_per_stream understates the PCM path"
+    return result
+
+
+async def main(args):
+    testbot.client.loop = asyncio.get_running_loop()
+    encode = discord.opus.is_loaded()
+    with tempfile.TemporaryDirectory() as directory:
+        files = generate_audio(directory, args.seconds)
+        mp3, opus_file = files['tone.mp3'], files['tone.opus']
+        results = {
+            'timestamp': time.time(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'opus_loaded': encode,
+            },
+            'parameters': vars(args),
+            'time_to_first_frame_ms': {
+                'play_next_pcm': await bench_play_next(mp3, args.trials, opus=False),
+                'play_next_opus': await bench_play_next(opus_file, args.trials, opus=True),
+                'play_effect': await bench_play_effect(mp3, args.trials),
+                'play_effect_over_music': await bench_play_effect(mp3, args.trials, over_music=True),
+            },
+            'gap_between_tracks_ms': {
+                'prewarmed': await bench_gap(mp3, args.trials, prewarm=True),
+                'cold': await bench_gap(mp3, args.trials, prewarm=False),
+            },
+            'transform_cpu': bench_transform_cpu(testbot.decode_to_pcm(mp3)),
+            'mixer_cpu': bench_mixer_cpu(testbot.decode_to_pcm(mp3)),
+            'speed_change_latency_ms': await bench_change_latency(mp3, args.trials),
+            'adjust_latency_ms': {
+                'pcm': await bench_adjust(mp3, args.trials, opus=False),
+                # Taking a passthrough track onto the PCM path decodes its packets with libopus
+                'opus': await bench_adjust(opus_file, args.trials, opus=True) if encode else None,
+            },
+            'concurrency': [
+                await bench_concurrency(mp3, args.guilds, not args.fast, opus=False, encode=encode),
+                await bench_concurrency(opus_file, args.guilds, not args.fast, opus=True, encode=encode),
+            ],
+        }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark for the music bot's audio pipeline")
+    parser.add_argument('--guilds', type=int, default=4, help="simultaneous streams for the concurrency run")
+    parser.add_argument('--seconds', type=float, default=5.0, help="length of the generated test audio")
+    parser.add_argument('--trials', type=int, default=5, help="repetitions for the latency measurements")
+    parser.add_argument('--fast', action='store_true', help="read frames as fast as possible instead of every 20 ms")
+    parser.add_argument('--output', help="write the JSON results to this file as well")
+    asyncio.run(main(parser.parse_args()))
@@ -1,15 +1,31 @@
+import asyncio
 import os
 import random
+import time
 import discord
 from discord.ext.commands import Bot
 from discord.ui import Select, View
 from dotenv import load_dotenv
 import string
 
+import dice
+from cipher import LANGUAGES, encipher
+from death_saves import DeathSaveStore
+from fanout import fan_out
+from purge import MessageIndex, purge
+from role_index import RoleIndex
+from command_sync import sync_if_changed
+from shards import shard_options, report_health
+
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 GUILD = os.getenv('DISCORD_GUILD') 
+# Where the IDs of the bot's own posts are kept for /clear-bot-posts
+BOT_MESSAGE_INDEX = os.getenv('BOT_MESSAGE_INDEX', './data/bot_messages.json')
+# Death saves survive restarts; ones nobody touched for DEATH_SAVE_TTL seconds are forgotten
+DEATH_SAVE_DB = os.getenv('DEATH_SAVE_DB', './data/death_saves.sqlite3')
+DEATH_SAVE_TTL = int(os.getenv('DEATH_SAVE_TTL', 7 * 24 * 3600))
 
 intents = discord.Intents.default()
 intents.guilds = True
@@ -17,34 +33,89 @@ intents.members = True
 
 
 
-class MyBot(discord.Client):
+class MyBot(discord.AutoShardedClient):
     def __init__(self, *, intents: discord.Intents):
-        super().__init__(intents=intents)
+        # Shard count and ids come from the environment when run under shards.py
+        # Members are requested over the gateway only when a feature needs them (see role_index)
+        super().__init__(intents=intents, chunk_guilds_at_startup=False, **shard_options())
         self.tree = discord.app_commands.CommandTree(self)
-        self.death_rolls = {}  
+        self.death_saves = DeathSaveStore(DEATH_SAVE_DB, ttl=DEATH_SAVE_TTL)
+        self.role_indexes = {}
+        # Under shards.py each worker sees only its own shards' channels, so it keeps its own file
+        index_path = BOT_MESSAGE_INDEX if self.shard_ids is None else f"{BOT_MESSAGE_INDEX}.shards{self.shard_ids[0]}-{self.shard_ids[-1]}"
+        self.message_index = MessageIndex(index_path)
 
     async def setup_hook(self):
-
-        await self.tree.sync()
+        # Commands are global, so only the process owning shard 0 needs to sync them
+        if self.shard_ids is None or 0 in self.shard_ids:
+            await sync_if_changed(self.tree, self.application_id)
+        asyncio.create_task(report_health(self))
+        asyncio.create_task(self.message_index.flush_periodically())
+        asyncio.create_task(self.death_saves.flush_periodically())
+
+    async def close(self):
+        await self.message_index.close()
+        await self.death_saves.close()
+        await super().close()
+
+    async def role_index(self, guild):
+        # Built from the member cache on first use, then kept current by the member/role events below
+        if guild.id not in self.role_indexes:
+            if not guild.chunked:
+                await guild.chunk()
+            self.role_indexes[guild.id] = RoleIndex.build(guild)
+        return self.role_indexes[guild.id]
 
 client = MyBot(intents=intents)
 
 # Slash command
-@client.tree.command(name="roll", description="Roll a random number between 0 and the given number")
-async def roll(interaction: discord.Interaction, number: int):
-    if number <= 0:
-        await interaction.response.send_message("Please provide a positive number!", ephemeral=True)
+@client.tree.command(name="roll", description="Roll dice, e.g. 20, 8d6+4, 4d6kh3, 2d20kl1+5 or 6d10!")
+async def roll(interaction: discord.Interaction, expression: str):
+    # A bare number is a single die with that many sides, as /roll has always worked
+    if expression.strip().isdigit():
+        expression = f"d{expression.strip()}"
+    try:
+        result = dice.roll(expression)
+    except dice.DiceError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
         return
-    result = random.randint(1, number)
     embed = discord.Embed(
         title="Roll 🎲",
-        description=f"{interaction.user.display_name} rolled: **{result}** on a d{number}",
+        description=f"{interaction.user.display_name} rolled: **{result.total}** on {expression}",
         color=discord.Color.blue()
     )
+    if result.rolls:
+        embed.add_field(name="Dice", value=dice.format_breakdown(result), inline=False)
     embed.set_footer(text="Standard roll")
     await interaction.response.send_message(embed=embed)
 
 
+# Exact odds for a dice expression, optionally of reaching a target (e.g. a DC)
+@client.tree.command(name="odds", description="Show the odds of a dice roll, e.g. 2d20kh1+7 against a DC of 15")
+async def odds(interaction: discord.Interaction, expression: str, target: int = None):
+    if expression.strip().isdigit():
+        expression = f"d{expression.strip()}"
+    try:
+        # Big pools take a moment to convolve, so keep the event loop free
+        distribution = await asyncio.to_thread(dice.distribution, expression)
+    except dice.DiceError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    embed = discord.Embed(
+        title="Odds 📊",
+        description=f"Distribution of {expression}",
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="Mean", value=f"{distribution.mean:.2f}")
+    embed.add_field(name="Range", value=f"{distribution.minimum} – {distribution.maximum}")
+    percentiles = ' · '.join(f"p{p}: {distribution.percentile(p / 100)}" for p in (5, 25, 50, 75, 95))
+    embed.add_field(name="Percentiles", value=percentiles, inline=False)
+    if target is not None:
+        embed.add_field(name=f"Chance of {target} or more", value=f"**{distribution.at_least(target):.1%}**", inline=False)
+    embed.set_footer(text="Exact" if distribution.exact else f"Estimated from {dice.KEEP_SAMPLES:,} simulated rolls")
+    await interaction.response.send_message(embed=embed)
+
+
 # Slash command for Jungle Rest
 @client.tree.command(name="jungle-rest", description="Take a rest in the jungle and receive a surprise!")
 async def jungle_rest(interaction: discord.Interaction):
@@ -71,23 +142,22 @@ async def jungle_rest(interaction: discord.Interaction):
 async def death_roll(interaction: discord.Interaction):
     user = interaction.user
     number = random.randint(1, 20)
-    
-    # Ensure we have a death roll state for the user
-    if user.id not in client.death_rolls:
-        client.death_rolls[user.id] = {"successes": 0, "failures": 0}
-    
+
+    # Death saves are tracked per campaign, i.e. per guild (0 for DMs)
+    key = (interaction.guild_id or 0, user.id)
+
     # Determine the result of the death roll
-    message = selectionLogic(number, user)
+    message = selectionLogic(number, user, key)
 
-    death_state = client.death_rolls[user.id]
+    death_state = client.death_saves.get(key)
 
-        # Check if the player is dead or up after the roll
-    if death_state["failures"] >= 3:
+    # Check if the player is dead or up after the roll
+    if death_state.failures >= 3:
         message = f"{user.mention} has died! 💀 You failed 3 death saves."
-        client.death_rolls[user.id] = {"successes": 0, "failures": 0}
-    if death_state["successes"] >= 3:
+        client.death_saves.reset(key)
+    if death_state.successes >= 3:
         message = f"{user.mention} is stabilized! 😴 You succeeded 3 death saves."
-        client.death_rolls[user.id] = {"successes": 0, "failures": 0}
+        client.death_saves.reset(key)
 
     embed = discord.Embed(
         title="Death roll ☠️",
@@ -100,41 +170,30 @@ async def death_roll(interaction: discord.Interaction):
     embed.set_footer(text=thingy)
     await interaction.response.send_message(embed=embed)
 
-def selectionLogic(n: int, user) -> str:
-    # Access the user's death roll state
-    death_state = client.death_rolls[user.id]
-    
-    # Handle the different roll outcomes
+def selectionLogic(n: int, user, key) -> str:
+    # Handle the different roll outcomes; the store writes the changes behind
     if n == 1:
-        death_state["failures"] += 2
-        return f"Two failed death saves! {user.mention}, you now have {death_state['failures']} failure(s)."
-    
+        death_state = client.death_saves.add(key, failures=2)
+        return f"Two failed death saves! {user.mention}, you now have {death_state.failures} failure(s)."
+
     if n == 20:
-        death_state["successes"] += 3
-        client.death_rolls[user.id] = {"successes": 0, "failures": 0}
+        client.death_saves.reset(key)
         return f"Regain one health, you're up! 🍀🍀🍀 {user.mention}."
-    
+
     if 2 <= n <= 9: # Failure
-        death_state["failures"] += 1
-         # Failure
-        return f"One failed death save! {user.mention}, you now have {death_state['failures']} failure(s)."
-    
+        death_state = client.death_saves.add(key, failures=1)
+        return f"One failed death save! {user.mention}, you now have {death_state.failures} failure(s)."
+
     if 10 <= n <= 19:  # Success
-        death_state["successes"] += 1
-        return f"One succeeded death save! {user.mention}, you now have {death_state['successes']} success(es)."
+        death_state = client.death_saves.add(key, successes=1)
+        return f"One succeeded death save! {user.mention}, you now have {death_state.successes} success(es)."
 
 # Slash command to reset the player's state to "up" manually
 @client.tree.command(name="up", description="Revive yourself if you have 3 success rolls or you somehow figured out how not to die!")
 async def up(interaction: discord.Interaction):
     user = interaction.user
-    
-    if user.id not in client.death_rolls:
-        client.death_rolls[user.id] = {"successes": 0, "failures": 0}
-    
-    death_state = client.death_rolls[user.id]
-    
-    death_state["successes"] = 0
-    death_state["failures"] = 0
+
+    client.death_saves.reset((interaction.guild_id or 0, user.id))
 
     await interaction.response.send_message(f"{user.mention}, you're back up! You're fully revived and ready to fight! 💪")
 
@@ -148,60 +207,48 @@ async def clear_bot_posts(interaction: discord.Interaction):
         await interaction.response.send_message("I don't have permission to delete messages in this channel.", ephemeral=True)
         return
 
-    # Fetch the bot's previous messages
-    deleted_count = 0
-    async for message in channel.history(limit=250):  # Adjust limit if needed
-        if message.author == client.user:
-            await message.delete()
-            deleted_count += 1
+    # Answer within the interaction deadline; the deleting happens afterwards
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    # History is only read once per channel (posts from before the index), and once more after a crash
+    scan = client.message_index.scan_window(channel.id)
+    if scan is not None:
+        client.message_index.extend(channel.id, [
+            message.id async for message in channel.history(**scan) if message.author == client.user
+        ])
+        client.message_index.mark_scanned(channel.id)
+
+    message_ids = client.message_index.get(channel.id)
+    if not message_ids:
+        await interaction.followup.send("No messages from the bot found in this channel.", ephemeral=True)
+        return
+
+    status = await interaction.followup.send(f"Deleting {len(message_ids)} messages made by the bot...", ephemeral=True, wait=True)
+    last_update = [time.monotonic()]
+
+    async def progress(done, total):
+        # Editing the followup is rate limited too, so only every couple of seconds
+        if done < total and time.monotonic() - last_update[0] >= 2:
+            last_update[0] = time.monotonic()
+            await status.edit(content=f"Deleted {done}/{total} messages made by the bot...")
+
+    gone = await purge(channel, message_ids, progress)
+    client.message_index.discard(channel.id, gone)
 
     # Respond to the user
-    if deleted_count > 0:
-        await interaction.response.send_message(f"Deleted {deleted_count} messages made by the bot.", ephemeral=True)
-    else:
-        await interaction.response.send_message("No messages from the bot found in this channel.", ephemeral=True)
+    failed = len(message_ids) - len(gone)
+    await status.edit(content=f"Deleted {len(gone)} messages made by the bot." + (f" {failed} could not be deleted." if failed else ""))
 
 # Gibberish message generator
-def obfuscate_message_full_mapping(message: str) -> str:
-    # Define a consistent character map (a "language translation")
-    char_map = {
-        'a': 'x', 'b': 'y', 'c': 'z', 'd': 'w', 'e': 'v',
-        'f': 'u', 'g': 't', 'h': 's', 'i': 'r', 'j': 'q',
-        'k': 'p', 'l': 'o', 'm': 'n', 'n': 'm', 'o': 'l',
-        'p': 'k', 'q': 'j', 'r': 'i', 's': 'h', 't': 'g',
-        'u': 'f', 'v': 'e', 'w': 'd', 'x': 'c', 'y': 'b', 'z': 'a',
-        'A': 'X', 'B': 'Y', 'C': 'Z', 'D': 'W', 'E': 'V',
-        'F': 'U', 'G': 'T', 'H': 'S', 'I': 'R', 'J': 'Q',
-        'K': 'P', 'L': 'O', 'M': 'N', 'N': 'M', 'O': 'L',
-        'P': 'K', 'Q': 'J', 'R': 'I', 'S': 'H', 'T': 'G',
-        'U': 'F', 'V': 'E', 'W': 'D', 'X': 'C', 'Y': 'B', 'Z': 'A',
-        '0': '9', '1': '8', '2': '7', '3': '6', '4': '5',
-        '5': '4', '6': '3', '7': '2', '8': '1', '9': '0',
-        # Leave punctuation and spaces as is
-        ' ': ' ', '!': '!', '.': '.', ',': ',', '?': '?',
-        ':': ':', ';': ';', '\'': '\'', '\"': '\"', '-': '-',
-    }
-
-    # Obfuscate each character
-    obfuscated_message = ''.join(char_map.get(c, c) for c in message)
-
-    return obfuscated_message
+def obfuscate_message_full_mapping(message: str, language: str = None) -> str:
+    # Each language has its own precompiled alphabet; repeated messages come from a small LRU
+    return encipher(message, language)
 
 # Dropdown select for languages
 class LanguageSelect(Select):
     def __init__(self, content: str):
         # Options for the dropdown (languages)
-        options = [
-            discord.SelectOption(label="Undercommon", value="Undercommon"),
-            discord.SelectOption(label="Celestial", value="Celestial"),
-            discord.SelectOption(label="Giant", value="Giant"),
-            discord.SelectOption(label="Elvish", value="Elvish"),
-            discord.SelectOption(label="Dwarvish", value="Dwarvish"),
-            discord.SelectOption(label="Goblin", value="Goblin"),
-            discord.SelectOption(label="Thieves' Cant", value="Thieves' Cant"),
-            discord.SelectOption(label="Common Sign Language", value="Common Sign Language"),
-            discord.SelectOption(label="Old Omuan", value="Old Omuan"),
-        ]
+        options = [discord.SelectOption(label=language, value=language) for language in LANGUAGES]
         super().__init__(placeholder="Choose a language...", min_values=1, max_values=1, options=options)
         self.content = content  # Store the secret message content
 
@@ -212,48 +259,31 @@ class LanguageSelect(Select):
         language = self.values[0]  # Get selected language
         content = self.content  # Get the message content (the secret message)
 
-        titl = f'{language} Message'
-
-        # Send the message to the entire guild, checking the role of each member
-        for member in interaction.guild.members:
-            print(member)
-            required_role_name = language
-            user_has_role = False
-            print(member.roles)
-            
-            # Check if the user has the "Spiller" role and required language role
-            if not any(role.name == "Spiller" or role.name == "Gm" for role in member.roles):
-                continue
-
-            # Check if the user has the required role
-            for role in member.roles:
-                if role.name.lower() == required_role_name.lower():
-                    user_has_role = True
-                    break
-            
-            # Prepare the message based on role
-            if user_has_role:
-                message = f"**{content}**"  # Show original message if they have the role
-                titl = titl
-            else:
-                titl = "Unknown"
-                message = obfuscate_message_full_mapping(content)  # Show gibberish if they don't have the role
-
-            # Send the personalized message
-            embed = discord.Embed(
-                title=titl,
-                description=message,
-                color=discord.Color.blue() if user_has_role else discord.Color.red()
-            )
-            try:
-                await member.send(embed=embed)  # Send the message via DM to each member
-                print(f'{message} sending to {member.global_name}')
-            except discord.Forbidden:
-                # Handle case where DMs are disabled for a user
-                print(f"Couldn't DM {member.name}, they may have DMs disabled.")
-        
-        # Optionally send a follow-up message
-        await interaction.followup.send("The message has been sent to everyone in the guild (via DM).")
+        # Players and GMs who speak the language get the original, the rest get gibberish
+        guild = interaction.guild
+        readers, others = (await client.role_index(guild)).route(language)
+        reader_embed = discord.Embed(
+            title=f'{language} Message',
+            description=f"**{content}**",
+            color=discord.Color.blue()
+        )
+        other_embed = discord.Embed(
+            title="Unknown",
+            description=obfuscate_message_full_mapping(content, language),
+            color=discord.Color.red()
+        )
+
+        messages = []
+        for member_ids, embed in ((readers, reader_embed), (others, other_embed)):
+            for member_id in member_ids:
+                member = guild.get_member(member_id)
+                if member is not None:
+                    messages.append((member, embed))
+
+        report = await fan_out(messages)
+
+        # Report who got it, and who couldn't be reached (e.g. DMs disabled)
+        await interaction.followup.send(f"The message has been sent via DM.\n{report.summary()}", ephemeral=True)
 
 
 # Command to post a secret message
@@ -268,6 +298,49 @@ async def reveal_message(interaction: discord.Interaction, content: str):
     await interaction.response.send_message("Choose a language to send the message in:", view=view)
 
 
+# Remember what the bot posts so /clear-bot-posts needn't scan history
+@client.event
+async def on_message(message):
+    if message.author == client.user and message.guild is not None:
+        client.message_index.add(message.channel.id, message.id)
+
+
+# Keep the role indexes in step with the guilds
+@client.event
+async def on_member_join(member):
+    if member.guild.id in client.role_indexes:
+        client.role_indexes[member.guild.id].add_member(member)
+
+@client.event
+async def on_member_remove(member):
+    if member.guild.id in client.role_indexes:
+        client.role_indexes[member.guild.id].remove_member(member.id)
+
+@client.event
+async def on_member_update(before, after):
+    if after.guild.id in client.role_indexes and before.roles != after.roles:
+        client.role_indexes[after.guild.id].update_member(before, after)
+
+@client.event
+async def on_guild_role_create(role):
+    if role.guild.id in client.role_indexes:
+        client.role_indexes[role.guild.id].add_role(role)
+
+@client.event
+async def on_guild_role_delete(role):
+    if role.guild.id in client.role_indexes:
+        client.role_indexes[role.guild.id].remove_role(role.id)
+
+@client.event
+async def on_guild_role_update(before, after):
+    if after.guild.id in client.role_indexes and before.name != after.name:
+        client.role_indexes[after.guild.id].rename_role(after)
+
+@client.event
+async def on_guild_remove(guild):
+    client.role_indexes.pop(guild.id, None)
+
+
 @client.event
 async def on_ready():
     for guild in client.guilds:
@@ -276,13 +349,12 @@ async def on_ready():
                 f'{client.user} is connected to the following guild:\n'
                 f'{guild.name} (id: {guild.id})'
             )
-            members = [member async for member in guild.fetch_members()]
-            print(f'Members in {guild.name}: {len(members)}')
-            for member in members:
-                print(f'- {member.name}#{member.discriminator}')
-
+            print(f'Members in {guild.name}: {guild.member_count}')
+            # Load the members and role index in the background, ready for the first secret message
+            asyncio.create_task(client.role_index(guild))
             break
     else:
         print(f"{client.user} is not connected to the specified guild: {GUILD}")
 
-client.run(TOKEN)
+if __name__ == "__main__":
+    client.run(TOKEN)
@@ -0,0 +1,61 @@
+"""Gibberish alphabets for the secret-message languages.
+
+Every language gets its own letter and digit substitution, derived deterministically from its name
+so it is stable across restarts, and compiled into a ``str.translate`` table once at import.
+Punctuation and whitespace pass through unchanged, so the gibberish keeps the message's shape.
+"""
+import hashlib
+import random
+import string
+from functools import lru_cache
+
+LANGUAGES = (
+    "Undercommon",
+    "Celestial",
+    "Giant",
+    "Elvish",
+    "Dwarvish",
+    "Goblin",
+    "Thieves' Cant",
+    "Common Sign Language",
+    "Old Omuan",
+)
+
+# The original mapping, used when no language is given: (nearly) the alphabet and digits reversed
+DEFAULT_TABLE = str.maketrans(
+    string.ascii_lowercase + string.ascii_uppercase + string.digits,
+    "xyzwvutsrqponmlkjihgfedcba" + "XYZWVUTSRQPONMLKJIHGFEDCBA" + string.digits[::-1],
+)
+
+
+def compile_table(language):
+    """A substitution table seeded from the language name; upper case follows lower case."""
+    seed = int.from_bytes(hashlib.sha256(language.encode()).digest()[:8], 'big')
+    rng = random.Random(seed)
+    letters = list(string.ascii_lowercase)
+    digits = list(string.digits)
+    rng.shuffle(letters)
+    rng.shuffle(digits)
+    letters = ''.join(letters)
+    return str.maketrans(
+        string.ascii_lowercase + string.ascii_uppercase + string.digits,
+        letters + letters.upper() + ''.join(digits),
+    )
+
+
+TABLES = {language: compile_table(language) for language in LANGUAGES}
+
+
+def table_for(language):
+    if language is None:
+        return DEFAULT_TABLE
+    table = TABLES.get(language)
+    if table is None:
+        table = TABLES[language] = compile_table(language)
+    return table
+
+
+@lru_cache(maxsize=128)
+def encipher(message, language=None):
+    """Render ``message`` as gibberish in ``language`` (the original mapping when None)."""
+    return message.translate(table_for(language))
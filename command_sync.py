@@ -0,0 +1,47 @@
+"""Skip the global command sync when the command tree hasn't changed since the last one.
+
+``tree.sync()`` is a rate-limited bulk upsert, yet on most boots nothing changed. The commands'
+sync payload is hashed together with the application ID, and the sync only runs when the hash
+differs from the one stored for that application in COMMAND_HASH_FILE (or FORCE_COMMAND_SYNC=1).
+"""
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger("command_sync")
+
+COMMAND_HASH_FILE = os.getenv('COMMAND_HASH_FILE', './data/command_tree.json')
+
+
+def tree_hash(tree, application_id):
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: (c['name'], c.get('type', 1)))
+    data = json.dumps({'application_id': application_id, 'commands': payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def load_hashes(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+async def sync_if_changed(tree, application_id, path=COMMAND_HASH_FILE):
+    """Sync ``tree`` globally unless its hash matches the stored one; return whether it synced."""
+    digest = tree_hash(tree, application_id)
+    hashes = load_hashes(path)
+    if hashes.get(str(application_id)) == digest and os.getenv('FORCE_COMMAND_SYNC') != '1':
+        logger.info("Command tree unchanged, skipping sync")
+        return False
+    await tree.sync()
+    # Only remember the hash once Discord has accepted the commands
+    hashes[str(application_id)] = digest
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(hashes, f)
+    os.replace(temp_path, path)
+    logger.info("Command tree changed, synced")
+    return True
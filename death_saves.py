@@ -0,0 +1,150 @@
+"""Death-save state per (guild, user), kept in memory and written behind to SQLite.
+
+Commands read and mutate the in-memory records and return immediately; changed keys are
+collected and flushed in one transaction every few seconds off the event loop. SQLite's journal
+makes each flush atomic, so after a crash the store comes back as of the last flush. A flush that
+fails (e.g. the database is locked) keeps its keys pending for the next one. Records untouched
+for ``ttl`` seconds are dropped, in memory and on disk; the delete only applies to the row this
+store saw, so a process holding a stale copy (another shard's guild, say) can't drop live state.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger("death_saves")
+
+
+class DeathSave:
+    __slots__ = ('successes', 'failures', 'updated')
+
+    def __init__(self, successes=0, failures=0, updated=None):
+        self.successes = successes
+        self.failures = failures
+        self.updated = updated or time.time()
+
+
+class DeathSaveStore:
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.records = {}
+        self.dirty = set()
+        self.expired = {}  # key -> the updated time of the record expire() dropped
+        self.writing = None  # the write-behind task in flight, which close() waits for
+        self.closed = False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS death_saves ("
+            "guild_id INTEGER, user_id INTEGER, successes INTEGER, failures INTEGER, updated REAL, "
+            "PRIMARY KEY (guild_id, user_id))"
+        )
+        self.load()
+
+    def load(self):
+        cutoff = time.time() - self.ttl
+        with self.db:
+            self.db.execute("DELETE FROM death_saves WHERE updated < ?", (cutoff,))
+        for guild_id, user_id, successes, failures, updated in self.db.execute("SELECT * FROM death_saves"):
+            self.records[(guild_id, user_id)] = DeathSave(successes, failures, updated)
+
+    def get(self, key):
+        """The record for ``(guild_id, user_id)``; a fresh one is not stored until it changes."""
+        return self.records.get(key) or DeathSave()
+
+    def add(self, key, successes=0, failures=0):
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = DeathSave()
+        record.successes += successes
+        record.failures += failures
+        record.updated = time.time()
+        self.dirty.add(key)
+        return record
+
+    def reset(self, key):
+        # A cleared record is the same as no record, so it's simply deleted
+        if self.records.pop(key, None) is not None:
+            self.dirty.add(key)
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [key for key, record in self.records.items() if record.updated < cutoff]:
+            self.expired[key] = self.records.pop(key).updated
+            self.dirty.add(key)
+
+    def take_changes(self):
+        """Snapshot the pending writes and deletes, so the flush can run without touching live state."""
+        keys, self.dirty = self.dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            record = self.records.get(key)
+            seen = self.expired.pop(key, None)
+            if record is None:
+                # An expiry only deletes the row as it was seen; a reset deletes whatever is there
+                deletes.append((*key, seen))
+            else:
+                upserts.append((*key, record.successes, record.failures, record.updated))
+        return keys, upserts, deletes
+
+    def restore(self, keys, deletes):
+        """Put a failed flush's changes back to be re-read by the next one."""
+        self.dirty |= keys
+        for guild_id, user_id, seen in deletes:
+            if seen is not None and (guild_id, user_id) not in self.records:
+                self.expired.setdefault((guild_id, user_id), seen)
+
+    def write(self, upserts, deletes):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO death_saves VALUES (?, ?, ?, ?, ?)", upserts)
+            self.db.executemany(
+                "DELETE FROM death_saves WHERE guild_id = ? AND user_id = ? AND updated <= COALESCE(?, updated)",
+                deletes,
+            )
+
+    def flush(self):
+        keys, upserts, deletes = self.take_changes()
+        if upserts or deletes:
+            try:
+                self.write(upserts, deletes)
+            except Exception:
+                self.restore(keys, deletes)
+                raise
+
+    async def write_behind(self, keys, upserts, deletes):
+        try:
+            await asyncio.to_thread(self.write, upserts, deletes)
+        except Exception:
+            # The snapshot is stale by the next flush, so only the keys go back; it re-reads their records
+            self.restore(keys, deletes)
+            raise
+
+    async def flush_periodically(self, interval=5, expire_every=3600):
+        last_expire = time.monotonic()
+        while not self.closed:
+            await asyncio.sleep(interval)
+            if self.closed:
+                return
+            if time.monotonic() - last_expire >= expire_every:
+                self.expire()
+                last_expire = time.monotonic()
+            keys, upserts, deletes = self.take_changes()
+            if not (upserts or deletes):
+                continue
+            # A task of its own, so cancelling this loop can't abandon a write close() has to wait for
+            self.writing = asyncio.ensure_future(self.write_behind(keys, upserts, deletes))
+            try:
+                await asyncio.shield(self.writing)
+            except Exception as e:
+                logger.error(f"Failed to write death saves, retrying at the next flush: {e}")
+
+    async def close(self):
+        """Wait for a write in flight, write what is still pending and close the database."""
+        self.closed = True
+        if self.writing is not None and not self.writing.done():
+            await asyncio.wait([self.writing])
+        self.flush()
+        self.db.close()
@@ -0,0 +1,488 @@
+"""Dice notation: parse once, roll many times.
+
+Supported: ``NdS`` (N defaults to 1), ``+``/``-`` with other dice or constants, keep/drop
+modifiers ``khN``, ``klN``, ``kN`` (keep highest), ``dhN``, ``dlN``, and exploding dice ``NdS!``
+(a die showing S is rolled again and added, up to MAX_EXPLOSIONS times). Examples: ``8d6+4``,
+``4d6kh3``, ``2d20kl1+5``, ``6d10!``.
+
+Expressions compile to a cached tuple of terms; pools of VECTOR_THRESHOLD dice or more are rolled
+with NumPy in one batch.
+"""
+import math
+import random
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+MAX_DICE = 10000
+MAX_SIDES = 10000
+MAX_EXPLOSIONS = 100
+VECTOR_THRESHOLD = 32
+
+TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<dice>(?P<count>\d*)d(?P<sides>\d+)(?P<explode>!)?(?:(?P<modifier>kh|kl|k|dh|dl)(?P<amount>\d+))?)"
+    r"|(?P<number>\d+)|(?P<op>[+-]))\s*"
+)
+
+rng = np.random.default_rng()
+
+
+class DiceError(ValueError):
+    """Raised for malformed or oversized expressions; the message is safe to show to users."""
+
+
+class DiceTerm:
+    __slots__ = ('sign', 'count', 'sides', 'keep', 'keep_highest', 'explode')
+
+    def __init__(self, sign, count, sides, keep=None, keep_highest=True, explode=False):
+        self.sign = sign
+        self.count = count
+        self.sides = sides
+        self.keep = keep
+        self.keep_highest = keep_highest
+        self.explode = explode
+
+    def __str__(self):
+        text = f"{self.count}d{self.sides}" + ("!" if self.explode else "")
+        if self.keep is not None:
+            text += f"{'kh' if self.keep_highest else 'kl'}{self.keep}"
+        return text
+
+
+class ConstantTerm:
+    __slots__ = ('sign', 'value')
+
+    def __init__(self, sign, value):
+        self.sign = sign
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+
+def make_dice_term(sign, match):
+    count = int(match['count'] or 1)
+    sides = int(match['sides'])
+    if not 1 <= count <= MAX_DICE:
+        raise DiceError(f"You can roll between 1 and {MAX_DICE} dice at once.")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceError(f"Dice need between 1 and {MAX_SIDES} sides.")
+    explode = bool(match['explode'])
+    if explode and sides == 1:
+        raise DiceError("A d1 can't explode.")
+    keep, keep_highest = None, True
+    if match['modifier']:
+        amount = int(match['amount'])
+        if amount > count:
+            raise DiceError(f"Can't keep or drop {amount} of {count} dice.")
+        modifier = match['modifier']
+        # Dropping the lowest N is keeping the highest count-N, and vice versa
+        keep = amount if modifier.startswith('k') else count - amount
+        keep_highest = modifier in ('k', 'kh', 'dl')
+    return DiceTerm(sign, count, sides, keep, keep_highest, explode)
+
+
+@lru_cache(maxsize=256)
+def compile_expression(text):
+    """Parse ``text`` into a tuple of terms; cached, so repeated expressions skip the parser."""
+    expression = text.strip().lower()
+    if not expression:
+        raise DiceError("Empty dice expression.")
+    terms = []
+    sign = 1
+    expect_term = True
+    after_op = False
+    total_dice = 0
+    position = 0
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if match is None:
+            raise DiceError(f"Couldn't understand `{expression[position:]}`.")
+        position = match.end()
+        if match['op']:
+            if after_op:
+                raise DiceError("Two operators in a row.")
+            sign = 1 if match['op'] == '+' else -1
+            expect_term = after_op = True
+            continue
+        if not expect_term:
+            raise DiceError("Missing `+` or `-` between terms.")
+        if match['dice']:
+            term = make_dice_term(sign, match)
+            total_dice += term.count
+            if total_dice > MAX_DICE:
+                raise DiceError(f"You can roll at most {MAX_DICE} dice at once.")
+        else:
+            term = ConstantTerm(sign, int(match['number']))
+        terms.append(term)
+        expect_term = after_op = False
+    if expect_term:
+        raise DiceError("The expression ends with an operator.")
+    return tuple(terms)
+
+
+class TermRoll:
+    """Each die's value (explosions included) and which dice were kept."""
+    __slots__ = ('term', 'values', 'kept', 'exploded', 'total')
+
+    def __init__(self, term, values, kept, exploded, total):
+        self.term = term
+        self.values = values
+        self.kept = kept
+        self.exploded = exploded
+        self.total = total
+
+
+class Roll:
+    __slots__ = ('expression', 'rolls', 'total')
+
+    def __init__(self, expression, rolls, total):
+        self.expression = expression
+        self.rolls = rolls
+        self.total = total
+
+
+def roll_small(term):
+    values, exploded = [], []
+    for _ in range(term.count):
+        value = face = random.randint(1, term.sides)
+        explosions = 0
+        while term.explode and face == term.sides and explosions < MAX_EXPLOSIONS:
+            face = random.randint(1, term.sides)
+            value += face
+            explosions += 1
+        values.append(value)
+        exploded.append(explosions > 0)
+    kept = [True] * term.count
+    if term.keep is not None:
+        order = sorted(range(term.count), key=values.__getitem__, reverse=term.keep_highest)
+        kept = [False] * term.count
+        for i in order[:term.keep]:
+            kept[i] = True
+    total = sum(value for value, keep in zip(values, kept) if keep)
+    return TermRoll(term, values, kept, exploded, total)
+
+
+def roll_large(term):
+    values = rng.integers(1, term.sides + 1, size=term.count)
+    exploded = np.zeros(term.count, dtype=bool)
+    if term.explode:
+        live = np.flatnonzero(values == term.sides)
+        exploded[live] = True
+        for _ in range(MAX_EXPLOSIONS):
+            if not live.size:
+                break
+            faces = rng.integers(1, term.sides + 1, size=live.size)
+            values[live] += faces
+            live = live[faces == term.sides]
+    kept = np.ones(term.count, dtype=bool)
+    if term.keep is not None:
+        order = np.argsort(values, kind='stable')
+        # order[-0:] would be every die, so slice from the front for the highest too
+        chosen = order[term.count - term.keep:] if term.keep_highest else order[:term.keep]
+        kept[:] = False
+        kept[chosen] = True
+    return TermRoll(term, values, kept, exploded, int(values[kept].sum()))
+
+
+def roll(text):
+    """Roll a dice expression; raises DiceError for bad input."""
+    rolls = []
+    total = 0
+    for term in compile_expression(text):
+        if isinstance(term, ConstantTerm):
+            total += term.sign * term.value
+            continue
+        term_roll = roll_large(term) if term.count >= VECTOR_THRESHOLD else roll_small(term)
+        rolls.append(term_roll)
+        total += term.sign * term_roll.total
+    return Roll(text, rolls, total)
+
+
+def format_term(term_roll, max_dice=20):
+    """One term's dice: every die for small pools, face counts or a prefix for large ones."""
+    term = term_roll.term
+    values = term_roll.values
+    if len(values) <= max_dice:
+        dice = []
+        for value, kept, exploded in zip(values, term_roll.kept, term_roll.exploded):
+            text = f"{value}!" if exploded else str(value)
+            dice.append(text if kept else f"~~{text}~~")
+        shown = ', '.join(dice)
+    elif term.sides <= 20 and not term.explode and term.keep is None:
+        # A histogram says more about 1000d6 than its first few dice
+        counts = np.bincount(np.asarray(values), minlength=term.sides + 1)
+        shown = ' · '.join(f"{face}×{counts[face]}" for face in range(1, term.sides + 1) if counts[face])
+    elif term.keep is None:
+        first = ', '.join(str(value) for value in values[:max_dice])
+        shown = f"{first}, … ({len(values) - max_dice} more)"
+    else:
+        values = np.asarray(values)
+        kept = np.asarray(term_roll.kept)
+        top = ', '.join(str(value) for value in np.sort(values[kept])[::-1][:max_dice]) or 'none'
+        shown = f"kept {top}, … ({len(values) - min(max_dice, int(kept.sum()))} more)"
+    sign = '-' if term.sign < 0 else ''
+    return f"{sign}{term}: [{shown}] = {term_roll.total}"
+
+
+def format_breakdown(result, limit=1024):
+    """Per-die breakdown that fits in an embed field of ``limit`` characters."""
+    lines = [format_term(term_roll) for term_roll in result.rolls]
+    text = '\n'.join(lines)
+    if len(text) > limit:
+        text = text[:limit - 1].rsplit('\n', 1)[0] if '\n' in text[:limit - 1] else text[:limit - 1]
+        text += '…'
+    return text
+
+
+# Exact distributions for /odds. A distribution is (lowest total, probabilities of each total from there).
+
+MAX_SUPPORT = 2_000_000
+# Keep-highest/lowest is solved exactly while the order-statistics DP stays this small;
+# larger pools are estimated by sampling instead, so /odds time stays bounded
+MAX_KEEP_STEPS = 50_000
+KEEP_SAMPLES = 20_000
+# Total size of the distributions kept for repeat /odds queries; one 10000d199 alone is ~32 MB
+DISTRIBUTION_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def die_distribution(sides, explode):
+    """(faces, probabilities) of one die, explosions truncated once they become negligible."""
+    if not explode:
+        return np.arange(1, sides + 1), np.full(sides, 1 / sides)
+    faces, probs = [], []
+    for depth in range(MAX_EXPLOSIONS + 1):
+        weight = sides ** -(depth + 1)
+        last = depth == MAX_EXPLOSIONS or weight < 1e-15
+        # A die stops on anything but the top face, or on the top face once it can't explode again
+        top = sides + 1 if last else sides
+        faces.extend(sides * depth + face for face in range(1, top))
+        probs.extend([weight] * (top - 1))
+        if last:
+            break
+    probs = np.array(probs)
+    return np.array(faces), probs / probs.sum()
+
+
+def to_dense(faces, probs):
+    dense = np.zeros(faces.max() - faces.min() + 1)
+    np.add.at(dense, faces - faces.min(), probs)
+    return int(faces.min()), dense
+
+
+def convolve(a, b):
+    if min(len(a), len(b)) < 64:
+        return np.convolve(a, b)
+    size = len(a) + len(b) - 1
+    n = 1 << (size - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, n) * np.fft.rfft(b, n), n)[:size]
+    return np.clip(result, 0, None)
+
+
+def pool_power(dense, count):
+    """Distribution of the sum of ``count`` dice, as one FFT power rather than count convolutions."""
+    size = count * (len(dense) - 1) + 1
+    if count <= 4 or size < 256:
+        result = dense
+        for _ in range(count - 1):
+            result = np.convolve(result, dense)
+        return result
+    n = 1 << (size - 1).bit_length()
+    result = np.clip(np.fft.irfft(np.fft.rfft(dense, n) ** count, n)[:size], 0, None)
+    return result / result.sum()
+
+
+def log_binomial_pmf(n, q):
+    """Binomial(n, q) probabilities for 0..n, computed in log space so large n doesn't overflow."""
+    m = np.arange(n + 1)
+    if q >= 1:
+        pmf = np.zeros(n + 1)
+        pmf[n] = 1.0
+        return pmf
+    if q <= 0:
+        pmf = np.zeros(n + 1)
+        pmf[0] = 1.0
+        return pmf
+    log_comb = np.array([math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1) for k in m])
+    return np.exp(log_comb + m * math.log(q) + (n - m) * math.log1p(-q))
+
+
+def keep_distribution(term, faces, probs):
+    """Exact distribution of the sum of the kept dice, walking faces from best to worst.
+
+    State: how many dice have been assigned a face so far (below ``keep``) and the kept sum. Of the
+    remaining dice, the number showing the current face is binomial given they show no better face.
+    """
+    order = np.argsort(faces)
+    if term.keep_highest:
+        order = order[::-1]
+    faces, probs = faces[order], probs[order]
+    keep, count = term.keep, term.count
+    width = keep * int(faces.max()) + 1
+    states = {0: np.zeros(width)}
+    states[0][0] = 1.0
+    finished = np.zeros(width)
+    remaining = 1.0
+    for face, p in zip(faces, probs):
+        q = 1.0 if remaining <= p else p / remaining
+        remaining -= p
+        next_states = {}
+        for assigned, sums in states.items():
+            pmf = log_binomial_pmf(count - assigned, q)
+            for m in np.flatnonzero(pmf > 1e-18):
+                taken = min(m, keep - assigned)
+                shifted = np.zeros(width)
+                shift = taken * int(face)
+                shifted[shift:] = sums[:width - shift] * pmf[m]
+                if assigned + m >= keep:
+                    finished += shifted
+                else:
+                    next_states[assigned + m] = next_states.get(assigned + m, 0) + shifted
+        states = next_states
+        if not states:
+            break
+    nonzero = np.flatnonzero(finished)
+    return int(nonzero[0]), finished[nonzero[0]:nonzero[-1] + 1] / finished.sum()
+
+
+def sample_keep_distribution(term):
+    """Estimate a large keep term's distribution from KEEP_SAMPLES vectorized rolls."""
+    rows = max(1, min(KEEP_SAMPLES, 2_000_000 // term.count))
+    values = rng.integers(1, term.sides + 1, size=(rows, term.count))
+    if term.explode:
+        live = values == term.sides
+        for _ in range(MAX_EXPLOSIONS):
+            if not live.any():
+                break
+            faces = rng.integers(1, term.sides + 1, size=int(live.sum()))
+            values[live] += faces
+            live[live] = faces == term.sides
+    values.sort(axis=1)
+    kept = values[:, term.count - term.keep:] if term.keep_highest else values[:, :term.keep]
+    totals = kept.sum(axis=1)
+    counts = np.bincount(totals - totals.min())
+    return int(totals.min()), counts / counts.sum()
+
+
+def term_distribution(term):
+    """(offset, probabilities, exact) for one term, before its sign is applied."""
+    faces, probs = die_distribution(term.sides, term.explode)
+    if term.keep is not None and term.keep < term.count:
+        if len(faces) * term.keep * term.count > MAX_KEEP_STEPS:
+            offset, dense = sample_keep_distribution(term)
+            return offset, dense, False
+        offset, dense = keep_distribution(term, faces, probs)
+        return offset, dense, True
+    if term.count * (int(faces.max()) - int(faces.min())) + 1 > MAX_SUPPORT:
+        raise DiceError("That roll has too many possible totals to analyse.")
+    offset, dense = to_dense(faces, probs)
+    return offset * term.count, pool_power(dense, term.count), True
+
+
+class Distribution:
+    __slots__ = ('offset', 'probabilities', 'exact', 'cumulative')
+
+    def __init__(self, offset, probabilities, exact):
+        self.offset = offset
+        self.probabilities = probabilities
+        self.exact = exact
+        self.cumulative = np.cumsum(probabilities)
+
+    @property
+    def mean(self):
+        return float(np.dot(np.arange(len(self.probabilities)) + self.offset, self.probabilities))
+
+    @property
+    def minimum(self):
+        return self.offset
+
+    @property
+    def maximum(self):
+        return self.offset + len(self.probabilities) - 1
+
+    def percentile(self, fraction):
+        """Smallest total reached with at least ``fraction`` probability."""
+        return self.offset + int(np.searchsorted(self.cumulative, fraction - 1e-12))
+
+    def at_least(self, target):
+        index = target - self.offset
+        if index <= 0:
+            return 1.0
+        if index >= len(self.probabilities):
+            return 0.0
+        return float(max(0.0, 1.0 - self.cumulative[index - 1]))
+
+    @property
+    def nbytes(self):
+        return self.probabilities.nbytes + self.cumulative.nbytes
+
+
+class DistributionCache:
+    """Least-recently-used distributions by expression, bounded by their total size in bytes.
+
+    /odds computes distributions in worker threads, so lookups and stores take a lock.
+    """
+
+    def __init__(self, max_bytes=DISTRIBUTION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # expression -> Distribution, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, text):
+        with self.lock:
+            odds = self.entries.get(text)
+            if odds is not None:
+                self.entries.move_to_end(text)
+            return odds
+
+    def store(self, text, odds):
+        with self.lock:
+            old = self.entries.pop(text, None)
+            if old is not None:
+                self.size -= old.nbytes
+            if odds.nbytes > self.max_bytes:
+                return
+            self.entries[text] = odds
+            self.size += odds.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+distribution_cache = DistributionCache()
+
+
+def distribution(text):
+    """The exact (or, for huge keep pools, sampled) distribution of a dice expression's total."""
+    odds = distribution_cache.get(text)
+    if odds is None:
+        odds = compute_distribution(text)
+        distribution_cache.store(text, odds)
+    return odds
+
+
+def compute_distribution(text):
+    offset, probabilities, exact = 0, np.ones(1), True
+    for term in compile_expression(text):
+        if isinstance(term, ConstantTerm):
+            offset += term.sign * term.value
+            continue
+        term_offset, term_probabilities, term_exact = term_distribution(term)
+        if term.sign < 0:
+            term_offset = -(term_offset + len(term_probabilities) - 1)
+            term_probabilities = term_probabilities[::-1]
+        if len(probabilities) + len(term_probabilities) > MAX_SUPPORT:
+            raise DiceError("That roll has too many possible totals to analyse.")
+        offset += term_offset
+        probabilities = convolve(probabilities, term_probabilities)
+        exact = exact and term_exact
+    return Distribution(offset, probabilities / probabilities.sum(), exact)
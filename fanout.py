@@ -0,0 +1,80 @@
+"""Concurrent DM delivery for bot.py's secret messages.
+
+discord.py already queues requests per rate-limit bucket and waits out 429s it is told about, but
+sending one DM at a time leaves every other bucket idle. ``fan_out`` keeps up to ``concurrency``
+deliveries in flight (each DM channel is its own bucket), retries the 429/5xx responses discord.py
+gives up on with exponential backoff, and returns a report instead of printing per member.
+"""
+import asyncio
+import random
+
+import discord
+
+
+class DeliveryReport:
+    """Who got the message, who has DMs closed, and who could not be reached for other reasons."""
+    __slots__ = ('delivered', 'forbidden', 'failed', 'elapsed')
+
+    def __init__(self):
+        self.delivered = []
+        self.forbidden = []
+        self.failed = []
+        self.elapsed = 0.0
+
+    def __len__(self):
+        return len(self.delivered) + len(self.forbidden) + len(self.failed)
+
+    def summary(self, limit=10):
+        lines = [f"Delivered to {len(self.delivered)} of {len(self)} members in {self.elapsed:.1f}s."]
+        for label, members in (("DMs closed", self.forbidden), ("Failed", self.failed)):
+            if members:
+                names = ', '.join(member.display_name for member in members[:limit])
+                more = f" and {len(members) - limit} more" if len(members) > limit else ""
+                lines.append(f"{label}: {names}{more}")
+        return '\n'.join(lines)
+
+
+def is_retryable(error):
+    return isinstance(error, discord.RateLimited) or (
+        isinstance(error, discord.HTTPException) and (error.status == 429 or error.status >= 500)
+    )
+
+
+async def with_retries(call, retries=3, base_delay=1.0):
+    """Await ``call()``, retrying 429/5xx responses with exponential backoff and jitter."""
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except (discord.RateLimited, discord.HTTPException) as e:
+            if not is_retryable(e) or attempt == retries:
+                raise
+            delay = getattr(e, 'retry_after', None) or base_delay * 2 ** attempt
+            await asyncio.sleep(delay * random.uniform(1.0, 1.25))
+
+
+async def deliver(member, embed, retries, base_delay):
+    """Send one DM; return 'delivered', 'forbidden' or 'failed'."""
+    try:
+        await with_retries(lambda: member.send(embed=embed), retries, base_delay)
+        return 'delivered'
+    except discord.Forbidden:
+        return 'forbidden'
+    except (discord.RateLimited, discord.HTTPException):
+        return 'failed'
+
+
+async def fan_out(messages, concurrency=10, retries=3, base_delay=1.0):
+    """Send ``(member, embed)`` pairs concurrently, at most ``concurrency`` at a time."""
+    report = DeliveryReport()
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def send(member, embed):
+        async with semaphore:
+            outcome = await deliver(member, embed, retries, base_delay)
+        getattr(report, outcome).append(member)
+
+    await asyncio.gather(*(send(member, embed) for member, embed in messages))
+    report.elapsed = loop.time() - start
+    return report
@@ -0,0 +1,364 @@
+"""Offline load test for the slash commands of bot.py and testbot.py.
+
+Calls the ``@client.tree.command`` handlers directly with in-process stand-ins for the
+interaction, guild, member, channel and voice objects. Every REST call those objects would make
+goes through a stub that only sleeps, so no Discord connection (or network) is needed. For each
+command it fires ``--requests`` interactions, ``--concurrency`` at a time, and reports
+throughput, p50/p99 latency to the first response and to completion, event-loop lag and memory:
+
+    python loadtest.py --requests 5000 --concurrency 1000 --output load.json
+
+``--voice`` also runs /play-url against locally generated audio (needs ffmpeg).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+# The bots persist state next to the working directory; keep a load test's state out of it
+STATE_DIR = tempfile.mkdtemp(prefix='loadtest-')
+os.environ.setdefault('DEATH_SAVE_DB', os.path.join(STATE_DIR, 'death_saves.sqlite3'))
+os.environ.setdefault('BOT_MESSAGE_INDEX', os.path.join(STATE_DIR, 'bot_messages.json'))
+os.environ.setdefault('COMMAND_HASH_FILE', os.path.join(STATE_DIR, 'command_tree.json'))
+os.environ.setdefault('TRANSCODE_CACHE_DIR', os.path.join(STATE_DIR, 'transcoded'))
+
+import discord
+
+import bot
+import testbot
+from benchmark import FakeVoiceClient, generate_audio, summarize
+
+
+class HTTPStub:
+    """Counts the REST calls the fakes make and delays each by a simulated round trip."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = {}
+
+    async def request(self, route):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+
+class FakePermissions:
+    manage_messages = True
+
+
+class FakeVoiceChannel:
+    def __init__(self, http):
+        self.http = http
+
+    async def connect(self):
+        await self.http.request('GATEWAY voice connect')
+        return FakeVoiceClient(realtime=True)
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeMember:
+    def __init__(self, member_id, roles, http, voice=None):
+        self.id = member_id
+        self.name = self.display_name = self.global_name = f"member{member_id}"
+        self.mention = f"<@{member_id}>"
+        self.roles = roles
+        self.voice = voice
+        self.http = http
+
+    async def send(self, embed=None, **kwargs):
+        await self.http.request('POST /users/@me/channels')
+        await self.http.request('POST /channels/{dm}/messages')
+
+
+class FakeMessage:
+    def __init__(self, message_id, author, http):
+        self.id = message_id
+        self.author = author
+        self.http = http
+
+    async def edit(self, **kwargs):
+        await self.http.request('PATCH /webhooks/{token}/messages/{id}')
+
+    async def delete(self):
+        await self.http.request('DELETE /channels/{id}/messages/{id}')
+
+
+class FakeChannel:
+    def __init__(self, channel_id, http, bot_messages=50):
+        self.id = channel_id
+        self.http = http
+        # Recent snowflakes, so /clear-bot-posts takes the bulk-delete path
+        now = discord.utils.utcnow()
+        self.message_ids = [discord.utils.time_snowflake(now) - i for i in range(bot_messages)]
+
+    def permissions_for(self, member):
+        return FakePermissions()
+
+    async def history(self, limit=100, after=None, before=None):
+        await self.http.request('GET /channels/{id}/messages')
+        message_ids = self.message_ids
+        if after is not None:
+            message_ids = [m for m in message_ids if m > discord.utils.time_snowflake(after, high=True)]
+        if before is not None:
+            message_ids = [m for m in message_ids if m < discord.utils.time_snowflake(before, high=False)]
+        for message_id in message_ids[:limit]:
+            yield FakeMessage(message_id, bot.client.user, self.http)
+
+    async def delete_messages(self, messages):
+        await self.http.request('POST /channels/{id}/messages/bulk-delete')
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, None, self.http)
+
+
+class FakeGuild:
+    def __init__(self, guild_id, members, roles, http):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self.members = members
+        self.roles = roles
+        self.me = members[0]
+        self.chunked = True
+        self.member_count = len(members)
+        self._members = {member.id: member for member in members}
+        self.http = http
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    async def chunk(self):
+        await self.http.request('GATEWAY request_guild_members')
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    def is_done(self):
+        return self.interaction.responded is not None
+
+    async def _respond(self):
+        if self.interaction.responded is not None:
+            raise discord.InteractionResponded(self.interaction)
+        self.interaction.responded = time.perf_counter()
+        await self.interaction.http.request('POST /interactions/{id}/{token}/callback')
+
+    async def send_message(self, *args, **kwargs):
+        await self._respond()
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+    async def edit_message(self, **kwargs):
+        await self._respond()
+
+    async def send_modal(self, modal):
+        await self._respond()
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, *args, wait=False, **kwargs):
+        await self.interaction.http.request('POST /webhooks/{id}/{token}')
+        return FakeMessage(0, None, self.interaction.http)
+
+
+class FakeInteraction:
+    def __init__(self, user, guild, channel, http, client):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.client = client
+        self.http = http
+        self.responded = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+
+class FakeWorld:
+    """Guilds with players, language speakers and a text channel each, all sharing one HTTP stub."""
+
+    def __init__(self, guilds, members, http):
+        self.http = http
+        self.voice_channel = FakeVoiceChannel(http)
+        names = ["@everyone", "Spiller", "Gm"] + list(bot.LANGUAGES)
+        self.guilds = []
+        ids = itertools.count(1)
+        for g in range(guilds):
+            roles = [FakeRole(next(ids), name) for name in names]
+            guild_members = []
+            for _ in range(members):
+                member_roles = [roles[0]] + random.sample(roles[1:], 3)
+                guild_members.append(FakeMember(next(ids), member_roles, http, FakeVoiceState(self.voice_channel)))
+            guild = FakeGuild(next(ids), guild_members, roles, http)
+            guild.channel = FakeChannel(next(ids), http)
+            self.guilds.append(guild)
+
+    def interaction(self, client):
+        guild = random.choice(self.guilds)
+        return FakeInteraction(random.choice(guild.members), guild, guild.channel, self.http, client)
+
+
+def command_runner(client, name, **kwargs):
+    command = client.tree.get_command(name)
+
+    async def run(interaction):
+        await command.callback(interaction, **kwargs)
+    return run
+
+
+def language_select_runner():
+    """The /switch-language dropdown's callback, which is where the DMs go out."""
+    async def run(interaction):
+        select = bot.LanguageSelect(content="The treasure is under the old mill")
+        select._values = [random.choice(bot.LANGUAGES)]
+        await select.callback(interaction)
+    return run
+
+
+def scenarios(audio_path=None):
+    rolls = ['d20', '8d6+4', '4d6kh3', '2d20kl1+5', '6d10!', '1000d6']
+
+    async def roll(interaction):
+        await bot.roll.callback(interaction, expression=random.choice(rolls))
+
+    runs = {
+        'bot /roll': (bot.client, roll),
+        'bot /odds': (bot.client, command_runner(bot.client, 'odds', expression='2d20kh1+7', target=15)),
+        'bot /jungle-rest': (bot.client, command_runner(bot.client, 'jungle-rest')),
+        'bot /death-roll': (bot.client, command_runner(bot.client, 'death-roll')),
+        'bot /up': (bot.client, command_runner(bot.client, 'up')),
+        'bot /switch-language': (bot.client, command_runner(bot.client, 'switch-language', content="Meet at dawn")),
+        'bot language select': (bot.client, language_select_runner()),
+        'bot /clear-bot-posts': (bot.client, command_runner(bot.client, 'clear-bot-posts')),
+        'testbot /control': (testbot.client, command_runner(testbot.client, 'control')),
+        'testbot /soundboard': (testbot.client, command_runner(testbot.client, 'soundboard')),
+        'testbot /queue': (testbot.client, command_runner(testbot.client, 'queue')),
+        'testbot /seek': (testbot.client, command_runner(testbot.client, 'seek', position='1:30')),
+        'testbot /stats': (testbot.client, command_runner(testbot.client, 'stats')),
+    }
+    if audio_path:
+        runs['testbot /play-url'] = (testbot.client, command_runner(testbot.client, 'play-url', url=audio_path))
+    return runs
+
+
+async def monitor_loop_lag(samples, stop, interval=0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run_scenario(world, client, run, requests, concurrency, trace_memory):
+    semaphore = asyncio.Semaphore(concurrency)
+    first_response, completion = [], []
+    errors = 0
+
+    async def fire():
+        nonlocal errors
+        async with semaphore:
+            interaction = world.interaction(client)
+            start = time.perf_counter()
+            try:
+                await run(interaction)
+            except Exception:
+                errors += 1
+                return
+            completion.append(time.perf_counter() - start)
+            if interaction.responded is not None:
+                first_response.append(interaction.responded - start)
+
+    lag, stop = [], asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lag, stop))
+    if trace_memory:
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    calls_before = sum(world.http.calls.values())
+    start = time.perf_counter()
+    await asyncio.gather(*(fire() for _ in range(requests)))
+    wall = time.perf_counter() - start
+    stop.set()
+    await monitor
+    result = {
+        'requests': requests,
+        'errors': errors,
+        'wall_seconds': wall,
+        'per_second': requests / wall,
+        'first_response_ms': summarize(first_response),
+        'completion_ms': summarize(completion),
+        'loop_lag_ms': summarize(lag),
+        'http_calls': sum(world.http.calls.values()) - calls_before,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if trace_memory:
+        result['python_heap_peak_mb'] = (tracemalloc.get_traced_memory()[1] - memory_before) / 1024 ** 2
+    return result
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    testbot.client.loop = asyncio.get_running_loop()
+    random.seed(args.seed)
+    if args.trace_memory:
+        tracemalloc.start()
+    http = HTTPStub(args.http_latency / 1000)
+    world = FakeWorld(args.guilds, args.members, http)
+    with tempfile.TemporaryDirectory() as directory:
+        audio_path = generate_audio(directory, 5)['tone.mp3'] if args.voice else None
+        results = {}
+        for name, (client, run) in scenarios(audio_path).items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            results[name] = await run_scenario(world, client, run, args.requests, args.concurrency, args.trace_memory)
+            print(f"{name}: {results[name]['per_second']:.0f}/s, first response p50 "
+                  f"{results[name]['first_response_ms']['p50']:.2f} ms" if results[name]['first_response_ms'] else name)
+        for player in testbot.client.audio_players.values():
+            player.queue.clear()
+            player.cleanup()
+    output = json.dumps({
+        'timestamp': time.time(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'parameters': vars(args),
+        'http_calls': http.calls,
+        'commands': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test for the bots' slash commands")
+    parser.add_argument('--requests', type=int, default=2000, help="interactions per command")
+    parser.add_argument('--concurrency', type=int, default=500, help="interactions in flight at once")
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--members', type=int, default=100, help="members per guild")
+    parser.add_argument('--http-latency', type=float, default=20.0, help="simulated REST round trip in ms")
+    parser.add_argument('--voice', action='store_true', help="also run /play-url (needs ffmpeg)")
+    parser.add_argument('--only', nargs='*', help="only run commands whose name contains one of these")
+    parser.add_argument('--trace-memory', action='store_true', help="report the Python heap peak (slower)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON results to this file as well")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,203 @@
+"""Index of the messages bot.py has posted, and the engine /clear-bot-posts deletes them with.
+
+Instead of walking channel history, the bot records the ID of every message it posts
+(``on_message``) per channel, capped and persisted to a JSON file. Clearing a channel then bulk
+deletes the indexed messages younger than 14 days in batches of 100, and deletes only the
+older ones one by one, since Discord's bulk delete refuses them.
+
+History is still read in two cases: once per channel, for posts from before the index covered it,
+and after an unclean shutdown, for the posts made between the last write-behind save and the
+crash, which the file never received.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import discord
+
+from fanout import with_retries
+
+BULK_DELETE_MAX = 100
+# Discord rejects bulk deletes containing messages older than two weeks; keep a margin
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+# How far back the one-off history scans look
+SCAN_LIMIT = 250
+
+logger = logging.getLogger("purge")
+
+
+class MessageIndex:
+    """channel ID -> the most recent ``per_channel`` message IDs the bot posted there."""
+
+    def __init__(self, path, per_channel=1000):
+        self.path = path
+        self.per_channel = per_channel
+        self.channels = {}
+        self.seeded = set()  # channels whose history from before the index was scanned once
+        self.unsaved_since = None  # when the last run saved for the last time, if it then crashed
+        self.recovered = set()  # channels scanned for that run's unsaved posts
+        self.started = discord.utils.utcnow()
+        self.dirty = False
+        self.writing = None  # the write-behind save in flight, which close() waits for
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # A torn write only loses the index; /clear-bot-posts falls back to a history scan
+            return
+        if 'channels' not in data:
+            data = {'channels': data}  # the format before seeding was tracked; every channel gets scanned once
+        for channel_id, message_ids in data['channels'].items():
+            self.channels[int(channel_id)] = deque(message_ids, maxlen=per_channel)
+        self.seeded.update(data.get('seeded', ()))
+        if not data.get('clean') and 'saved_at' in data:
+            self.unsaved_since = datetime.datetime.fromtimestamp(data['saved_at'], datetime.timezone.utc)
+
+    def __contains__(self, channel_id):
+        return channel_id in self.channels
+
+    def add(self, channel_id, message_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = deque(maxlen=self.per_channel)
+        self.channels[channel_id].append(message_id)
+        self.dirty = True
+
+    def extend(self, channel_id, message_ids):
+        """Merge ``message_ids`` in, e.g. from a history scan that overlaps what is already indexed."""
+        merged = set(self.channels.get(channel_id, ())) | set(message_ids)
+        self.channels[channel_id] = deque(sorted(merged), maxlen=self.per_channel)
+        self.dirty = True
+
+    def scan_window(self, channel_id):
+        """Keyword arguments for the ``channel.history()`` scan ``channel_id`` still needs, or None."""
+        if channel_id not in self.seeded:
+            return {'limit': SCAN_LIMIT}
+        if self.unsaved_since is not None and channel_id not in self.recovered:
+            # Only posts made between the crashed run's last save and this run's start can be missing
+            return {'limit': SCAN_LIMIT, 'after': self.unsaved_since, 'before': self.started}
+        return None
+
+    def mark_scanned(self, channel_id):
+        self.seeded.add(channel_id)
+        self.recovered.add(channel_id)
+        self.dirty = True
+
+    def get(self, channel_id):
+        return list(self.channels.get(channel_id, ()))
+
+    def discard(self, channel_id, message_ids):
+        if channel_id in self.channels:
+            message_ids = set(message_ids)
+            remaining = [m for m in self.channels[channel_id] if m not in message_ids]
+            self.channels[channel_id] = deque(remaining, maxlen=self.per_channel)
+            self.dirty = True
+
+    def snapshot(self, clean=False):
+        """The index as saved; taken on the event loop, so the write can run in a thread without it changing."""
+        self.dirty = False
+        return {
+            'channels': {str(channel_id): list(ids) for channel_id, ids in self.channels.items()},
+            'seeded': sorted(self.seeded),
+            'saved_at': time.time(),
+            'clean': clean,
+        }
+
+    def write(self, data):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def save(self, clean=False):
+        """Persist the index; ``clean`` marks the final save of a shutdown, so the next run skips recovery."""
+        try:
+            self.write(self.snapshot(clean))
+        except Exception:
+            self.dirty = True
+            raise
+
+    async def save_in_thread(self):
+        try:
+            await asyncio.to_thread(self.write, self.snapshot())
+        except Exception:
+            self.dirty = True
+            raise
+
+    async def flush_periodically(self, interval=30):
+        """Write-behind: persist at most every ``interval`` seconds, and only when something changed."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.dirty:
+                # A task of its own, so cancelling this loop can't leave a write running under close()
+                self.writing = asyncio.ensure_future(self.save_in_thread())
+                try:
+                    await asyncio.shield(self.writing)
+                except Exception as e:
+                    # E.g. a full disk; the index stays dirty, so the next round tries again
+                    logger.error(f"Failed to save the message index: {e}")
+
+    async def close(self):
+        """Wait for a save in flight, then make the clean final save."""
+        if self.writing is not None and not self.writing.done():
+            await asyncio.wait([self.writing])
+        self.save(clean=True)
+
+def split_by_age(message_ids, now=None):
+    """Split message IDs into (bulk-deletable, too old for bulk delete), newest first."""
+    now = now or discord.utils.utcnow()
+    recent, old = [], []
+    for message_id in sorted(message_ids, reverse=True):
+        if now - discord.utils.snowflake_time(message_id) < BULK_DELETE_MAX_AGE:
+            recent.append(message_id)
+        else:
+            old.append(message_id)
+    return recent, old
+
+
+async def purge(channel, message_ids, progress=None, retries=3):
+    """Delete ``message_ids`` from ``channel``; return the IDs that are gone (deleted or already missing).
+
+    Batches go out one after another, so each waits for discord.py's per-route bucket rather than
+    queueing behind it, and 429/5xx responses are retried with backoff. ``progress(done, total)``
+    is awaited after every batch and every individual delete.
+    """
+    recent, old = split_by_age(message_ids)
+    total = len(recent) + len(old)
+    gone = []
+
+    async def report():
+        if progress:
+            await progress(len(gone), total)
+
+    for start in range(0, len(recent), BULK_DELETE_MAX):
+        batch = recent[start:start + BULK_DELETE_MAX]
+        if len(batch) == 1:
+            # Bulk delete needs at least two messages
+            old.insert(0, batch[0])
+            continue
+        try:
+            await with_retries(lambda: channel.delete_messages([discord.Object(id=m) for m in batch]), retries)
+        except discord.HTTPException:
+            # E.g. some were already deleted by hand; fall back to deleting this batch one by one
+            old[:0] = batch
+            continue
+        gone.extend(batch)
+        await report()
+
+    for message_id in old:
+        try:
+            await with_retries(lambda: channel.get_partial_message(message_id).delete(), retries)
+        except discord.NotFound:
+            pass
+        except (discord.RateLimited, discord.HTTPException):
+            continue
+        gone.append(message_id)
+        await report()
+    return gone
@@ -0,0 +1,102 @@
+"""Per-guild index from role to member IDs, so secret messages are routed with set operations.
+
+bot.py builds a guild's index from its member cache the first time it is needed and keeps it
+current from member and role events. Role names are matched case-insensitively, as before.
+"""
+
+PLAYER_ROLES = ("spiller", "gm")
+
+
+class RoleIndex:
+    """Role ID -> member IDs for one guild, plus lower-cased role name -> role IDs."""
+    __slots__ = ('role_members', 'role_names', 'name_roles', '_eligible')
+
+    def __init__(self):
+        self.role_members = {}
+        self.role_names = {}
+        self.name_roles = {}
+        self._eligible = None
+
+    @classmethod
+    def build(cls, guild):
+        index = cls()
+        for role in guild.roles:
+            index.add_role(role)
+        for member in guild.members:
+            index.add_member(member)
+        return index
+
+    def add_role(self, role):
+        name = role.name.lower()
+        self.role_members.setdefault(role.id, set())
+        self.role_names[role.id] = name
+        self.name_roles.setdefault(name, set()).add(role.id)
+        self._invalidate(name)
+
+    def remove_role(self, role_id):
+        name = self.role_names.pop(role_id, None)
+        self.role_members.pop(role_id, None)
+        if name is not None:
+            roles = self.name_roles[name]
+            roles.discard(role_id)
+            if not roles:
+                del self.name_roles[name]
+            self._invalidate(name)
+
+    def rename_role(self, role):
+        """Keep a role's members but file it under its new name."""
+        members = self.role_members.get(role.id, set())
+        self.remove_role(role.id)
+        self.add_role(role)
+        self.role_members[role.id] = members
+
+    def add_member(self, member):
+        for role in member.roles:
+            if role.id not in self.role_names:
+                self.add_role(role)
+            self.role_members[role.id].add(member.id)
+            self._invalidate(self.role_names[role.id])
+
+    def remove_member(self, member_id):
+        for role_id, members in self.role_members.items():
+            if member_id in members:
+                members.discard(member_id)
+                self._invalidate(self.role_names[role_id])
+
+    def update_member(self, before, after):
+        before_roles = {role.id for role in before.roles}
+        after_roles = {role.id for role in after.roles}
+        for role_id in before_roles - after_roles:
+            if role_id in self.role_members:
+                self.role_members[role_id].discard(after.id)
+                self._invalidate(self.role_names[role_id])
+        for role in after.roles:
+            if role.id not in before_roles:
+                if role.id not in self.role_names:
+                    self.add_role(role)
+                self.role_members[role.id].add(after.id)
+                self._invalidate(self.role_names[role.id])
+
+    def members_with(self, name):
+        """IDs of members holding any role called ``name`` (case-insensitive)."""
+        role_ids = self.name_roles.get(name.lower(), ())
+        if len(role_ids) == 1:
+            return self.role_members[next(iter(role_ids))]
+        return set().union(*(self.role_members[role_id] for role_id in role_ids))
+
+    @property
+    def eligible(self):
+        """IDs of players and GMs, the only members a secret message goes to."""
+        if self._eligible is None:
+            self._eligible = set().union(*(self.members_with(name) for name in PLAYER_ROLES))
+        return self._eligible
+
+    def route(self, language):
+        """Split the eligible members into (readers, others) for a message in ``language``."""
+        eligible = self.eligible
+        readers = eligible & self.members_with(language)
+        return readers, eligible - readers
+
+    def _invalidate(self, name):
+        if name in PLAYER_ROLES:
+            self._eligible = None
@@ -0,0 +1,172 @@
+"""Sharded multi-process runtime shared by bot.py and testbot.py.
+
+Each bot builds its client with ``shard_options()``; on its own that is a single
+AutoShardedClient that lets Discord pick the shard count. Running
+
+    python shards.py testbot.py --workers 4 --shards 16
+
+starts 4 worker processes of the bot, each owning a contiguous range of the 16 shards, restarts
+workers that crash and aggregates the health each worker reports into one file.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger("shards")
+
+
+def shard_options():
+    """AutoShardedClient kwargs for this process, from SHARD_COUNT and SHARD_IDS set by the supervisor."""
+    shard_count = os.getenv('SHARD_COUNT')
+    if not shard_count:
+        return {}
+    options = {'shard_count': int(shard_count)}
+    shard_ids = os.getenv('SHARD_IDS')
+    if shard_ids:
+        options['shard_ids'] = [int(shard_id) for shard_id in shard_ids.split(',')]
+    return options
+
+
+def shard_for_guild(guild_id, shard_count):
+    """The shard Discord routes a guild to."""
+    return (guild_id >> 22) % shard_count
+
+
+def partition(shard_count, workers):
+    """Split shard ids 0..shard_count-1 into ``workers`` contiguous, near-equal ranges."""
+    workers = min(workers, shard_count)
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for worker in range(workers):
+        end = start + size + (1 if worker < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def report_health(client, interval=10):
+    """Worker side: periodically write this process's shard health to WORKER_HEALTH_FILE."""
+    path = os.getenv('WORKER_HEALTH_FILE')
+    if not path:
+        return
+    while True:
+        health = {
+            'pid': os.getpid(),
+            'time': time.time(),
+            'ready': client.is_ready(),
+            'guilds': len(client.guilds),
+            'shards': {str(shard_id): latency for shard_id, latency in client.latencies},
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(health, f)
+        os.replace(temp_path, path)
+        await asyncio.sleep(interval)
+
+
+class ShardSupervisor:
+    """Runs one worker process per shard range and restarts the ones that exit.
+
+    Restarts back off exponentially per worker (reset once a worker stayed up for a minute), and
+    the workers' health files are merged into ``health_dir/health.json``.
+    """
+
+    def __init__(self, script, shard_count, workers, health_dir='./health', command=None):
+        self.script = script
+        self.shard_count = shard_count
+        self.ranges = partition(shard_count, workers)
+        self.health_dir = health_dir
+        self.command = command or [sys.executable, script]
+        self.processes = {}
+        self.restarts = {worker: 0 for worker in range(len(self.ranges))}
+        os.makedirs(health_dir, exist_ok=True)
+
+    def worker_env(self, worker):
+        env = dict(os.environ)
+        env['SHARD_COUNT'] = str(self.shard_count)
+        env['SHARD_IDS'] = ','.join(str(shard_id) for shard_id in self.ranges[worker])
+        env['WORKER_HEALTH_FILE'] = self.health_path(worker)
+        # Per-process exports must not collide between workers
+        if env.get('METRICS_FILE'):
+            env['METRICS_FILE'] = f"{env['METRICS_FILE']}.worker{worker}"
+        if env.get('METRICS_PORT'):
+            env['METRICS_PORT'] = str(int(env['METRICS_PORT']) + worker)
+        return env
+
+    def health_path(self, worker):
+        return os.path.join(self.health_dir, f"worker-{worker}.json")
+
+    async def run_worker(self, worker):
+        backoff = 1
+        while True:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(*self.command, env=self.worker_env(worker))
+            self.processes[worker] = process
+            logger.info(f"Worker {worker} (pid {process.pid}) started with shards {self.ranges[worker]}")
+            code = await process.wait()
+            if time.monotonic() - started > 60:
+                backoff = 1
+            self.restarts[worker] += 1
+            logger.warning(f"Worker {worker} exited with {code}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def aggregate_health(self):
+        workers = {}
+        for worker, shard_ids in enumerate(self.ranges):
+            process = self.processes.get(worker)
+            try:
+                with open(self.health_path(worker)) as f:
+                    health = json.load(f)
+            except (OSError, ValueError):
+                health = {}
+            workers[str(worker)] = {
+                'shards': shard_ids,
+                'running': process is not None and process.returncode is None,
+                'restarts': self.restarts[worker],
+                'ready': health.get('ready', False),
+                'guilds': health.get('guilds', 0),
+                'latencies': health.get('shards', {}),
+                'last_report': health.get('time'),
+            }
+        return {
+            'time': time.time(),
+            'shard_count': self.shard_count,
+            'guilds': sum(worker['guilds'] for worker in workers.values()),
+            'workers_ready': sum(1 for worker in workers.values() if worker['ready']),
+            'workers': workers,
+        }
+
+    async def write_health(self, interval=10):
+        path = os.path.join(self.health_dir, 'health.json')
+        while True:
+            await asyncio.sleep(interval)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.aggregate_health(), f, indent=2)
+            os.replace(temp_path, path)
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.run_worker(worker)) for worker in range(len(self.ranges))]
+        tasks.append(asyncio.create_task(self.write_health()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for process in self.processes.values():
+                if process.returncode is None:
+                    process.terminate()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run a bot as several sharded worker processes")
+    parser.add_argument('script', help="bot script to run in each worker, e.g. testbot.py")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, required=True, help="total shard count across all workers")
+    parser.add_argument('--health-dir', default='./health')
+    args = parser.parse_args()
+    asyncio.run(ShardSupervisor(args.script, args.shards, args.workers, args.health_dir).run())
@@ -4,19 +4,59 @@ import asyncio
 import yt_dlp
 from dotenv import load_dotenv
 import os
-from collections import deque
+from collections import deque, OrderedDict
 import logging
 import ffmpeg
+import numpy as np
+import hashlib
+import io
+import itertools
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+from aiohttp import web
+from urllib.parse import urlparse, parse_qs
+
+from command_sync import sync_if_changed
+from shards import shard_options, report_health
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("discord_bot")
 
-discord.opus.load_opus('/lib/x86_64-linux-gnu/libopus.so.0')
+try:
+    discord.opus.load_opus('/lib/x86_64-linux-gnu/libopus.so.0')
+except OSError as e:
+    # Only voice needs libopus; the offline benchmark imports this module without it
+    logger.warning(f"Could not load libopus: {e}")
 print(discord.opus.is_loaded())
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+# Share one paced decoder between all guilds playing the same source at the same time
+SHARED_DECODING = os.getenv('SHARED_DECODING') == '1'
+# Send Opus from ffmpeg as is while a track needs no live volume/speed; off by default, since taking
+# such a track onto the PCM path later (effects, Vol/Speed) means decoding its packets in-process
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH') == '1'
+TRANSCODE_CACHE_DIR = os.getenv('TRANSCODE_CACHE_DIR', './cache/transcoded')
+TRANSCODE_CACHE_BYTES = int(os.getenv('TRANSCODE_CACHE_BYTES', 2 * 1024 ** 3))
+# Chunks the cache writer may fall behind playback before the track's cache copy is dropped
+TRANSCODE_CACHE_BACKLOG = int(os.getenv('TRANSCODE_CACHE_BACKLOG', 1000))
+QUEUE_DISPLAY_LIMIT = 20
+# Leave voice after this long without playback, and drop the guild's player a while after that
+IDLE_DISCONNECT_SECONDS = int(os.getenv('IDLE_DISCONNECT_SECONDS', 600))
+IDLE_EVICT_SECONDS = int(os.getenv('IDLE_EVICT_SECONDS', 3600))
+# Prometheus text exposition: written to METRICS_FILE and/or served on METRICS_PORT when set
+METRICS_FILE = os.getenv('METRICS_FILE')
+METRICS_PORT = os.getenv('METRICS_PORT')
+FFMPEG_MAX_PROCESSES = int(os.getenv('FFMPEG_MAX_PROCESSES', 64))
+FFMPEG_MAX_PROCESSES_PER_GUILD = int(os.getenv('FFMPEG_MAX_PROCESSES_PER_GUILD', 4))
+# Read-ahead between ffmpeg and the voice thread, and how much of it to fill before playing
+JITTER_BUFFER_SECONDS = float(os.getenv('JITTER_BUFFER_SECONDS', 5))
+JITTER_PREROLL_SECONDS = float(os.getenv('JITTER_PREROLL_SECONDS', 0.2))
 
 # Intents setup
 intents = discord.Intents.default()
@@ -24,25 +64,1109 @@ intents.guilds = True
 intents.members = True
 intents.voice_states = True
 
-class MyBot(discord.Client):
+class MyBot(discord.AutoShardedClient):
     def __init__(self, *, intents: discord.Intents):
-        super().__init__(intents=intents)
+        # Shard count and ids come from the environment when run under shards.py
+        # Nothing here needs the full member list, so don't request it from every guild at startup
+        super().__init__(intents=intents, chunk_guilds_at_startup=False, **shard_options())
         self.tree = discord.app_commands.CommandTree(self)
         self.audio_players = {}
-        self.views = {}  # Store persistent views per guild
 
     async def setup_hook(self):
-        await self.tree.sync()
+        # Commands are global, so only the process owning shard 0 needs to sync them
+        if self.shard_ids is None or 0 in self.shard_ids:
+            await sync_if_changed(self.tree, self.application_id)
+        asyncio.create_task(report_health(self))
+        # One persistent view serves every guild's panel; the buttons look the guild up from the interaction
+        self.add_view(ControlPanelView(None))
+        asyncio.create_task(soundboard_cache.preload(SOUNDBOARD_SOUNDS.values()))
+        asyncio.create_task(self.idle_sweep())
+        if METRICS_FILE:
+            asyncio.create_task(self.write_metrics())
+        if METRICS_PORT:
+            await self.serve_metrics(int(METRICS_PORT))
+
+    def render_metrics(self):
+        return playback_metrics.render_prometheus(list(self.audio_players.values()), ffmpeg_supervisor)
+
+    async def write_metrics(self, interval=15):
+        """Rewrite METRICS_FILE atomically, for node_exporter's textfile collector or similar."""
+        while True:
+            temp_path = f"{METRICS_FILE}.tmp"
+            with open(temp_path, 'w') as f:
+                f.write(self.render_metrics())
+            os.replace(temp_path, METRICS_FILE)
+            await asyncio.sleep(interval)
+
+    async def serve_metrics(self, port):
+        async def handle(request):
+            return web.Response(text=self.render_metrics(), content_type='text/plain')
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
 
     def get_audio_player(self, guild_id):
         if guild_id not in self.audio_players:
-            self.audio_players[guild_id] = AudioPlayer()
-        return self.audio_players[guild_id]
+            self.audio_players[guild_id] = AudioPlayer(guild_id)
+        player = self.audio_players[guild_id]
+        player.last_active = time.monotonic()
+        return player
+
+    async def idle_sweep(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            await self.sweep_idle(time.monotonic())
+
+    async def sweep_idle(self, now):
+        """Disconnect idle voice clients and evict idle players; get_audio_player rebuilds them on demand."""
+        for guild_id, player in list(self.audio_players.items()):
+            voice_client = player.voice_client
+            if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+                player.last_active = now
+                continue
+            idle = now - player.last_active
+            if voice_client and idle >= IDLE_DISCONNECT_SECONDS:
+                logger.info(f"Disconnecting idle voice client in guild {guild_id}")
+                # Nothing plays a queue left behind without a voice client, so it is not kept either
+                player.queue.clear()
+                player.cleanup()
+                try:
+                    await voice_client.disconnect()
+                except Exception as e:
+                    logger.error(f"Failed to disconnect idle voice client in guild {guild_id}: {e}")
+            elif not voice_client and idle >= IDLE_EVICT_SECONDS:
+                player.cleanup()
+                del self.audio_players[guild_id]
+                # Its counters would otherwise stay in memory and in every scrape
+                playback_metrics.drop(guild_id)
 
 client = MyBot(intents=intents)
 
-class AudioPlayer:
+# 20 ms of 48 kHz stereo s16le, the frame size discord.py expects
+FRAME_SAMPLES = 960
+FRAME_SIZE = FRAME_SAMPLES * 2 * 2
+HOP_SAMPLES = FRAME_SAMPLES // 2
+OLA_WINDOW = np.hanning(FRAME_SAMPLES + 1)[:-1].astype(np.float32)[:, None]
+# How far (in samples, 5 ms) a time-stretch grain may move to line up with the previous one
+WSOLA_TOLERANCE = 240
+
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-quantile, or None without observations."""
+        if not self.count:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float('inf')
+
+class GuildStats:
+    """Playback counters for one guild. Updated from the voice thread, read from the event loop."""
+    __slots__ = ('first_frame', 'frame_read', 'underruns', 'short_reads', 'frames', 'restarts', 'stderr_lines', 'rebuffers', 'buffer_fill')
+
     def __init__(self):
+        self.first_frame = Histogram()  # decoder start to first frame
+        self.frame_read = Histogram()  # time spent waiting on the decoder per frame
+        self.underruns = 0  # frames whose read took longer than the 20 ms frame budget
+        self.short_reads = 0
+        self.frames = 0
+        self.restarts = 0
+        self.stderr_lines = 0
+        self.rebuffers = 0  # times the jitter buffer ran dry and waited for pre-roll again
+        self.buffer_fill = None  # jitter buffer fill level (0..1) at the last read
+
+    def observe_read(self, seconds, size):
+        self.frames += 1
+        self.frame_read.observe(seconds)
+        if seconds > 0.02:
+            self.underruns += 1
+        if 0 < size < FRAME_SIZE:
+            self.short_reads += 1
+
+class PlaybackMetrics:
+    def __init__(self):
+        self.guilds = {}
+
+    def guild(self, guild_id):
+        stats = self.guilds.get(guild_id)
+        if stats is None:
+            stats = self.guilds[guild_id] = GuildStats()
+        return stats
+
+    def drop(self, guild_id):
+        """Forget an evicted guild; its counters start from zero if it plays again."""
+        self.guilds.pop(guild_id, None)
+
+    def render_prometheus(self, players=(), supervisor=None):
+        lines = []
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, attribute):
+            metric(name, 'histogram', f"{attribute.replace('_', ' ')} latency in seconds")
+            for guild_id, stats in self.guilds.items():
+                hist = getattr(stats, attribute)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{guild="{guild_id}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{guild="{guild_id}"}} {hist.total}')
+                lines.append(f'{name}_count{{guild="{guild_id}"}} {hist.count}')
+
+        histogram('dndbot_first_frame_seconds', 'first_frame')
+        histogram('dndbot_frame_read_seconds', 'frame_read')
+        for name, attribute, help_text in (
+            ('dndbot_frames_total', 'frames', 'PCM frames read from decoders'),
+            ('dndbot_underruns_total', 'underruns', 'Frames that took longer than 20 ms to read'),
+            ('dndbot_short_reads_total', 'short_reads', 'Reads that returned less than a full frame'),
+            ('dndbot_ffmpeg_restarts_total', 'restarts', 'Decoder restarts after errors or mode switches'),
+            ('dndbot_ffmpeg_stderr_lines_total', 'stderr_lines', 'Lines ffmpeg wrote to stderr'),
+            ('dndbot_rebuffers_total', 'rebuffers', 'Times the jitter buffer ran dry'),
+        ):
+            metric(name, 'counter', help_text)
+            for guild_id, stats in self.guilds.items():
+                lines.append(f'{name}{{guild="{guild_id}"}} {getattr(stats, attribute)}')
+        metric('dndbot_buffer_fill_ratio', 'gauge', 'Jitter buffer fill level at the last read')
+        for guild_id, stats in self.guilds.items():
+            if stats.buffer_fill is not None:
+                lines.append(f'dndbot_buffer_fill_ratio{{guild="{guild_id}"}} {stats.buffer_fill:.3f}')
+        metric('dndbot_queue_depth', 'gauge', 'Tracks waiting in the queue')
+        for player in players:
+            lines.append(f'dndbot_queue_depth{{guild="{player.guild_id}"}} {len(player.queue)}')
+        if supervisor:
+            counts = supervisor.stats()
+            metric('dndbot_ffmpeg_processes', 'gauge', 'Running ffmpeg processes')
+            lines.append(f"dndbot_ffmpeg_processes {counts['processes']}")
+            if counts['open_fds'] is not None:
+                metric('dndbot_open_fds', 'gauge', 'Open file descriptors')
+                lines.append(f"dndbot_open_fds {counts['open_fds']}")
+        return '\n'.join(lines) + '\n'
+
+playback_metrics = PlaybackMetrics()
+
+class PipeBuffer:
+    """Bounded read-ahead buffer between an ffmpeg pipe and the voice thread.
+
+    A pump thread keeps reading the pipe into memory, so network hiccups are absorbed here and
+    the voice thread only copies bytes. Reads wait for ``preroll`` bytes first, and again after
+    the buffer ran dry, so a stall costs one pause instead of a stutter per frame. ``on_eof`` is
+    called from the pump thread with the total bytes read once the pipe ends.
+    """
+
+    def __init__(self, pipe, capacity, preroll, stats=None):
+        self.pipe = pipe
+        self.capacity = capacity
+        self.preroll = preroll
+        self.stats = stats
+        self.buffer = bytearray()
+        self.buffering = True
+        self.eof = False
+        self.closed = False
+        self.received = 0
+        self.on_eof = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+
+    def _pump(self):
+        while True:
+            with self.condition:
+                while len(self.buffer) >= self.capacity and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+            try:
+                data = self.pipe.read(FRAME_SIZE)
+            except (OSError, ValueError):
+                data = b''
+            with self.condition:
+                if data:
+                    self.buffer += data
+                    self.received += len(data)
+                else:
+                    self.eof = True
+                self.condition.notify_all()
+            if not data:
+                if self.on_eof and not self.closed:
+                    self.on_eof(self.received)
+                return
+
+    @property
+    def fill(self):
+        return len(self.buffer) / self.capacity
+
+    def read(self, size):
+        with self.condition:
+            if self.buffering:
+                while len(self.buffer) < self.preroll and not self.eof and not self.closed:
+                    self.condition.wait()
+                self.buffering = False
+            while len(self.buffer) < size and not self.eof and not self.closed:
+                self.condition.wait()
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            if not self.buffer and not self.eof:
+                self.buffering = True
+                if self.stats:
+                    self.stats.rebuffers += 1
+            if self.stats:
+                self.stats.buffer_fill = self.fill
+            self.condition.notify_all()
+            return data
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.buffer.clear()
+            self.condition.notify_all()
+
+class PCMTransformSource(discord.AudioSource):
+    """Reads raw PCM from ffmpeg and applies volume/speed per 20 ms frame.
+
+    Changing ``volume`` or ``speed`` takes effect on the next frame, no ffmpeg restart needed.
+    Speed changes keep the pitch with WSOLA, the method ffmpeg's atempo uses: grains are
+    overlap-added at a fixed hop, each taken within ``WSOLA_TOLERANCE`` of its nominal input
+    position where it correlates best with how the previous grain continued, so the waveforms
+    line up instead of partially cancelling.
+    """
+
+    def __init__(self, stream, volume=1.0, speed=1.0, offset=0.0, stats=None):
+        self.stream = stream
+        self.volume = volume
+        self.speed = speed
+        self.offset = offset  # seconds into the track where this stream starts
+        self.stats = stats
+        self.started = time.perf_counter()
+        self._buffer = None  # float32 (n, 2) input samples, only once time-stretching kicked in
+        self._position = 0.0  # nominal input position of the next grain, in samples into _buffer
+        self._natural = None  # where the last grain would have continued, in samples into _buffer
+        self._tail = np.zeros((HOP_SAMPLES, 2), dtype=np.float32)
+        self._eof = False
+        self.samples_read = 0
+        # Set by AudioPlayer once the track length is known; on_near_end fires once, from the voice thread
+        self.duration = None
+        self.lookahead = 0.0
+        self.on_near_end = None
+
+    @property
+    def elapsed(self):
+        return self.offset + self.samples_read / 48000
+
+    def _read_raw(self):
+        start = time.perf_counter()
+        data = self.stream.read(FRAME_SIZE)
+        if self.stats:
+            now = time.perf_counter()
+            if not self.samples_read and data:
+                self.stats.first_frame.observe(now - self.started)
+            self.stats.observe_read(now - start, len(data))
+        if isinstance(self.stream, BroadcastListener) and self.stream.skipped:
+            # Audio a shared decoder's resync jumped over still moves the track position on
+            self.samples_read += self.stream.skipped * FRAME_SAMPLES
+            self.stream.skipped = 0
+        if len(data) < FRAME_SIZE:
+            self._eof = True
+            if not data:
+                return None
+            data += b'\x00' * (FRAME_SIZE - len(data))
+        self.samples_read += FRAME_SAMPLES
+        return np.frombuffer(data, dtype=np.int16).reshape(-1, 2).astype(np.float32)
+
+    def _stretch(self, first):
+        speed = self.speed
+        if self._buffer is None:
+            self._buffer = first if first is not None else np.zeros((0, 2), dtype=np.float32)
+        out = np.empty((FRAME_SAMPLES, 2), dtype=np.float32)
+        for hop in range(2):
+            nominal = int(self._position)
+            while len(self._buffer) < nominal + WSOLA_TOLERANCE + FRAME_SAMPLES and not self._eof:
+                chunk = self._read_raw()
+                if chunk is None:
+                    break
+                self._buffer = np.concatenate((self._buffer, chunk))
+            start = nominal
+            if speed != 1.0 and self._natural is not None:
+                # Cross-correlate (in mono) the continuation of the previous grain against the search window
+                target = self._buffer[self._natural:self._natural + HOP_SAMPLES].sum(axis=1)
+                low = max(0, nominal - WSOLA_TOLERANCE)
+                window = self._buffer[low:nominal + WSOLA_TOLERANCE + HOP_SAMPLES].sum(axis=1)
+                if len(target) == HOP_SAMPLES and len(window) >= HOP_SAMPLES:
+                    start = low + int(np.argmax(np.correlate(window, target, mode='valid')))
+            grain = self._buffer[start:start + FRAME_SAMPLES]
+            if len(grain) == 0 and self._eof and hop == 0:
+                return None
+            if len(grain) < FRAME_SAMPLES:
+                grain = np.concatenate((grain, np.zeros((FRAME_SAMPLES - len(grain), 2), dtype=np.float32)))
+            grain = grain * OLA_WINDOW
+            out[hop * HOP_SAMPLES:(hop + 1) * HOP_SAMPLES] = self._tail + grain[:HOP_SAMPLES]
+            self._tail = grain[HOP_SAMPLES:]
+            self._natural = start + HOP_SAMPLES
+            self._position += HOP_SAMPLES * speed
+        # Drop consumed input, keeping what the next search window and continuation still need
+        consumed = max(0, min(int(self._position) - WSOLA_TOLERANCE, self._natural))
+        self._buffer = self._buffer[consumed:]
+        self._position -= consumed
+        self._natural -= consumed
+        return out
+
+    def read(self):
+        if self._buffer is None and self.speed == 1.0:
+            samples = self._read_raw()
+        else:
+            samples = self._stretch(None if self._buffer is not None else self._read_raw())
+        if samples is None:
+            return b''
+        if self.on_near_end and self.duration and (self.duration - self.elapsed) / self.speed <= self.lookahead:
+            callback, self.on_near_end = self.on_near_end, None
+            callback()
+        samples *= self.volume
+        np.clip(samples, -32768, 32767, out=samples)
+        return samples.astype(np.int16).tobytes()
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        if isinstance(self.stream, (BroadcastListener, PipeBuffer, OpusDecodeStream)):
+            self.stream.close()
+        self.stream = None
+
+class OpusPipeSource(discord.AudioSource):
+    """Sends the Opus packets of ffmpeg's Ogg output as they are, without a PCM round trip.
+
+    Volume is baked in by ffmpeg when the stream starts, so this source cannot be adjusted live;
+    AudioPlayer hands its packets to an OpusDecodeStream when a volume or speed change needs PCM.
+    """
+
+    def __init__(self, stream, offset=0.0, stats=None, volume=1.0):
+        self.stream = stream
+        self.offset = offset
+        self.speed = 1.0
+        self.volume = volume  # baked into the packets by ffmpeg
+        self.stats = stats
+        self.started = time.perf_counter()
+        self._packets = discord.oggparse.OggStream(stream).iter_packets()
+        self._lock = threading.Lock()
+        self._handed_over = False
+        self.packets_read = 0
+        self.duration = None
+        self.lookahead = 0.0
+        self.on_near_end = None
+
+    @property
+    def elapsed(self):
+        return self.offset + self.packets_read * 0.02
+
+    def next_packet(self):
+        with self._lock:
+            if self._handed_over:
+                return b''
+            return next(self._packets, b'')
+
+    def hand_over(self):
+        """Stop playing and give up the packets, for an OpusDecodeStream to continue from.
+
+        The stream is detached too, so the voice thread cleaning this source up leaves it open.
+        """
+        with self._lock:
+            self._handed_over = True
+            stream, self.stream = self.stream, None
+        return stream
+
+    def read(self):
+        start = time.perf_counter()
+        packet = self.next_packet()
+        if self.stats:
+            now = time.perf_counter()
+            if not self.packets_read and packet:
+                self.stats.first_frame.observe(now - self.started)
+            # Opus packets vary in size, so only count missing ones as short
+            self.stats.observe_read(now - start, len(packet) or FRAME_SIZE)
+        if not packet:
+            return b''
+        self.packets_read += 1
+        if self.on_near_end and self.duration and self.duration - self.elapsed <= self.lookahead:
+            callback, self.on_near_end = self.on_near_end, None
+            callback()
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if isinstance(self.stream, PipeBuffer):
+            self.stream.close()
+        self.stream = None
+
+class OpusDecodeStream:
+    """PCM decoded in-process from an OpusPipeSource's packets, read like a pipe.
+
+    Takes a passthrough track onto the PCM path where it is, with the same ffmpeg process still
+    feeding it. The volume ffmpeg baked into the packets is undone, so PCMTransformSource applies
+    the player's volume as it would to any other track.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.stream = source.hand_over()
+        self.decoder = discord.opus.Decoder()
+        self.gain = 1.0 / source.volume if source.volume else 1.0
+        self.pending = bytearray()
+
+    def read(self, size):
+        while len(self.pending) < size:
+            packet = self.source.next_packet()
+            if not packet:
+                break
+            pcm = self.decoder.decode(packet)
+            if self.gain != 1.0:
+                samples = np.frombuffer(pcm, dtype=np.int16) * self.gain
+                np.clip(samples, -32768, 32767, out=samples)
+                pcm = samples.astype(np.int16).tobytes()
+            self.pending += pcm
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def close(self):
+        if isinstance(self.stream, PipeBuffer):
+            self.stream.close()
+        self.stream = None
+
+class MixerSource(discord.AudioSource):
+    """Sums a music bed and any number of sound effects frame by frame.
+
+    Effects are added from the event loop while the voice thread reads, so the effect list is
+    guarded by a lock. The music is ducked while effects play and never restarted for them.
+    """
+
+    def __init__(self, music=None, duck=0.5, max_effects=8):
+        self.music = music
+        self.duck = duck  # music gain while effects play
+        self.max_effects = max_effects
+        self.effects = []  # [source, gain, on_done]
+        self.lock = threading.Lock()
+        self._music_gain = 1.0
+
+    def add(self, source, gain=1.0, on_done=None):
+        with self.lock:
+            if len(self.effects) >= self.max_effects:
+                # Keep mixing cost bounded: the oldest effect makes room
+                self._finish(self.effects.pop(0))
+            self.effects.append([source, gain, on_done])
+
+    @staticmethod
+    def _finish(effect):
+        source, _, on_done = effect
+        source.cleanup()
+        if on_done:
+            on_done()
+
+    def set_music(self, source):
+        """Put ``source`` under the effects, e.g. when a track starts while only effects are playing."""
+        with self.lock:
+            self.music = source
+
+    def read(self):
+        music_source = self.music
+        music = music_source.read() if music_source else b''
+        with self.lock:
+            if not music and self.music is music_source:
+                self.music = None
+            effects = list(self.effects)
+        if not effects and (self._music_gain >= 1.0 or not music):
+            self._music_gain = 1.0
+            return music
+
+        mix = np.zeros((FRAME_SAMPLES, 2), dtype=np.float32)
+        if music:
+            target = self.duck if effects else 1.0
+            # Ramp the ducking (and its release) over a few frames so it does not click
+            self._music_gain += max(-0.1, min(0.1, target - self._music_gain))
+            mix += np.frombuffer(music.ljust(FRAME_SIZE, b'\x00'), dtype=np.int16).reshape(-1, 2) * self._music_gain
+        finished = []
+        for effect in effects:
+            data = effect[0].read()
+            if not data:
+                finished.append(effect)
+                continue
+            mix += np.frombuffer(data.ljust(FRAME_SIZE, b'\x00'), dtype=np.int16).reshape(-1, 2) * effect[1]
+        if finished:
+            with self.lock:
+                self.effects = [effect for effect in self.effects if effect not in finished]
+            for effect in finished:
+                self._finish(effect)
+        if not music and len(finished) == len(effects):
+            return b''
+        np.clip(mix, -32768, 32767, out=mix)
+        return mix.astype(np.int16).tobytes()
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        if self.music:
+            self.music.cleanup()
+        with self.lock:
+            effects, self.effects = self.effects, []
+        for effect in effects:
+            self._finish(effect)
+
+def is_opus_url(url):
+    """YouTube's signed stream URLs name their container; audio/webm streams carry Opus."""
+    return parse_qs(urlparse(url).query).get('mime') == ['audio/webm']
+
+class PrewarmedTrack:
+    """A queue entry whose ffmpeg process was started early, with its first frames already buffered."""
+
+    def __init__(self, entry, process, buffer_frames, opus=False, volume=None, url=None):
+        self.entry = entry
+        self.url = url  # the stream URL actually decoded, for entries resolved lazily
+        self.process = process
+        self.buffer_frames = buffer_frames
+        self.opus = opus
+        self.volume = volume  # baked into the stream when opus is set
+        self.frames = bytearray()
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        while not self.cancelled and len(self.frames) < self.buffer_frames * FRAME_SIZE:
+            data = self.process.stdout.read(FRAME_SIZE)
+            if not data:
+                break
+            self.frames += data
+
+    def read(self, size):
+        # Hand out the buffered bytes first, then continue straight from the pipe.
+        # The join only waits on the voice thread, for a fill read that is still in flight.
+        if len(self.frames) < size:
+            self.thread.join()
+        data = bytes(self.frames[:size])
+        del self.frames[:size]
+        if len(data) < size:
+            data += self.process.stdout.read(size - len(data))
+        return data
+
+    def take(self):
+        """Stop buffering and return a stream that continues where the buffer left off."""
+        self.cancelled = True
+        return self
+
+    def cancel(self):
+        self.cancelled = True
+        ffmpeg_supervisor.release(self.process)
+        self.frames.clear()
+
+class DecoderLimitError(RuntimeError):
+    pass
+
+class FFmpegSupervisor:
+    """Owns every ffmpeg process the bot starts.
+
+    Spawning is refused past a global and a per-guild limit. Released processes are terminated,
+    their pipes closed, and a reaper thread waits on them, escalating to kill after
+    ``kill_timeout`` seconds so nothing is left as a zombie.
+    """
+
+    def __init__(self, max_processes=FFMPEG_MAX_PROCESSES, max_per_guild=FFMPEG_MAX_PROCESSES_PER_GUILD, kill_timeout=2.0):
+        self.max_processes = max_processes
+        self.max_per_guild = max_per_guild
+        self.kill_timeout = kill_timeout
+        self.processes = {}  # process -> guild id (None for shared work)
+        self.reaping = {}  # process -> kill deadline
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def spawn(self, stream, guild_id=None, drain_stderr=True, pipe_stdin=False, nice=False):
+        """Start ffmpeg for ``stream``; unless ``drain_stderr`` is off, its stderr is read into the log.
+
+        ``nice`` lowers the process's CPU priority, for background work that must not slow playback.
+        """
+        # Progress lines would otherwise fill the stderr pipe and stall ffmpeg mid-track
+        stream = stream.global_args('-nostats', '-loglevel', 'warning')
+        with self.lock:
+            self._poll()
+            if len(self.processes) >= self.max_processes:
+                raise DecoderLimitError(f"Too many ffmpeg processes running ({len(self.processes)})")
+            if guild_id is not None and sum(1 for owner in self.processes.values() if owner == guild_id) >= self.max_per_guild:
+                raise DecoderLimitError(f"Too many ffmpeg processes running for guild {guild_id}")
+            process = ffmpeg.run_async(stream, pipe_stdin=pipe_stdin, pipe_stdout=True, pipe_stderr=True)
+            self.processes[process] = guild_id
+            self._start_reaper()
+        if nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, process.pid, 10)
+            except (AttributeError, OSError):
+                pass  # not on this platform; the work still runs, at normal priority
+        if drain_stderr:
+            threading.Thread(target=self._drain_stderr, args=(process, guild_id), daemon=True).start()
+        return process
+
+    @staticmethod
+    def _drain_stderr(process, guild_id):
+        stats = playback_metrics.guild(guild_id)
+        try:
+            for line in process.stderr:
+                stats.stderr_lines += 1
+                logger.warning(f"ffmpeg {process.pid} (guild {guild_id}): {line.decode(errors='replace').rstrip()}")
+        except (OSError, ValueError):
+            pass  # pipe closed by the reaper
+
+    def release(self, process):
+        """Terminate ``process`` and hand it to the reaper; safe to call more than once."""
+        with self.lock:
+            if process in self.reaping:
+                return
+            self.processes.pop(process, None)
+            if process.poll() is None:
+                process.terminate()
+            self.reaping[process] = time.monotonic() + self.kill_timeout
+            self._start_reaper()
+
+    @staticmethod
+    def _close_pipes(process):
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            if pipe:
+                try:
+                    pipe.close()
+                except (OSError, ValueError):
+                    pass
+
+    def _start_reaper(self):
+        if self.reaper is None or not self.reaper.is_alive():
+            self.reaper = threading.Thread(target=self._reap, name="ffmpeg-reaper", daemon=True)
+            self.reaper.start()
+
+    def _poll(self):
+        # poll() collects the exit status, so finished processes don't linger as zombies
+        for process in list(self.processes):
+            process.poll()
+        now = time.monotonic()
+        # Pipes are closed here rather than in release() so a reader thread never sees them vanish mid-read
+        for process, deadline in list(self.reaping.items()):
+            if process.poll() is not None:
+                del self.reaping[process]
+                self._close_pipes(process)
+            elif now >= deadline:
+                logger.warning(f"ffmpeg {process.pid} ignored terminate, killing it")
+                process.kill()
+                self.reaping[process] = now + self.kill_timeout
+
+    def _reap(self):
+        while True:
+            time.sleep(0.5)
+            with self.lock:
+                self._poll()
+                if not self.processes and not self.reaping:
+                    self.reaper = None
+                    return
+
+    def stats(self):
+        with self.lock:
+            self._poll()
+            per_guild = {}
+            for guild_id in self.processes.values():
+                per_guild[guild_id] = per_guild.get(guild_id, 0) + 1
+            running = sum(1 for process in self.processes if process.returncode is None)
+            try:
+                fds = len(os.listdir('/proc/self/fd'))
+            except OSError:
+                fds = None
+            return {'processes': running, 'tracked': len(self.processes), 'reaping': len(self.reaping), 'open_fds': fds, 'per_guild': per_guild}
+
+ffmpeg_supervisor = FFmpegSupervisor()
+
+def ffmpeg_input(url, is_local, **input_args):
+    if is_local:
+        absolute_path = os.path.abspath(url)
+        logger.info(f"Resolved local file path: {absolute_path}")
+        if not os.path.exists(absolute_path):
+            raise FileNotFoundError(f"Local file not found: {absolute_path}")
+        return ffmpeg.input(absolute_path, **input_args)
+    return ffmpeg.input(url, reconnect=1, reconnect_streamed=1, reconnect_delay_max=5, **input_args)
+
+def start_shared_decoder(url, is_local):
+    cached = None if is_local else transcode_cache.lookup(url)
+    if cached:
+        url, is_local = cached, True
+    # -re paces decoding at real time, so listeners share one timeline instead of racing ahead
+    stream = ffmpeg_input(url, is_local, re=None)
+    stream = ffmpeg.output(stream, 'pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
+    return ffmpeg_supervisor.spawn(stream)
+
+class BroadcastDecoder:
+    """One ffmpeg process whose PCM frames are shared by every subscribed listener.
+
+    Frames go into a ring of ``ring_frames``; a listener that falls out of the ring is resynced
+    near the live edge instead of holding the decoder or the other listeners back. New listeners
+    only join while the ring still holds the first frame, so every listener plays the track from
+    its start and its position is simply the frames it read.
+    """
+
+    def __init__(self, key, process, ring_frames=250):
+        self.key = key
+        self.process = process
+        self.ring = deque(maxlen=ring_frames)
+        self.next_seq = 0  # sequence number of the next frame to be decoded
+        self.eof = False
+        self.listeners = set()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+
+    def _pump(self):
+        while True:
+            data = self.process.stdout.read(FRAME_SIZE)
+            with self.condition:
+                if not data or self.eof:
+                    self.eof = True
+                    self.condition.notify_all()
+                    return
+                self.ring.append(data)
+                self.next_seq += 1
+                self.condition.notify_all()
+
+    def joinable(self):
+        """Whether a new listener can still start from the first frame; call with the condition held."""
+        return not self.eof and self.next_seq <= len(self.ring)
+
+    def stop(self):
+        with self.condition:
+            self.eof = True
+            self.condition.notify_all()
+        ffmpeg_supervisor.release(self.process)
+
+class BroadcastListener:
+    """A file-like reader over a BroadcastDecoder, one per voice client."""
+
+    def __init__(self, hub, decoder, resync_frames=5):
+        self.hub = hub
+        self.decoder = decoder
+        self.cursor = decoder.next_seq - len(decoder.ring)  # the oldest frame still held
+        self.resync_frames = resync_frames
+        self.resyncs = 0
+        self.skipped = 0  # frames jumped over by resyncs and not yet counted by the reader
+        self.closed = False
+
+    def read(self, size=FRAME_SIZE):
+        decoder = self.decoder
+        with decoder.condition:
+            while self.cursor >= decoder.next_seq and not decoder.eof and not self.closed:
+                decoder.condition.wait()
+            oldest = decoder.next_seq - len(decoder.ring)
+            if self.cursor < oldest:
+                self.resyncs += 1
+                resynced = max(oldest, decoder.next_seq - self.resync_frames)
+                self.skipped += resynced - self.cursor
+                self.cursor = resynced
+            if self.closed or self.cursor >= decoder.next_seq:
+                return b''
+            data = decoder.ring[self.cursor - oldest]
+            self.cursor += 1
+            return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub.unsubscribe(self)
+
+class BroadcastHub:
+    """Runs one decoder per unique source and fans its frames out to every guild playing it."""
+
+    def __init__(self, spawn=start_shared_decoder, ring_frames=250):
+        self.spawn = spawn
+        self.ring_frames = ring_frames
+        self.decoders = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, url, is_local):
+        key = (os.path.abspath(url) if is_local else url, is_local)
+        with self.lock:
+            decoder = self.decoders.get(key)
+            if decoder is not None:
+                with decoder.condition:
+                    listener = BroadcastListener(self, decoder) if decoder.joinable() else None
+            if decoder is None or listener is None:
+                # Too far in to start from the beginning: this listener gets a decoder of its own,
+                # which later listeners join; the old one keeps serving its listeners until they leave
+                decoder = BroadcastDecoder(key, self.spawn(url, is_local), self.ring_frames)
+                self.decoders[key] = decoder
+                listener = BroadcastListener(self, decoder)
+            decoder.listeners.add(listener)
+        with decoder.condition:
+            decoder.condition.notify_all()
+        return listener
+
+    def unsubscribe(self, listener):
+        decoder = listener.decoder
+        with self.lock:
+            decoder.listeners.discard(listener)
+            if decoder.listeners:
+                with decoder.condition:
+                    decoder.condition.notify_all()
+                return
+            if self.decoders.get(decoder.key) is decoder:
+                del self.decoders[decoder.key]
+        decoder.stop()
+
+broadcast_hub = BroadcastHub()
+
+class TranscodeCache:
+    """Size-bounded on-disk cache of remote tracks, transcoded to Opus while they first play.
+
+    Files are named by a hash of the video ID (or the URL for direct links) and written by a
+    CacheTee under a temporary name that is only renamed into place once the whole track was
+    written, so a skipped or failed play never leaves a partial entry. Least recently played files
+    are removed once ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, directory=TRANSCODE_CACHE_DIR, max_bytes=TRANSCODE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # file name -> size, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        files = [entry for entry in os.scandir(directory) if entry.name.endswith('.opus')]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+
+    def file_name(self, url):
+        key = youtube_resolver.stream_keys.get(url, url)
+        return hashlib.sha256(key.encode()).hexdigest() + '.opus'
+
+    def lookup(self, url):
+        """Return the local path for a cached remote track, or None."""
+        name = self.file_name(url)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)  # mtime doubles as the LRU order across restarts
+        except OSError:
+            self.discard(name)
+            return None
+        return path
+
+    def temp_path(self, url):
+        return os.path.join(self.directory, f"{self.file_name(url)}.{os.getpid()}.{threading.get_ident()}.{time.monotonic_ns()}.part")
+
+    def commit(self, url, temp_path):
+        name = self.file_name(url)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, os.path.join(self.directory, name))
+        with self.lock:
+            self.size += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            evicted = []
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                old_name, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+        logger.info(f"Cached transcoded track {name} ({size} bytes)")
+
+    def discard(self, name):
+        with self.lock:
+            self.size -= self.entries.pop(name, 0)
+
+class CacheTee:
+    """File-like wrapper over a playback ffmpeg's stdout that copies what it reads into the cache.
+
+    Reads only hand each chunk to a bounded queue; a writer thread drains it into the temporary
+    cache file, through a separate low-priority encoder for PCM or as is for remuxed Ogg/Opus. If the
+    writer falls ``backlog`` chunks behind (a slow disk, a busy encoder), the copy is dropped instead
+    of holding playback back. It is committed only when the track was read to the end and both
+    processes exited cleanly.
+    """
+
+    def __init__(self, pipe, process, url, temp_path, encode, cache=None, backlog=TRANSCODE_CACHE_BACKLOG):
+        self.pipe = pipe
+        self.process = process
+        self.url = url
+        self.temp_path = temp_path
+        self.encode = encode
+        self.cache = cache or transcode_cache
+        self.queue = Queue(maxsize=backlog)
+        self.dropped = False
+        self.done = False  # nothing more is queued once the track ended or the copy was dropped
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def read(self, size=-1):
+        data = self.pipe.read(size)
+        if not self.done:
+            try:
+                self.queue.put_nowait(data or None)
+                self.done = not data
+            except Full:
+                logger.info(f"Transcode cache writer fell behind, not caching {self.url}")
+                self.drop()
+        return data
+
+    def drop(self):
+        self.dropped = self.done = True
+        try:
+            self.queue.put_nowait(None)  # wakes an idle writer; a busy one sees the flag
+        except Full:
+            pass
+
+    def close(self):
+        if not self.done:
+            self.drop()  # stopped before the end, so the copy is incomplete
+        self.pipe.close()
+
+    def _open(self):
+        if not self.encode:
+            return None, open(self.temp_path, 'wb')
+        stream = ffmpeg.input('pipe:', format='s16le', ar=48000, ac=2)
+        stream = ffmpeg.output(stream, self.temp_path, format='opus', acodec='libopus', audio_bitrate='96k', map_metadata=-1)
+        encoder = ffmpeg_supervisor.spawn(stream, pipe_stdin=True, nice=True)
+        return encoder, encoder.stdin
+
+    def _write(self):
+        encoder = None
+        try:
+            encoder, sink = self._open()
+            with sink:
+                while True:
+                    data = self.queue.get()
+                    if data is None or self.dropped:
+                        break
+                    sink.write(data)
+            complete = not self.dropped and self.process.wait() == 0 and (encoder is None or encoder.wait() == 0)
+        except Exception as e:
+            # E.g. the supervisor refused the encoder, or it died; stop queueing for it
+            logger.warning(f"Not caching {self.url}: {e}")
+            self.drop()
+            complete = False
+        finally:
+            if encoder is not None:
+                ffmpeg_supervisor.release(encoder)
+                encoder.wait()  # until it exits it may still create or write the file
+        if complete and os.path.exists(self.temp_path):
+            self.cache.commit(self.url, self.temp_path)
+        elif os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+transcode_cache = TranscodeCache()
+
+SOUNDBOARD_SOUNDS = {
+    "Deja-vu": "./music/deja-vu.mp3",
+}
+
+def decode_to_pcm(path):
+    stream = ffmpeg.input(path).output('pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
+    process = ffmpeg_supervisor.spawn(stream, drain_stderr=False)
+    try:
+        out, err = process.communicate()
+    finally:
+        ffmpeg_supervisor.release(process)
+    if process.returncode:
+        raise ffmpeg.Error('ffmpeg', out, err)
+    return out
+
+class SoundboardCache:
+    """Decoded PCM for local soundboard files, so a click plays from memory without spawning ffmpeg.
+
+    Entries are evicted least-recently-used once ``max_bytes`` is exceeded and re-decoded when the
+    file's mtime changes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, decode=decode_to_pcm):
+        self.max_bytes = max_bytes
+        self.decode = decode
+        self.entries = OrderedDict()  # absolute path -> (mtime, pcm bytes)
+        self.size = 0
+
+    def lookup(self, path):
+        """Return cached PCM if it is still current, without decoding."""
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if entry is None or entry[0] != mtime:
+            return None
+        self.entries.move_to_end(path)
+        return entry[1]
+
+    async def load(self, path):
+        pcm = self.lookup(path)
+        if pcm is not None:
+            return pcm
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        pcm = await asyncio.get_running_loop().run_in_executor(None, self.decode, path)
+        self.store(path, mtime, pcm)
+        return pcm
+
+    def store(self, path, mtime, pcm):
+        old = self.entries.pop(path, None)
+        if old:
+            self.size -= len(old[1])
+        if len(pcm) > self.max_bytes:
+            return
+        self.entries[path] = (mtime, pcm)
+        self.size += len(pcm)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    async def preload(self, paths):
+        for path in paths:
+            try:
+                await self.load(path)
+                logger.info(f"Cached soundboard sound: {path}")
+            except Exception as e:
+                logger.error(f"Failed to cache soundboard sound {path}: {e}")
+
+soundboard_cache = SoundboardCache()
+
+class AudioPlayer:
+    # Players stay around for every guild that used the bot recently, so keep them small
+    __slots__ = (
+        'guild_id', 'queue', 'voice_client', 'current_source', 'volume', 'speed', 'playing', 'paused',
+        'ffmpeg_process', 'audio_source', 'mixer', 'opus_passthrough', 'prewarm_seconds', 'prewarm_frames',
+        'prewarmed', 'resolve_ahead_count', 'last_active', 'resume_attempts', 'output',
+    )
+
+    def __init__(self, guild_id=None, prewarm_seconds=5.0, prewarm_frames=50, opus_passthrough=OPUS_PASSTHROUGH):
+        self.guild_id = guild_id
         self.queue = deque()
         self.voice_client = None
         self.current_source = None  # (url/path, title, is_local)
@@ -51,128 +1175,387 @@ class AudioPlayer:
         self.playing = False
         self.paused = False
         self.ffmpeg_process = None
+        self.audio_source = None
+        self.mixer = None  # wraps audio_source on the PCM path so effects can be layered on top
+        self.opus_passthrough = opus_passthrough  # send Opus from ffmpeg unless speed needs the PCM path
+        self.prewarm_seconds = prewarm_seconds  # start decoding the next track this long before the current one ends
+        self.prewarm_frames = prewarm_frames
+        self.prewarmed = None
+        self.resolve_ahead_count = 3
+        self.last_active = time.monotonic()
+        self.resume_attempts = 0
+        self.output = None  # what was last passed to voice_client.play(); its after= callback is bound to it
 
-    async def play_next(self):
-        if not self.queue or not self.voice_client:
-            self.playing = False
-            logger.info("Queue empty or no voice client, stopping playback.")
-            return
+    def use_opus(self):
+        # Effects that are still mixing need the track on the PCM path to stay audible
+        mixing = self.mixer is not None and bool(self.mixer.effects)
+        return self.opus_passthrough and self.speed == 1.0 and not SHARED_DECODING and not mixing
 
-        self.playing = True
-        self.paused = False
-        url, title, is_local = self.queue.popleft()
-        self.current_source = (url, title, is_local)
-        logger.info(f"Playing next: {title} (URL/Path: {url}, Local: {is_local})")
+    def start_ffmpeg(self, url, is_local, opus=False, seek=0.0):
+        """Spawn ffmpeg for the source.
+
+        Without ``opus`` it decodes to raw PCM and volume/speed are applied by PCMTransformSource.
+        With ``opus`` it outputs Ogg/Opus with the volume baked in, remuxing without re-encoding
+        when the source already is Opus at unity volume.
+        """
+        remote_url = None
+        if not is_local:
+            cached = transcode_cache.lookup(url)
+            if cached:
+                logger.info(f"Serving {url} from the transcode cache")
+                url, is_local = cached, True
+            elif not seek:
+                remote_url = url
+
+        source = ffmpeg_input(url, is_local, **({'ss': seek} if seek else {}))
+        # Only output without volume baked in can be cached: PCM is encoded by the cache writer, remuxed Opus kept as is
+        encode = not opus
+        if not opus:
+            stream = ffmpeg.output(source, 'pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
+        elif self.volume == 1.0 and not is_local and is_opus_url(url):
+            stream = ffmpeg.output(source, 'pipe:', format='opus', acodec='copy', map_metadata=-1, page_duration=20000)
+        else:
+            stream = ffmpeg.filter(source, 'volume', volume=self.volume)
+            stream = ffmpeg.output(stream, 'pipe:', format='opus', acodec='libopus', ac=2, ar=48000, audio_bitrate='128k', map_metadata=-1, page_duration=20000)
+            remote_url = None
+        process = ffmpeg_supervisor.spawn(stream, guild_id=self.guild_id)
+        if remote_url:
+            # Copy what playback reads to disk the first time the track plays; every reader goes through stdout
+            process.stdout = CacheTee(process.stdout, process, remote_url, transcode_cache.temp_path(remote_url), encode)
+        return process
+
+    def make_source(self, stream, opus=False, offset=0.0):
+        stats = playback_metrics.guild(self.guild_id)
+        if opus:
+            return OpusPipeSource(stream, offset=offset, stats=stats, volume=self.volume)
+        return PCMTransformSource(stream, volume=self.volume, speed=self.speed, offset=offset, stats=stats)
 
+    def buffer_pipe(self, pipe, opus=False):
+        # Opus at 128 kb/s is ~16 KB/s against 192 KB/s of PCM; size the pre-roll in audio time
+        bytes_per_second = 16000 if opus else 192000
+        return PipeBuffer(
+            pipe,
+            capacity=int(JITTER_BUFFER_SECONDS * bytes_per_second),
+            preroll=int(JITTER_PREROLL_SECONDS * bytes_per_second),
+            stats=playback_metrics.guild(self.guild_id),
+        )
+
+    def start_source(self, process, stream=None, prewarm=True, opus=False):
+        if process is not None:
+            stream = self.buffer_pipe(stream or process.stdout, opus=opus)
+        self.audio_source = self.make_source(stream, opus=opus)
+        if prewarm and self.prewarm_seconds > 0:
+            self.arm_prewarm(self.audio_source, stream, process)
+        busy = self.voice_client.is_playing() or self.voice_client.is_paused()
+        if busy and self.mixer and not opus and self.voice_client.source is self.mixer:
+            # Effects are still playing on their own: start the track under them instead of cutting them off
+            self.mixer.set_music(self.audio_source)
+        else:
+            if busy:
+                self.voice_client.stop()
+            self.mixer = None if opus else MixerSource(self.audio_source)
+            self.play_output(self.mixer or self.audio_source)
+
+    def arm_prewarm(self, source, stream, process):
+        """Have ``source`` pre-warm the next track ``prewarm_seconds`` before it ends.
+
+        YouTube tracks know their length from yt-dlp. For other tracks the end shows up in the
+        jitter buffer: ffmpeg decodes ahead until the buffer is full, so once its output ends only
+        the buffered audio is left, and on the PCM path the bytes read give the exact length.
+        """
+        source.lookahead = self.prewarm_seconds
+        source.on_near_end = lambda: client.loop.call_soon_threadsafe(self.prewarm_next)
+        url, _, is_local = self.current_source
+        if source.duration is None and not is_local:
+            source.duration = youtube_resolver.duration(url)
+        if source.duration is None and process is not None and isinstance(stream, PipeBuffer):
+            stream.on_eof = lambda received: self.decoder_finished(source, process, received)
+
+    @staticmethod
+    def decoder_finished(source, process, received):
+        # Called from the buffer's pump thread once ffmpeg's output ended
         try:
-            if self.ffmpeg_process:
-                self.ffmpeg_process.terminate()
-                self.ffmpeg_process = None
-
-            if is_local:
-                absolute_path = os.path.abspath(url)
-                logger.info(f"Resolved local file path: {absolute_path}")
-                if not os.path.exists(absolute_path):
-                    raise FileNotFoundError(f"Local file not found: {absolute_path}")
-                stream = ffmpeg.input(absolute_path)
-            else:
-                stream = ffmpeg.input(url, reconnect=1, reconnect_streamed=1, reconnect_delay_max=5)
+            if process.wait(timeout=2) != 0:
+                return  # a decoder that died mid-way says nothing about the length; track_ended resumes it
+        except subprocess.TimeoutExpired:
+            return
+        if isinstance(source, PCMTransformSource) and not isinstance(source.stream, OpusDecodeStream):
+            source.duration = source.offset + received / (FRAME_SIZE * 50)
+        elif source.on_near_end:
+            # Opus pages don't map bytes to time, but what is left is at most the buffer
+            callback, source.on_near_end = source.on_near_end, None
+            callback()
+
+    def prewarm_next(self):
+        """Start decoding the head of the queue so play_next can hand over without a gap."""
+        if SHARED_DECODING or not self.queue or (self.prewarmed and self.prewarmed.entry is self.queue[0]):
+            return
+        self.cancel_prewarm()
+        entry = self.queue[0]
+        if isinstance(entry, PlaylistEntry):
+            resolved = youtube_resolver.cached(entry.page_url)
+            if not resolved:
+                return
+            url, title, is_local = resolved[0], resolved[1], False
+        else:
+            url, title, is_local = entry
+        try:
+            opus = self.use_opus()
+            process = self.start_ffmpeg(url, is_local, opus=opus)
+            self.prewarmed = PrewarmedTrack(entry, process, self.prewarm_frames, opus=opus, volume=self.volume, url=url)
+            logger.info(f"Pre-warming next track: {title}")
+        except Exception as e:
+            logger.error(f"Failed to pre-warm {title}: {e}")
 
-            stream = ffmpeg.filter(stream, 'volume', volume=self.volume)
-            stream = ffmpeg.filter(stream, 'atempo', tempo=self.speed)
-            stream = ffmpeg.output(stream, 'pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
-            self.ffmpeg_process = ffmpeg.run_async(stream, pipe_stdout=True, pipe_stderr=True)
+    def resolve_ahead(self):
+        """Resolve playlist entries once they are within ``resolve_ahead_count`` of the queue head."""
+        for entry in itertools.islice(self.queue, self.resolve_ahead_count):
+            if isinstance(entry, PlaylistEntry) and not youtube_resolver.cached(entry.page_url):
+                asyncio.create_task(self.resolve_entry(entry))
 
-            source = discord.PCMAudio(self.ffmpeg_process.stdout)
-            self.voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(), client.loop))
-            logger.info(f"Started playing: {title}")
-            return title
+    async def resolve_entry(self, entry):
+        try:
+            await youtube_resolver.resolve(entry.page_url)
         except Exception as e:
-            logger.error(f"Error playing audio: {e}", exc_info=True)
-            self.playing = False
-            await self.play_next()
+            logger.error(f"Failed to resolve playlist entry {entry.title}: {e}")
 
-    async def play_immediate(self, url, title, is_local):
-        """Play a sound immediately, interrupting current playback and clearing the queue."""
-        if not self.voice_client:
-            logger.info("No voice client available for immediate play.")
-            return
+    def prewarm_matches(self, prewarmed):
+        # A PCM pre-warm takes any volume/speed live; an Opus one has its volume baked in
+        if not prewarmed.opus:
+            return True
+        return self.use_opus() and prewarmed.volume == self.volume
 
-        # Stop current playback and clear queue
-        if self.playing and self.voice_client.is_playing():
-            self.voice_client.stop()
-        if self.ffmpeg_process:
-            self.ffmpeg_process.terminate()
-            self.ffmpeg_process = None
-        self.queue.clear()  # Clear any pending items
-        self.paused = False
+    def cancel_prewarm(self):
+        if self.prewarmed:
+            self.prewarmed.cancel()
+            self.prewarmed = None
+
+    def play_output(self, output):
+        """Start ``output`` on the voice client, with the end callback bound to it.
 
-        # Set up new playback
-        self.playing = True
-        self.current_source = (url, title, is_local)
-        logger.info(f"Playing immediately: {title} (URL/Path: {url}, Local: {is_local})")
+        Swapping ``voice_client.source`` keeps the callback, so ``output`` stays current across swaps;
+        only a new play() replaces it, and the callback of a replaced output is then ignored.
+        """
+        self.output = output
+        self.voice_client.play(output, after=lambda error, output=output: self.on_source_end(error, output))
 
+    def on_source_end(self, error, output):
+        # Called from the voice thread
+        asyncio.run_coroutine_threadsafe(self.track_ended(output), client.loop)
+
+    async def track_ended(self, output):
+        """Resume a track whose decoder died mid-way at the same position; otherwise move on."""
+        if output is not self.output:
+            return  # stopped to make way for something else, which owns the decoder now
+        if not self.playing:
+            return  # only effects were playing, the queue was not started
+        process, source = self.ffmpeg_process, self.audio_source
+        failed = process is not None and process.poll() not in (None, 0)
+        unfinished = source is not None and (source.duration is None or source.elapsed < source.duration - 1)
+        if failed and unfinished and self.voice_client and self.resume_attempts < 3:
+            self.resume_attempts += 1
+            logger.warning(f"Decoder exited with {process.returncode}, resuming at {source.elapsed:.1f}s (attempt {self.resume_attempts})")
+            if self.restart_at(source.elapsed, opus=isinstance(source, OpusPipeSource)):
+                return
+        await self.play_next()
+
+    @property
+    def position(self):
+        """Seconds into the current track, from the frames consumed so far."""
+        return self.audio_source.elapsed if self.audio_source else 0.0
+
+    def restart_at(self, position, opus=False):
+        """Restart the current track at ``position`` with input-side seeking, keeping effects and pre-warm."""
+        old_source, old_mixer = self.audio_source, self.mixer
+        url, title, is_local = self.current_source
         try:
-            if is_local:
-                absolute_path = os.path.abspath(url)
-                logger.info(f"Resolved local file path: {absolute_path}")
-                if not os.path.exists(absolute_path):
-                    raise FileNotFoundError(f"Local file not found: {absolute_path}")
-                stream = ffmpeg.input(absolute_path)
+            process = self.start_ffmpeg(url, is_local, opus=opus, seek=position)
+        except Exception as e:
+            logger.error(f"Failed to restart {title} at {position:.1f}s: {e}", exc_info=True)
+            return False
+        stream = self.buffer_pipe(process.stdout, opus=opus)
+        source = self.make_source(stream, opus=opus, offset=position)
+        if old_source:
+            source.duration = old_source.duration
+            if old_source.on_near_end:
+                self.arm_prewarm(source, stream, process)
+        old_process, self.ffmpeg_process = self.ffmpeg_process, process
+        self.audio_source = source
+        paused = self.voice_client.is_paused()
+        busy = paused or self.voice_client.is_playing()
+        if busy and not opus and old_mixer and self.voice_client.source is old_mixer:
+            # The mixer keeps playing (and stays paused); only the music under it changes
+            old_mixer.set_music(source)
+        else:
+            self.mixer = None if opus else MixerSource(source)
+            if self.mixer and old_mixer:
+                with old_mixer.lock:
+                    self.mixer.effects, old_mixer.effects = old_mixer.effects, []
+            if busy:
+                # Swaps without firing the after= callback, but discord.py resumes the player doing so
+                self.voice_client.source = self.mixer or source
+                if paused:
+                    self.voice_client.pause()
             else:
-                stream = ffmpeg.input(url, reconnect=1, reconnect_streamed=1, reconnect_delay_max=5)
+                self.play_output(self.mixer or source)
+        if old_process:
+            ffmpeg_supervisor.release(old_process)
+        playback_metrics.guild(self.guild_id).restarts += 1
+        return True
 
-            stream = ffmpeg.filter(stream, 'volume', volume=self.volume)
-            stream = ffmpeg.filter(stream, 'atempo', tempo=self.speed)
-            stream = ffmpeg.output(stream, 'pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
-            self.ffmpeg_process = ffmpeg.run_async(stream, pipe_stdout=True, pipe_stderr=True)
+    async def seek(self, position):
+        """Jump to ``position`` seconds in the current track."""
+        if not self.playing or not self.current_source or not self.voice_client:
+            return False
+        source = self.audio_source
+        if source is not None and source.duration:
+            position = min(position, max(0.0, source.duration - 1))
+        position = max(0.0, position)
+        logger.info(f"Seeking {self.current_source[1]} to {position:.1f}s")
+        return self.restart_at(position, opus=isinstance(source, OpusPipeSource) and self.use_opus())
 
-            source = discord.PCMAudio(self.ffmpeg_process.stdout)
-            self.voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(), client.loop))
-            logger.info(f"Started playing immediately: {title}")
-        except Exception as e:
-            logger.error(f"Error playing immediate audio: {e}", exc_info=True)
-            self.playing = False
+    async def play_next(self):
+        # Entries that fail to start are skipped in a loop; running out of decoders or a busy voice
+        # client would fail every entry the same way, so those keep the entry queued and stop instead
+        while self.queue and self.voice_client:
+            self.playing = True
+            self.paused = False
+            self.resume_attempts = 0
+            entry = self.queue.popleft()
+            self.resolve_ahead()
+
+            try:
+                if isinstance(entry, PlaylistEntry):
+                    # Cheap when resolve_ahead already did it; re-resolves if the signed URL went stale
+                    audio_url, title = await youtube_resolver.resolve(entry.page_url)
+                    self.current_source = (audio_url, title, False)
+                else:
+                    self.current_source = entry
+                url, title, is_local = self.current_source
+                logger.info(f"Playing next: {title} (URL/Path: {url}, Local: {is_local})")
+
+                if self.ffmpeg_process:
+                    ffmpeg_supervisor.release(self.ffmpeg_process)
+                    self.ffmpeg_process = None
+
+                prewarmed, self.prewarmed = self.prewarmed, None
+                if prewarmed and prewarmed.entry is entry and prewarmed.url == url and self.prewarm_matches(prewarmed):
+                    self.ffmpeg_process = prewarmed.process
+                    self.start_source(self.ffmpeg_process, prewarmed.take(), opus=prewarmed.opus)
+                else:
+                    if prewarmed:
+                        prewarmed.cancel()  # queue was skipped, reordered or settings changed since pre-warming
+                    if SHARED_DECODING:
+                        self.start_source(None, broadcast_hub.subscribe(url, is_local))
+                    else:
+                        opus = self.use_opus()
+                        self.ffmpeg_process = self.start_ffmpeg(url, is_local, opus=opus)
+                        self.start_source(self.ffmpeg_process, opus=opus)
+                logger.info(f"Started playing: {title}")
+                return title
+            except (DecoderLimitError, discord.ClientException) as e:
+                logger.error(f"Cannot start playback, keeping the queue: {e}")
+                self.queue.appendleft(entry)
+                break
+            except Exception as e:
+                logger.error(f"Error playing audio: {e}", exc_info=True)
+                playback_metrics.guild(self.guild_id).restarts += 1
+
+        self.playing = False
+        if self.ffmpeg_process:
+            ffmpeg_supervisor.release(self.ffmpeg_process)
+            self.ffmpeg_process = None
+        logger.info("Queue empty or no voice client, stopping playback.")
 
     async def adjust_audio(self):
-        """Restart the current audio with updated volume/speed settings."""
-        if not self.playing or self.paused or not self.voice_client or not self.current_source:
+        """Apply the current volume/speed to the playing source; takes effect on the next frame."""
+        if not self.playing or not self.audio_source:
             return
 
-        url, title, is_local = self.current_source
-        logger.info(f"Adjusting audio - Volume: {self.volume}, Speed: {self.speed} for {title}")
+        logger.info(f"Adjusting audio - Volume: {self.volume}, Speed: {self.speed}")
+        if isinstance(self.audio_source, OpusPipeSource):
+            self.switch_to_pcm()
+            return
+        self.audio_source.volume = self.volume
+        self.audio_source.speed = self.speed
 
-        try:
-            if self.ffmpeg_process:
-                self.ffmpeg_process.terminate()
-                self.ffmpeg_process = None
-
-            if is_local:
-                absolute_path = os.path.abspath(url)
-                logger.info(f"Adjusting local file path: {absolute_path}")
-                if not os.path.exists(absolute_path):
-                    raise FileNotFoundError(f"Local file not found: {absolute_path}")
-                stream = ffmpeg.input(absolute_path)
-            else:
-                stream = ffmpeg.input(url, reconnect=1, reconnect_streamed=1, reconnect_delay_max=5)
+    def switch_to_pcm(self):
+        """Continue an Opus passthrough track on the PCM path from where it is now.
 
-            stream = ffmpeg.filter(stream, 'volume', volume=self.volume)
-            stream = ffmpeg.filter(stream, 'atempo', tempo=self.speed)
-            stream = ffmpeg.output(stream, 'pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
-            self.ffmpeg_process = ffmpeg.run_async(stream, pipe_stdout=True, pipe_stderr=True)
+        The packets already decoded ahead are decoded in-process, so ffmpeg keeps running and a
+        remote source is not fetched again.
+        """
+        old_source = self.audio_source
+        if not discord.opus.is_loaded():
+            logger.warning(f"libopus is not loaded, {self.current_source[1]} stays on Opus passthrough")
+            return False
+        paused = self.voice_client.is_paused()
+        source = PCMTransformSource(
+            OpusDecodeStream(old_source), volume=self.volume, speed=self.speed,
+            offset=old_source.elapsed, stats=playback_metrics.guild(self.guild_id),
+        )
+        source.duration = old_source.duration
+        if old_source.on_near_end:
+            source.lookahead = old_source.lookahead
+            source.on_near_end, old_source.on_near_end = old_source.on_near_end, None
+            stream, process = source.stream.stream, self.ffmpeg_process
+            if isinstance(stream, PipeBuffer) and stream.on_eof and process is not None:
+                stream.on_eof = lambda received: self.decoder_finished(source, process, received)
+        self.audio_source = source
+        self.mixer = MixerSource(source)
+        # discord.py only sets up its Opus encoder in play(), so a PCM source can't be swapped in
+        # under a player that started on Opus; the old output's end callback is ignored
+        self.voice_client.stop()
+        self.play_output(self.mixer)
+        if paused:
+            self.voice_client.pause()
+        logger.info(f"Switched {self.current_source[1]} from Opus passthrough to PCM at {source.offset:.1f}s")
+        return True
 
-            source = discord.PCMAudio(self.ffmpeg_process.stdout)
-            self.voice_client.stop()
-            self.voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(), client.loop))
-            logger.info(f"Restarted audio with new settings: {title}")
+    async def play_effect(self, url, title, is_local, pcm=None, gain=1.0):
+        """Layer a sound effect over whatever is playing, leaving the music, its decoder and the queue alone."""
+        if not self.voice_client:
+            logger.info("No voice client available for sound effect.")
+            return
+        # A passthrough track is taken onto the PCM path in-process before anything is started for the effect
+        if self.playing and isinstance(self.audio_source, OpusPipeSource) and not self.switch_to_pcm():
+            logger.info(f"Cannot mix {title} over Opus passthrough without libopus")
+            return
+
+        process = None
+        try:
+            if pcm is not None:
+                stream = io.BytesIO(pcm)
+            else:
+                process = self.start_ffmpeg(url, is_local)
+                stream = process.stdout
         except Exception as e:
-            logger.error(f"Failed to adjust audio: {e}", exc_info=True)
-            self.playing = False
+            logger.error(f"Error starting sound effect: {e}", exc_info=True)
+            return
+        effect = PCMTransformSource(stream, volume=self.volume)
+        on_done = (lambda: ffmpeg_supervisor.release(process)) if process else None
+
+        if self.mixer and (self.voice_client.is_playing() or self.voice_client.is_paused()):
+            self.mixer.add(effect, gain=gain, on_done=on_done)
+        else:
+            # Nothing to mix with: play the effect on its own, without advancing the queue afterwards
+            self.mixer = MixerSource()
+            self.mixer.add(effect, gain=gain, on_done=on_done)
+            if self.voice_client.is_playing():
+                self.voice_client.source = self.mixer
+            else:
+                # track_ended ignores the end of effects played on their own, unless a track joined them
+                self.play_output(self.mixer)
+        logger.info(f"Mixing sound effect: {title}")
 
     def cleanup(self):
         if self.ffmpeg_process:
-            self.ffmpeg_process.terminate()
+            ffmpeg_supervisor.release(self.ffmpeg_process)
             self.ffmpeg_process = None
+        self.audio_source = None
+        self.mixer = None
+        self.output = None
+        self.cancel_prewarm()
         if self.voice_client:
             self.voice_client.stop()
             self.voice_client = None
@@ -192,9 +1575,18 @@ class AddYouTubeModal(discord.ui.Modal, title="Add YouTube"):
         url = self.url_input.value.strip()
         if url:
             try:
-                audio_url, title = await get_youtube_audio_url(url)
-                is_local = False
-                player.queue.append((audio_url, title, is_local))
+                if is_playlist_url(url):
+                    entries = await youtube_resolver.expand_playlist(url)
+                    if not entries:
+                        await interaction.followup.send("That playlist has no playable entries.", ephemeral=True)
+                        return
+                    player.queue.extend(entries)
+                    title = f"playlist with {len(entries)} entries"
+                else:
+                    audio_url, title = await get_youtube_audio_url(url)
+                    is_local = False
+                    player.queue.append((audio_url, title, is_local))
+                player.resolve_ahead()
                 if not player.playing:
                     await player.play_next()
                 logger.info(f"Added to queue via modal: {title}")
@@ -229,7 +1621,7 @@ class SoundboardView(discord.ui.View):
 
     @discord.ui.button(label="Deja-vu", style=discord.ButtonStyle.blurple, custom_id="sound_Deja-vu")
     async def Deja_vu_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.play_sound(interaction, "./music/deja-vu.mp3", "Deja-vu")
+        await self.play_sound(interaction, SOUNDBOARD_SOUNDS["Deja-vu"], "Deja-vu")
 
     async def play_sound(self, interaction: discord.Interaction, sound_file: str, title: str):
         await interaction.response.defer()
@@ -240,9 +1632,12 @@ class SoundboardView(discord.ui.View):
         if not player.voice_client and interaction.user.voice and interaction.user.voice.channel:
             player.voice_client = await interaction.user.voice.channel.connect()
 
-        # Play the sound immediately, interrupting current playback
-        await player.play_immediate(sound_file, title, is_local=True)
-        logger.info(f"Played immediately from soundboard: {title}")
+        # Mix the sound over current playback, keeping the music and queue
+        pcm = soundboard_cache.lookup(sound_file)
+        await player.play_effect(sound_file, title, is_local=True, pcm=pcm)
+        if pcm is None:
+            asyncio.create_task(soundboard_cache.preload([sound_file]))
+        logger.info(f"Played from soundboard: {title}")
 
 class ControlPanelView(discord.ui.View):
     def __init__(self, guild_id):
@@ -272,7 +1667,8 @@ class ControlPanelView(discord.ui.View):
             _, title, _ = player.current_source
             embed.add_field(name="🎵 Now Playing", value=title, inline=False)
         if player.queue:
-            for i, (_, title, _) in enumerate(player.queue, 1):
+            # Embeds hold at most 25 fields; playlist entries render from their stored title only
+            for i, (_, title, _) in enumerate(itertools.islice(player.queue, QUEUE_DISPLAY_LIMIT), 1):
                 embed.add_field(name=f"🔢 {i}.", value=title, inline=False)
         else:
             embed.add_field(name="🔍 Queue", value="No songs queued.", inline=False)
@@ -371,7 +1767,6 @@ class ControlPanelView(discord.ui.View):
 async def control(interaction: discord.Interaction):
     guild_id = interaction.guild.id
     view = ControlPanelView(guild_id)
-    client.views[guild_id] = view
     embed = discord.Embed(title="Music Bot Control Panel", description="Use the buttons below to control the bot!", color=discord.Color.blue())
     await interaction.response.send_message(embed=embed, view=view)
 
@@ -390,13 +1785,21 @@ async def play_youtube(interaction: discord.Interaction, url: str):
         player.voice_client = await interaction.user.voice.channel.connect()
     
     try:
-        audio_url, title = await get_youtube_audio_url(url)
-        is_local = False
+        if is_playlist_url(url):
+            entries = await youtube_resolver.expand_playlist(url)
+            if not entries:
+                await interaction.followup.send("That playlist has no playable entries.")
+                return
+            player.queue.extend(entries)
+            title = f"{entries[0].title} (+{len(entries) - 1} more from playlist)"
+        else:
+            audio_url, title = await get_youtube_audio_url(url)
+            is_local = False
+            player.queue.append((audio_url, title, is_local))
     except Exception as e:
         await interaction.followup.send(f"Error processing YouTube URL: {str(e)}")
         return
-    
-    player.queue.append((audio_url, title, is_local))
+    player.resolve_ahead()
     
     if not player.playing:
         await player.play_next()
@@ -437,7 +1840,9 @@ async def soundboard(interaction: discord.Interaction):
     view = SoundboardView()
     await interaction.response.send_message("Soundboard:", view=view, ephemeral=True)
 
-async def get_youtube_audio_url(youtube_url):
+YOUTUBE_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|shorts/|embed/)([A-Za-z0-9_-]{11})')
+
+def extract_youtube_info(youtube_url):
     ydl_opts = {
         'format': 'bestaudio/best',
         'noplaylist': True,
@@ -445,7 +1850,141 @@ async def get_youtube_audio_url(youtube_url):
     }
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(youtube_url, download=False)
-        return info['url'], info.get('title', 'Unknown Title')
+        return info['url'], info.get('title', 'Unknown Title'), info.get('duration')
+
+def extract_youtube_playlist(playlist_url):
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'quiet': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
+        entries = []
+        for entry in info.get('entries') or []:
+            page_url = entry.get('url') or entry.get('id')
+            if not page_url:
+                continue
+            if not page_url.startswith('http'):
+                page_url = f"https://www.youtube.com/watch?v={page_url}"
+            entries.append((page_url, entry.get('title') or 'Unknown Title'))
+        return entries
+
+def is_playlist_url(url):
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    return parsed.path.rstrip('/').endswith('/playlist') or ('list' in query and 'v' not in query)
+
+class PlaylistEntry:
+    """A queued playlist video that is only resolved to a stream URL when it nears the queue head.
+
+    Iterates like a queue tuple so queue listings can show it without resolving anything.
+    """
+    __slots__ = ('page_url', 'title')
+
+    def __init__(self, page_url, title):
+        self.page_url = page_url
+        self.title = title
+
+    def __iter__(self):
+        return iter((self.page_url, self.title, False))
+
+class YouTubeResolver:
+    """Resolves YouTube links to stream URLs off the event loop.
+
+    Extraction runs in a bounded thread pool, concurrent requests for the same video share one
+    extraction, and results are cached until shortly before the signed URL expires. Past
+    ``max_entries`` the cache drops expired results first, then the least recently used ones.
+    """
+
+    def __init__(self, extract=extract_youtube_info, extract_playlist=extract_youtube_playlist, max_workers=4, default_ttl=3600, expiry_margin=300, max_entries=10000):
+        self.extract = extract
+        self.extract_playlist = extract_playlist
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yt-resolver")
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # video id -> (audio_url, title, expires_at, duration), least recently used first
+        self.pending = {}  # video id -> asyncio.Future
+        self.stream_keys = {}  # resolved audio_url -> video id, so caches can key on the stable ID
+
+    @staticmethod
+    def video_key(youtube_url):
+        match = YOUTUBE_ID_PATTERN.search(youtube_url)
+        return match.group(1) if match else youtube_url.strip()
+
+    def expires_at(self, audio_url):
+        # googlevideo stream URLs carry their expiry as a unix timestamp in the query string
+        expire = parse_qs(urlparse(audio_url).query).get('expire')
+        if expire and expire[0].isdigit():
+            return int(expire[0]) - self.expiry_margin
+        return time.time() + self.default_ttl
+
+    def cached(self, youtube_url):
+        """Return a still valid (audio_url, title) without resolving, or None."""
+        key = self.video_key(youtube_url)
+        cached = self.cache.get(key)
+        if cached and cached[2] > time.time():
+            self.cache.move_to_end(key)
+            return cached[0], cached[1]
+        return None
+
+    def duration(self, audio_url):
+        """The track length yt-dlp reported for a resolved stream URL, or None."""
+        cached = self.cache.get(self.stream_keys.get(audio_url))
+        return cached[3] if cached else None
+
+    def store(self, key, audio_url, title, duration=None):
+        self.discard(key)
+        self.cache[key] = (audio_url, title, self.expires_at(audio_url), duration)
+        self.stream_keys[audio_url] = key
+        if len(self.cache) > self.max_entries:
+            self.prune()
+
+    def discard(self, key):
+        cached = self.cache.pop(key, None)
+        if cached:
+            self.stream_keys.pop(cached[0], None)
+
+    def prune(self):
+        """Drop expired entries, then least recently used ones down to 90% of ``max_entries``.
+
+        The headroom keeps the full scan from running again on every following insert.
+        """
+        now = time.time()
+        for key in [key for key, cached in self.cache.items() if cached[2] <= now]:
+            self.discard(key)
+        while len(self.cache) > self.max_entries * 9 // 10:
+            self.discard(next(iter(self.cache)))
+
+    async def expand_playlist(self, playlist_url):
+        """Flat-extract a playlist into unresolved PlaylistEntry items, without fetching any stream URL."""
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(self.executor, self.extract_playlist, playlist_url)
+        return [PlaylistEntry(page_url, title) for page_url, title in entries]
+
+    async def resolve(self, youtube_url):
+        key = self.video_key(youtube_url)
+        cached = self.cached(youtube_url)
+        if cached:
+            return cached
+        self.discard(key)
+
+        if key not in self.pending:
+            loop = asyncio.get_running_loop()
+            self.pending[key] = loop.run_in_executor(self.executor, self.extract, youtube_url)
+        future = self.pending[key]
+        try:
+            audio_url, title, duration = await asyncio.shield(future)
+        finally:
+            if self.pending.get(key) is future and future.done():
+                del self.pending[key]
+        self.store(key, audio_url, title, duration)
+        return audio_url, title
+
+youtube_resolver = YouTubeResolver()
+
+async def get_youtube_audio_url(youtube_url):
+    return await youtube_resolver.resolve(youtube_url)
 
 @client.tree.command(name="queue", description="View the current audio queue")
 async def queue(interaction: discord.Interaction):
@@ -458,17 +1997,55 @@ async def queue(interaction: discord.Interaction):
     if player.current_source:
         _, title, _ = player.current_source
         embed.add_field(name="🎵 Now Playing", value=title, inline=False)
-    for i, (_, title, _) in enumerate(player.queue, 1):
+    for i, (_, title, _) in enumerate(itertools.islice(player.queue, QUEUE_DISPLAY_LIMIT), 1):
         embed.add_field(name=f"🔢 {i}.", value=title, inline=False)
     embed.set_footer(text=f"Total queued: {len(player.queue)}")
     await interaction.response.send_message(embed=embed)
 
+def parse_timestamp(value):
+    """Parse "90", "1:30" or "1:02:03" into seconds."""
+    seconds = 0.0
+    for part in value.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+@client.tree.command(name="seek", description="Jump to a position in the current track (e.g. 90 or 1:30)")
+async def seek(interaction: discord.Interaction, position: str):
+    player = client.get_audio_player(interaction.guild.id)
+    try:
+        seconds = parse_timestamp(position)
+    except ValueError:
+        await interaction.response.send_message("Use seconds or mm:ss, e.g. `90` or `1:30`.", ephemeral=True)
+        return
+    if not await player.seek(seconds):
+        await interaction.response.send_message("Nothing is playing!", ephemeral=True)
+        return
+    minutes, rest = divmod(int(player.position), 60)
+    await interaction.response.send_message(f"Jumped to {minutes}:{rest:02d}", ephemeral=True)
+
+@client.tree.command(name="stats", description="Show playback statistics for this server")
+async def stats(interaction: discord.Interaction):
+    guild_stats = playback_metrics.guild(interaction.guild.id)
+    player = client.get_audio_player(interaction.guild.id)
+    processes = ffmpeg_supervisor.stats()
+
+    def ms(seconds):
+        return "n/a" if seconds is None else f"≤{seconds * 1000:.0f} ms"
+
+    embed = discord.Embed(title="Playback Stats 📊", color=discord.Color.blue())
+    embed.add_field(name="Time to first frame", value=f"p50 {ms(guild_stats.first_frame.quantile(0.5))}, p99 {ms(guild_stats.first_frame.quantile(0.99))}", inline=False)
+    embed.add_field(name="Frame read", value=f"p50 {ms(guild_stats.frame_read.quantile(0.5))}, p99 {ms(guild_stats.frame_read.quantile(0.99))}", inline=False)
+    embed.add_field(name="Frames", value=str(guild_stats.frames))
+    embed.add_field(name="Underruns", value=str(guild_stats.underruns))
+    embed.add_field(name="Short reads", value=str(guild_stats.short_reads))
+    embed.add_field(name="ffmpeg restarts", value=str(guild_stats.restarts))
+    embed.add_field(name="Queue depth", value=str(len(player.queue)))
+    embed.add_field(name="ffmpeg processes", value=f"{processes['per_guild'].get(interaction.guild.id, 0)} here, {processes['processes']} total")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @client.event
 async def on_ready():
     print(f'{client.user} has connected to Discord!')
-    for guild in client.guilds:
-        client.views[guild.id] = ControlPanelView(guild.id)
-    for view in client.views.values():
-        client.add_view(view)
 
-client.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    client.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""Shared setup for the test suite.
+
+The bots persist state next to the working directory when imported, so that state is pointed at a
+temporary directory before any test imports them. Tests that decode audio generate it locally and
+are skipped when ffmpeg is not installed. Timing comparisons are marked ``benchmark`` and only run
+with ``--benchmark``, since they depend on the machine rather than on the code being right.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATE_DIR = tempfile.mkdtemp(prefix='dndbot-tests-')
+os.environ.setdefault('DEATH_SAVE_DB', os.path.join(STATE_DIR, 'death_saves.sqlite3'))
+os.environ.setdefault('BOT_MESSAGE_INDEX', os.path.join(STATE_DIR, 'bot_messages.json'))
+os.environ.setdefault('COMMAND_HASH_FILE', os.path.join(STATE_DIR, 'command_tree.json'))
+os.environ.setdefault('TRANSCODE_CACHE_DIR', os.path.join(STATE_DIR, 'transcoded'))
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', help="also run the timing comparisons marked benchmark")
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "benchmark: a timing comparison, only run with --benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason="timing comparison; run with --benchmark")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope='session')
+def audio(tmp_path_factory):
+    """A few seconds of test tone as ``tone.mp3`` and ``tone.opus``."""
+    if shutil.which('ffmpeg') is None:
+        pytest.skip("ffmpeg is not installed")
+    from benchmark import generate_audio
+    return generate_audio(str(tmp_path_factory.mktemp('audio')), 3)
@@ -0,0 +1,387 @@
+import asyncio
+import io
+import os
+import threading
+import time
+
+import discord
+import numpy as np
+import pytest
+
+import testbot
+from benchmark import FakeVoiceClient, drain
+
+
+def play(scenario):
+    async def run():
+        testbot.client.loop = asyncio.get_running_loop()
+        return await scenario()
+    return asyncio.run(run())
+
+
+def new_player(guild_id, **kwargs):
+    player = testbot.AudioPlayer(guild_id=guild_id, prewarm_seconds=0, **kwargs)
+    player.voice_client = FakeVoiceClient(realtime=True)
+    return player
+
+
+def count_spawns(monkeypatch):
+    spawned = []
+    spawn = testbot.ffmpeg_supervisor.spawn
+
+    def counting_spawn(*args, **kwargs):
+        process = spawn(*args, **kwargs)
+        spawned.append(process)
+        return process
+    monkeypatch.setattr(testbot.ffmpeg_supervisor, 'spawn', counting_spawn)
+    return spawned
+
+
+def test_track_starts_under_an_effect_playing_on_its_own(audio):
+    async def scenario():
+        player = new_player(601)
+        pcm = testbot.decode_to_pcm(audio['tone.mp3'])
+        await player.play_effect(audio['tone.mp3'], 'effect', True, pcm=pcm)
+        mixer = player.mixer
+        player.queue.extend([(audio['tone.mp3'], 'one', True), (audio['tone.mp3'], 'two', True)])
+        assert await player.play_next() == 'one'
+        assert player.voice_client.source is mixer
+        assert mixer.music is player.audio_source
+        assert [title for _, title, _ in player.queue] == ['two']
+        await drain(player)
+    play(scenario)
+
+
+def test_music_ramps_back_up_after_effects():
+    level = np.full((testbot.FRAME_SAMPLES * 40, 2), 10000, dtype=np.int16).tobytes()
+    mixer = testbot.MixerSource(discord.PCMAudio(io.BytesIO(level)), duck=0.5)
+    mixer.add(discord.PCMAudio(io.BytesIO(bytes(testbot.FRAME_SIZE * 10))))
+    peaks = []
+    while True:
+        data = mixer.read()
+        if not data:
+            break
+        peaks.append(int(np.abs(np.frombuffer(data, dtype=np.int16)).max()))
+    assert peaks[0] == 9000 and 5000 in peaks
+    released = peaks[peaks.index(5000, 5):]
+    # No jump back to full level when the effect ends: at most one 10% step per frame
+    assert all(0 <= b - a <= 1000 for a, b in zip(released, released[1:]))
+    assert released[-1] == 10000 and len(released) > 5
+
+
+def test_effect_over_music_leaves_the_decoder_alone(audio, monkeypatch):
+    # Decoded up front, as the soundboard cache does
+    pcm = testbot.decode_to_pcm(audio['tone.mp3'])[:testbot.FRAME_SIZE * 10]
+    spawned = count_spawns(monkeypatch)
+
+    async def scenario():
+        player = new_player(605)
+        player.queue.append((audio['tone.opus'], 'music', True))
+        await player.play_next()
+        source, mixer = player.audio_source, player.mixer
+        await player.voice_client.wait_for_frames(count=5)
+        await player.play_effect(audio['tone.mp3'], 'effect', True, pcm=pcm)
+        assert player.audio_source is source and player.mixer is mixer
+        assert len(mixer.effects) == 1
+        # A cached effect starts no subprocess, and the music's decoder keeps running
+        assert spawned == [player.ffmpeg_process]
+        assert player.ffmpeg_process.poll() is None or player.ffmpeg_process.returncode == 0
+        await drain(player)
+    play(scenario)
+
+
+@pytest.mark.skipif(not discord.opus.is_loaded(), reason="decoding Opus in-process needs libopus")
+def test_effect_over_passthrough_keeps_the_decoder(audio, monkeypatch):
+    # Decoded up front, as the soundboard cache does
+    pcm = testbot.decode_to_pcm(audio['tone.mp3'])[:testbot.FRAME_SIZE * 10]
+    spawned = count_spawns(monkeypatch)
+
+    async def scenario():
+        player = new_player(606, opus_passthrough=True)
+        player.queue.append((audio['tone.opus'], 'music', True))
+        await player.play_next()
+        process = player.ffmpeg_process
+        await player.voice_client.wait_for_frames(count=5)
+        await player.play_effect(audio['tone.mp3'], 'effect', True, pcm=pcm)
+        assert isinstance(player.audio_source.stream, testbot.OpusDecodeStream)
+        assert player.mixer.effects
+        assert player.ffmpeg_process is process and spawned == [process]
+        assert await player.voice_client.wait_for_frames(count=5, since=time.perf_counter())
+        await drain(player)
+    play(scenario)
+
+
+def test_effect_on_its_own_does_not_start_the_queue(audio):
+    async def scenario():
+        player = new_player(602)
+        pcm = testbot.decode_to_pcm(audio['tone.mp3'])[:testbot.FRAME_SIZE * 5]
+        player.queue.append((audio['tone.mp3'], 'queued', True))
+        await player.play_effect(audio['tone.mp3'], 'effect', True, pcm=pcm)
+        player.voice_client.wait(2)
+        await asyncio.sleep(0.1)
+        assert not player.playing
+        assert len(player.queue) == 1
+        await drain(player)
+    play(scenario)
+
+
+def test_entries_that_fail_to_start_are_skipped(audio):
+    async def scenario():
+        player = new_player(603)
+        player.queue.extend([('./missing.mp3', 'missing', True), (audio['tone.mp3'], 'tone', True)])
+        assert await player.play_next() == 'tone'
+        assert player.playing
+        await drain(player)
+    play(scenario)
+
+
+def test_decoder_limit_keeps_the_queue(audio, monkeypatch):
+    monkeypatch.setattr(testbot.ffmpeg_supervisor, 'max_per_guild', 0)
+
+    async def scenario():
+        player = new_player(604)
+        player.queue.extend([(audio['tone.mp3'], 'one', True), (audio['tone.mp3'], 'two', True)])
+        assert await player.play_next() is None
+        assert not player.playing
+        assert len(player.queue) == 2
+        await drain(player)
+    play(scenario)
+
+
+def test_stale_end_callback_leaves_the_new_decoder_alone(audio):
+    async def scenario():
+        # A passthrough track has no mixer to start the next one under, so it is stopped and replaced
+        player = new_player(1401, opus_passthrough=True)
+        player.queue.extend([(audio['tone.opus'], 'music', True), (audio['tone.opus'], 'next', True)])
+        await player.play_next()
+        await player.voice_client.wait_for_frames(count=5)
+        assert await player.play_next() == 'next'
+        process = player.ffmpeg_process
+        # Give the stopped player's after= callback time to reach the event loop
+        await asyncio.sleep(0.3)
+        assert player.playing
+        assert player.ffmpeg_process is process
+        assert process in testbot.ffmpeg_supervisor.processes  # not released
+        assert await player.voice_client.wait_for_frames(count=5, since=time.perf_counter())
+        await drain(player)
+    play(scenario)
+
+
+def test_skip_advances_the_queue(audio):
+    async def scenario():
+        player = new_player(1402, opus_passthrough=False)
+        player.queue.extend([(audio['tone.mp3'], 'one', True), (audio['tone.mp3'], 'two', True)])
+        await player.play_next()
+        await player.voice_client.wait_for_frames(count=5)
+        player.voice_client.stop()
+        await asyncio.sleep(0.3)
+        assert player.current_source[1] == 'two'
+        assert player.voice_client.is_playing()
+        await drain(player)
+    play(scenario)
+
+
+def frames_while_paused(player):
+    async def count():
+        await asyncio.sleep(0.05)
+        before = len(player.voice_client.frame_times)
+        await asyncio.sleep(0.2)
+        return len(player.voice_client.frame_times) - before
+    return count()
+
+
+def test_seek_keeps_a_paused_player_paused(audio):
+    async def scenario():
+        player = new_player(501, opus_passthrough=False)
+        player.queue.append((audio['tone.mp3'], 'music', True))
+        await player.play_next()
+        mixer = player.mixer
+        await player.voice_client.wait_for_frames(count=5)
+        player.voice_client.pause()
+        player.paused = True
+        assert await player.seek(1.0)
+        assert player.mixer is mixer
+        assert player.voice_client.is_paused()
+        assert await frames_while_paused(player) == 0
+        await drain(player)
+    play(scenario)
+
+
+def test_adjusting_never_respawns_the_decoder(audio, monkeypatch):
+    spawned = count_spawns(monkeypatch)
+
+    async def scenario():
+        # Passthrough is opt-in, so even an Opus file starts on the PCM path
+        player = new_player(503)
+        player.queue.append((audio['tone.opus'], 'music', True))
+        await player.play_next()
+        source = player.audio_source
+        assert isinstance(source, testbot.PCMTransformSource)
+        await player.voice_client.wait_for_frames(count=5)
+        player.volume, player.speed = 0.5, 1.25
+        await player.adjust_audio()
+        assert player.audio_source is source
+        assert (source.volume, source.speed) == (0.5, 1.25)
+        assert spawned == [player.ffmpeg_process]
+        await drain(player)
+    play(scenario)
+
+
+@pytest.mark.skipif(discord.opus.is_loaded(), reason="covers running without libopus")
+def test_passthrough_without_libopus_keeps_the_decoder(audio, monkeypatch):
+    spawned = count_spawns(monkeypatch)
+
+    async def scenario():
+        player = new_player(504, opus_passthrough=True)
+        player.queue.append((audio['tone.opus'], 'music', True))
+        await player.play_next()
+        source = player.audio_source
+        await player.voice_client.wait_for_frames(count=5)
+        player.volume = 0.5
+        await player.adjust_audio()
+        assert player.audio_source is source
+        assert spawned == [player.ffmpeg_process]
+        assert await player.voice_client.wait_for_frames(count=5, since=time.perf_counter())
+        await drain(player)
+    play(scenario)
+
+
+@pytest.mark.skipif(not discord.opus.is_loaded(), reason="decoding Opus in-process needs libopus")
+def test_switch_from_opus_decodes_in_process_and_stays_paused(audio, monkeypatch):
+    spawned = count_spawns(monkeypatch)
+
+    async def scenario():
+        player = new_player(502, opus_passthrough=True)
+        player.queue.append((audio['tone.opus'], 'music', True))
+        await player.play_next()
+        assert isinstance(player.audio_source, testbot.OpusPipeSource)
+        process = player.ffmpeg_process
+        await player.voice_client.wait_for_frames(count=5)
+        player.voice_client.pause()
+        player.paused = True
+        player.volume = 0.5
+        await player.adjust_audio()
+        assert isinstance(player.audio_source, testbot.PCMTransformSource)
+        assert isinstance(player.audio_source.stream, testbot.OpusDecodeStream)
+        assert player.ffmpeg_process is process and spawned == [process]
+        assert player.voice_client.is_paused()
+        assert await frames_while_paused(player) == 0
+        player.voice_client.resume()
+        assert await player.voice_client.wait_for_frames(count=5, since=time.perf_counter())
+        await drain(player)
+    play(scenario)
+
+
+def test_guilds_playing_the_same_file_share_one_decoder(audio, monkeypatch):
+    hub = testbot.BroadcastHub(ring_frames=60)
+    spawned = []
+
+    def spawn(url, is_local):
+        spawned.append(url)
+        return testbot.start_shared_decoder(url, is_local)
+    hub.spawn = spawn
+    monkeypatch.setattr(testbot, 'SHARED_DECODING', True)
+    monkeypatch.setattr(testbot, 'broadcast_hub', hub)
+
+    async def scenario():
+        players = [new_player(701 + i) for i in range(4)]
+        for player in players:
+            player.queue.append((audio['tone.mp3'], 'shared', True))
+            await player.play_next()
+        for player in players:
+            await player.voice_client.wait_for_frames(count=10)
+        assert len(spawned) == 1
+        assert len({player.audio_source.stream.decoder for player in players}) == 1
+        # Everyone started at the first frame, so positions match the audio actually heard
+        for player in players:
+            heard = len(player.voice_client.frame_times) * 0.02
+            assert abs(player.position - heard) < 0.1
+
+        # Once the first frame left the ring, a newcomer gets its own decoder instead of joining mid-track
+        await asyncio.sleep(1)
+        late = new_player(799)
+        late.queue.append((audio['tone.mp3'], 'shared', True))
+        await late.play_next()
+        await late.voice_client.wait_for_frames(count=5)
+        assert len(spawned) == 2
+        # The listener's cursor into the track is exactly the frames it accounted to the player
+        late.voice_client.pause()
+        await asyncio.sleep(0.05)
+        source = late.audio_source
+        assert source.stream.cursor == source.samples_read // testbot.FRAME_SAMPLES
+        assert source.stream.resyncs == 0
+        for player in players + [late]:
+            await drain(player)
+        assert not hub.decoders
+    play(scenario)
+
+
+def test_next_track_is_prewarmed_without_probing(audio):
+    async def scenario():
+        player = testbot.AudioPlayer(guild_id=301, prewarm_seconds=5.0, opus_passthrough=False)
+        player.voice_client = FakeVoiceClient(realtime=True)
+        player.queue.extend([(audio['tone.mp3'], 'first', True), (audio['tone.mp3'], 'second', True)])
+        await player.play_next()
+        first = player.audio_source
+        deadline = time.perf_counter() + 2
+        while player.prewarmed is None and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        # The decoder's output ended within the jitter buffer, which gives the exact length
+        assert abs(first.duration - 3.0) < 0.05
+        prewarmed = player.prewarmed
+        assert prewarmed is not None and prewarmed.entry is player.queue[0]
+        player.voice_client.wait(5)
+        deadline = time.perf_counter() + 2
+        while player.current_source[1] != 'second' and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        assert player.current_source[1] == 'second'
+        assert player.ffmpeg_process is prewarmed.process
+        await drain(player)
+    play(scenario)
+
+
+def decode(path):
+    stream = testbot.ffmpeg.output(testbot.ffmpeg_input(path, True), 'pipe:', format='s16le', acodec='pcm_s16le', ac=2, ar=48000)
+    return testbot.ffmpeg_supervisor.spawn(stream)
+
+
+def read_all(pipe):
+    data = bytearray()
+    while chunk := pipe.read(testbot.FRAME_SIZE):
+        data += chunk
+    return bytes(data)
+
+
+def test_cache_copy_is_encoded_apart_from_playback(audio, tmp_path):
+    cache = testbot.TranscodeCache(directory=str(tmp_path))
+    url = 'https://example.com/tone.mp3'
+    process = decode(audio['tone.mp3'])
+    tee = testbot.CacheTee(process.stdout, process, url, cache.temp_path(url), encode=True, cache=cache)
+    assert read_all(tee) == testbot.decode_to_pcm(audio['tone.mp3'])
+    tee.thread.join(10)
+    testbot.ffmpeg_supervisor.release(process)
+    cached = cache.lookup(url)
+    assert cached and len(testbot.decode_to_pcm(cached)) > 2.9 * 192000
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.part')] == []
+
+
+def test_cache_copy_is_dropped_when_the_writer_falls_behind(audio, tmp_path, monkeypatch):
+    cache = testbot.TranscodeCache(directory=str(tmp_path))
+    url = 'https://example.com/slow-disk.mp3'
+    stalled = threading.Event()
+    open_sink = testbot.CacheTee._open
+
+    def slow_open(self):
+        stalled.wait(10)
+        return open_sink(self)
+    monkeypatch.setattr(testbot.CacheTee, '_open', slow_open)
+    process = decode(audio['tone.mp3'])
+    tee = testbot.CacheTee(process.stdout, process, url, cache.temp_path(url), encode=False, cache=cache, backlog=4)
+    # Playback reads every byte without waiting for the stalled writer
+    assert read_all(tee) == testbot.decode_to_pcm(audio['tone.mp3'])
+    assert tee.dropped
+    stalled.set()
+    tee.thread.join(10)
+    testbot.ffmpeg_supervisor.release(process)
+    assert cache.lookup(url) is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,33 @@
+import asyncio
+
+import benchmark
+import testbot
+
+
+def run(scenario):
+    async def main():
+        testbot.client.loop = asyncio.get_running_loop()
+        return await scenario
+    return asyncio.run(main())
+
+
+def test_concurrency_runs_the_production_path(audio, monkeypatch):
+    started = []
+    start_source = testbot.AudioPlayer.start_source
+
+    def counting_start_source(self, *args, **kwargs):
+        started.append(self.guild_id)
+        return start_source(self, *args, **kwargs)
+    monkeypatch.setattr(testbot.AudioPlayer, 'start_source', counting_start_source)
+
+    result = run(benchmark.bench_concurrency(audio['tone.mp3'], 3, realtime=False, opus=False, encode=False))
+    assert sorted(started) == [0, 1, 2]
+    assert result['frames'] >= 3 * 140
+    assert 'libopus not loaded' in result['note']
+
+
+def test_opus_passthrough_run_is_not_marked(audio):
+    # Passthrough frames are never encoded, so a missing libopus does not skew them
+    result = run(benchmark.bench_concurrency(audio['tone.opus'], 1, realtime=False, opus=True, encode=False))
+    assert result['frames'] > 0
+    assert 'note' not in result
@@ -0,0 +1,57 @@
+import string
+import timeit
+
+import pytest
+
+import cipher
+from cipher import LANGUAGES, compile_table, encipher
+
+MESSAGE = ("The vault opens at midnight; bring 3 torches, the silver key and Grok's map! "
+           "Don't trust the innkeeper -- she works for the Zhentarim? ") * 15
+
+
+def char_map_cipher(message):
+    """The dict-and-generator mapping bot.py used before cipher.py."""
+    char_map = dict(zip(string.ascii_lowercase + string.ascii_uppercase + string.digits,
+                        "xyzwvutsrqponmlkjihgfedcba" + "XYZWVUTSRQPONMLKJIHGFEDCBA" + string.digits[::-1]))
+    return ''.join(char_map.get(c, c) for c in message)
+
+
+def test_default_table_matches_the_old_mapping():
+    assert encipher(MESSAGE) == char_map_cipher(MESSAGE)
+
+
+def test_languages_differ_and_stay_stable():
+    rendered = {encipher(MESSAGE, language) for language in LANGUAGES}
+    assert len(rendered) == len(LANGUAGES)
+    for language in LANGUAGES:
+        assert compile_table(language) == compile_table(language)
+        gibberish = encipher(MESSAGE, language)
+        # Punctuation, whitespace and word lengths survive; letters keep their case
+        assert [len(word) for word in gibberish.split()] == [len(word) for word in MESSAGE.split()]
+        assert [c for c in gibberish if not c.isalnum()] == [c for c in MESSAGE if not c.isalnum()]
+        assert [c.isupper() for c in gibberish] == [c.isupper() for c in MESSAGE]
+
+
+def test_tables_are_compiled_once_and_repeats_hit_the_cache(monkeypatch):
+    def recompile(language):
+        raise AssertionError(f"{language} table compiled per message")
+    monkeypatch.setattr(cipher, 'compile_table', recompile)
+    encipher.cache_clear()
+    for language in LANGUAGES:
+        encipher(MESSAGE, language)
+        encipher(MESSAGE, language)
+    info = encipher.cache_info()
+    assert (info.misses, info.hits) == (len(LANGUAGES), len(LANGUAGES))
+
+
+@pytest.mark.benchmark
+def test_translate_beats_the_char_map():
+    runs = 200
+    old = min(timeit.repeat(lambda: char_map_cipher(MESSAGE), number=runs, repeat=3)) / runs
+    new = min(timeit.repeat(lambda: encipher.__wrapped__(MESSAGE, "Elvish"), number=runs, repeat=3)) / runs
+    cached = min(timeit.repeat(lambda: encipher(MESSAGE, "Elvish"), number=runs, repeat=3)) / runs
+    print(f"{len(MESSAGE)} chars: char map {old * 1e6:.1f} us, str.translate {new * 1e6:.1f} us, "
+          f"LRU hit {cached * 1e6:.2f} us")
+    assert new * 5 < old
+    assert cached < new
@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+from death_saves import DeathSaveStore
+
+
+def test_failed_write_is_retried_and_the_loop_survives(tmp_path):
+    path = str(tmp_path / 'saves.sqlite3')
+    store = DeathSaveStore(path)
+    write = store.write
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_write(upserts, deletes):
+        if failures:
+            raise failures.pop()
+        write(upserts, deletes)
+    store.write = flaky_write
+
+    async def scenario():
+        flusher = asyncio.create_task(store.flush_periodically(interval=0.01))
+        store.add((1, 2), successes=1)
+        await asyncio.sleep(0.1)
+        assert not flusher.done()
+        flusher.cancel()
+        await store.close()
+    asyncio.run(scenario())
+    assert not failures
+    assert DeathSaveStore(path).get((1, 2)).successes == 1
+
+
+def test_stale_copy_cannot_expire_live_state(tmp_path):
+    path = str(tmp_path / 'saves.sqlite3')
+    owner = DeathSaveStore(path, ttl=60)
+    owner.add((1, 2), failures=1)
+    owner.add((1, 3), failures=1)
+    owner.flush()
+    # Another shard loaded the guild at startup and has never handled it since
+    stale = DeathSaveStore(path, ttl=60)
+    time.sleep(0.01)
+    owner.add((1, 2), successes=1)
+    owner.flush()
+    stale.ttl = -1
+    stale.expire()
+    stale.flush()
+    assert DeathSaveStore(path).get((1, 2)).successes == 1
+    # A row nobody has touched since the stale copy saw it still expires
+    assert (1, 3) not in DeathSaveStore(path).records
+
+
+def test_close_waits_for_the_write_in_flight(tmp_path):
+    path = str(tmp_path / 'saves.sqlite3')
+    store = DeathSaveStore(path)
+    write = store.write
+    started = threading.Event()
+
+    def slow_write(upserts, deletes):
+        started.set()
+        time.sleep(0.2)
+        write(upserts, deletes)
+    store.write = slow_write
+
+    async def scenario():
+        flusher = asyncio.create_task(store.flush_periodically(interval=0.01))
+        store.add((1, 2), failures=1)
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        store.add((1, 3), successes=2)
+        # Shutdown cancels the loop mid-write; close must not close the database under it
+        flusher.cancel()
+        await store.close()
+    asyncio.run(scenario())
+    reopened = DeathSaveStore(path)
+    assert reopened.get((1, 2)).failures == 1
+    assert reopened.get((1, 3)).successes == 2
+
@@ -0,0 +1,75 @@
+import timeit
+
+import numpy as np
+import pytest
+
+import dice
+
+
+@pytest.mark.parametrize('expression', ['4d6k0', '40d6k0', '40d6kl0', '40d6dl40'])
+def test_keeping_no_dice_totals_zero(expression):
+    result = dice.roll(expression)
+    assert result.total == 0
+    assert not any(result.rolls[0].kept)
+
+
+@pytest.mark.parametrize('count', [4, 40])
+def test_keep_highest_and_lowest(count):
+    result = dice.roll(f'{count}d6kh3').rolls[0]
+    assert result.total == sum(sorted(result.values)[-3:])
+    result = dice.roll(f'{count}d6kl3').rolls[0]
+    assert result.total == sum(sorted(result.values)[:3])
+
+
+def test_large_pool_without_keep_is_not_labelled_kept():
+    text = dice.format_term(dice.roll('40d100').rolls[0])
+    assert 'kept' not in text
+    assert '(20 more)' in text
+    assert 'kept none' in dice.format_term(dice.roll('40d100k0').rolls[0])
+
+
+@pytest.mark.parametrize('expression, mean', [('4d6kh3', 12.2446), ('1d6!', 4.2), ('1000d6', 3500), ('8d6+4', 32)])
+def test_sample_means_match_theory(expression, mean):
+    totals = [dice.roll(expression).total for _ in range(20_000)]
+    spread = np.std(totals) / np.sqrt(len(totals))
+    assert abs(np.mean(totals) - mean) < 5 * spread
+
+
+def test_repeat_rolls_reuse_the_compiled_expression():
+    dice.compile_expression.cache_clear()
+    dice.roll('8d6+4')
+    dice.roll('8d6+4')
+    info = dice.compile_expression.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+
+def test_large_pools_are_rolled_in_one_batch(monkeypatch):
+    def die_by_die(term):
+        raise AssertionError(f"{term.count} dice rolled one at a time")
+    monkeypatch.setattr(dice, 'roll_small', die_by_die)
+    assert 1000 <= dice.roll('1000d6').total <= 6000
+    assert dice.roll(f'{dice.VECTOR_THRESHOLD}d6!').total >= dice.VECTOR_THRESHOLD
+
+
+@pytest.mark.benchmark
+def test_throughput():
+    runs = 2000
+    timings = {}
+    for expression in ('8d6+4', '4d6kh3', '1000d6', '1000d6!'):
+        dice.roll(expression)
+        cached = min(timeit.repeat(lambda: dice.roll(expression), number=runs, repeat=3)) / runs
+
+        def uncached():
+            dice.compile_expression.cache_clear()
+            dice.roll(expression)
+        timings[expression] = cached, min(timeit.repeat(uncached, number=runs, repeat=3)) / runs
+    print(', '.join(f"{expression} {cached * 1e6:.1f}/{uncached * 1e6:.1f} us"
+                    for expression, (cached, uncached) in timings.items()))
+    assert timings['8d6+4'][0] < timings['8d6+4'][1]
+    assert 1 / timings['8d6+4'][0] > 20_000
+
+    # The NumPy path has to earn its place over rolling a large pool die by die
+    term = dice.compile_expression('1000d6')[0]
+    small = min(timeit.repeat(lambda: dice.roll_small(term), number=50, repeat=3))
+    large = min(timeit.repeat(lambda: dice.roll_large(term), number=50, repeat=3))
+    assert large * 5 < small
@@ -0,0 +1,87 @@
+import asyncio
+
+import discord
+
+import bot
+from fanout import fan_out
+from loadtest import FakeMember, FakeWorld, HTTPStub, language_select_runner
+
+
+class StubResponse:
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+class ClosedDMs(FakeMember):
+    async def send(self, embed=None, **kwargs):
+        await self.http.request('POST /users/@me/channels')
+        raise discord.Forbidden(StubResponse(403, 'Forbidden'), 'Cannot send messages to this user')
+
+
+class Throttled(FakeMember):
+    """Answers 429 the first ``throttled`` times, then delivers."""
+
+    def __init__(self, *args, throttled=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.throttled = throttled
+
+    async def send(self, embed=None, **kwargs):
+        await self.http.request('POST /users/@me/channels')
+        if self.throttled:
+            self.throttled -= 1
+            raise discord.HTTPException(StubResponse(429, 'Too Many Requests'), 'You are being rate limited.')
+        await self.http.request('POST /channels/{dm}/messages')
+
+
+def test_fan_out_is_concurrent_and_reports_every_member():
+    latency = 0.02
+    http = HTTPStub(latency=latency)
+    members = [FakeMember(i, [], http) for i in range(90)]
+    members += [ClosedDMs(100 + i, [], http) for i in range(5)]
+    members += [Throttled(200 + i, [], http) for i in range(3)]
+    members += [Throttled(300 + i, [], http, throttled=10) for i in range(2)]
+    embed = discord.Embed(description='secret')
+
+    report = asyncio.run(fan_out([(member, embed) for member in members], concurrency=10, base_delay=0.01))
+    print(report.summary())
+
+    assert len(report) == len(members)
+    assert len(report.delivered) == 93
+    assert {member.id for member in report.forbidden} == set(range(100, 105))
+    assert {member.id for member in report.failed} == {300, 301}
+    # One at a time this is two round trips per member, about 4s; ten in flight should be ~10x faster
+    serial = 2 * latency * len(members)
+    assert report.elapsed < serial / 4
+
+
+def test_concurrency_is_bounded():
+    in_flight = peak = 0
+
+    class Counting(FakeMember):
+        async def send(self, embed=None, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.005)
+            in_flight -= 1
+
+    members = [Counting(i, [], HTTPStub(latency=0)) for i in range(50)]
+    report = asyncio.run(fan_out([(member, None) for member in members], concurrency=7))
+    assert len(report.delivered) == 50
+    assert peak == 7
+
+
+def test_delivery_report_goes_only_to_the_sender(monkeypatch):
+    world = FakeWorld(guilds=1, members=10, http=HTTPStub(latency=0))
+    monkeypatch.setattr(bot.client, 'role_indexes', {})
+    interaction = world.interaction(bot.client)
+    sent = []
+
+    async def send(content=None, **kwargs):
+        sent.append((content, kwargs))
+    monkeypatch.setattr(interaction.followup, 'send', send)
+    asyncio.run(language_select_runner()(interaction))
+    [(content, kwargs)] = sent
+    assert content.startswith("The message has been sent via DM.")
+    assert kwargs.get('ephemeral') is True
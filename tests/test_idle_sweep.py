@@ -0,0 +1,58 @@
+import asyncio
+import gc
+import time
+import tracemalloc
+
+import testbot
+from benchmark import FakeVoiceClient
+
+
+def sweep(now):
+    asyncio.run(testbot.client.sweep_idle(now))
+
+
+def test_evicted_guild_stats_are_dropped(monkeypatch):
+    monkeypatch.setattr(testbot.client, 'audio_players', {})
+    player = testbot.client.get_audio_player(1201)
+    testbot.playback_metrics.guild(1201).observe_read(0.001, testbot.FRAME_SIZE)
+    active = testbot.client.get_audio_player(1202)
+    testbot.playback_metrics.guild(1202).observe_read(0.001, testbot.FRAME_SIZE)
+    player.last_active -= testbot.IDLE_EVICT_SECONDS
+
+    sweep(time.monotonic())
+    assert 1201 not in testbot.client.audio_players
+    assert 1201 not in testbot.playback_metrics.guilds
+    assert 'guild="1201"' not in testbot.playback_metrics.render_prometheus()
+    assert testbot.client.audio_players[1202] is active
+    assert 1202 in testbot.playback_metrics.guilds
+
+
+def test_idle_guilds_do_not_accumulate(monkeypatch):
+    """Thousands of guilds queue a few tracks and go idle, over and over; memory must level off."""
+    monkeypatch.setattr(testbot.client, 'audio_players', {})
+
+    def cycle(first_guild):
+        for guild_id in range(first_guild, first_guild + 5000):
+            player = testbot.client.get_audio_player(guild_id)
+            player.voice_client = FakeVoiceClient()
+            player.queue.extend((f'./music/{guild_id}-{i}.mp3', f'track {i}', True) for i in range(3))
+            testbot.playback_metrics.guild(guild_id).observe_read(0.001, testbot.FRAME_SIZE)
+        start = time.monotonic()
+        sweep(start + testbot.IDLE_DISCONNECT_SECONDS)
+        assert not any(player.voice_client or player.queue for player in testbot.client.audio_players.values())
+        sweep(start + testbot.IDLE_DISCONNECT_SECONDS + testbot.IDLE_EVICT_SECONDS)
+        assert not testbot.client.audio_players
+
+    tracemalloc.start()
+    try:
+        cycle(100_000)
+        gc.collect()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for i in range(1, 4):
+            cycle(100_000 + i * 5000)
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+    assert not any(guild_id >= 100_000 for guild_id in testbot.playback_metrics.guilds if guild_id)
+    assert growth < 256 * 1024
@@ -0,0 +1,58 @@
+import asyncio
+import random
+
+import pytest
+
+import loadtest
+import testbot
+from benchmark import drain
+
+HTTP_LATENCY = 0.005
+
+
+@pytest.fixture
+def run_command():
+    def run(name, audio_path=None, requests=200, concurrency=50):
+        async def main():
+            testbot.client.loop = asyncio.get_running_loop()
+            random.seed(25)
+            world = loadtest.FakeWorld(guilds=3, members=30, http=loadtest.HTTPStub(HTTP_LATENCY))
+            client, command = loadtest.scenarios(audio_path)[name]
+            try:
+                return await loadtest.run_scenario(world, client, command, requests, concurrency, trace_memory=False)
+            finally:
+                for player in list(testbot.client.audio_players.values()):
+                    await drain(player)
+        return asyncio.run(main())
+    return run
+
+
+@pytest.mark.parametrize('name', list(loadtest.scenarios()))
+def test_command_under_load(run_command, name):
+    result = run_command(name)
+    assert result['errors'] == 0
+    assert result['completion_ms']['count'] == result['requests']
+    assert result['first_response_ms']['count'] == result['requests']
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('name', list(loadtest.scenarios()))
+def test_command_latency_under_load(run_command, name):
+    result = run_command(name)
+    # Handlers acknowledge before their slow work; completion is a few simulated round trips plus
+    # queueing behind the other interactions in flight
+    assert result['first_response_ms']['p99'] < 50
+    assert result['completion_ms']['p99'] < 500
+    assert result['loop_lag_ms']['p99'] < 100
+
+
+def test_play_url_under_load(run_command, audio):
+    result = run_command('testbot /play-url', audio_path=audio['tone.mp3'], requests=20, concurrency=10)
+    assert result['errors'] == 0
+    assert result['first_response_ms']['count'] == result['requests']
+
+
+@pytest.mark.benchmark
+def test_play_url_latency_under_load(run_command, audio):
+    result = run_command('testbot /play-url', audio_path=audio['tone.mp3'], requests=20, concurrency=10)
+    assert result['first_response_ms']['p99'] < 1000
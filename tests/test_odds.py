@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import dice
+
+SAMPLES = 20_000
+
+
+def monte_carlo(expression):
+    totals = np.array([dice.roll(expression).total for _ in range(SAMPLES)])
+    counts = np.bincount(totals - totals.min())
+    return int(totals.min()), counts / SAMPLES, totals
+
+
+def test_known_values():
+    assert dice.distribution('2d6').probabilities[7 - 2] == pytest.approx(1 / 6)
+    assert dice.distribution('1d20').at_least(11) == pytest.approx(0.5)
+    assert dice.distribution('4d6kh3').mean == pytest.approx(12.2446, abs=1e-4)
+    assert dice.distribution('1d6!').mean == pytest.approx(4.2, abs=1e-6)
+    assert dice.distribution('2d20kl1').at_least(11) == pytest.approx(0.25)
+    odds = dice.distribution('3d8-2')
+    assert (odds.minimum, odds.maximum) == (1, 22)
+
+
+@pytest.mark.parametrize('expression', ['2d6+3', '4d6kh3', '2d20kl1', '3d6!', '1d8-1d4', '12d10dl2', '200d6', '6d4!kh2'])
+def test_exact_distribution_matches_monte_carlo(expression):
+    odds = dice.distribution(expression)
+    assert odds.exact
+    assert odds.probabilities.sum() == pytest.approx(1.0)
+    offset, sampled, totals = monte_carlo(expression)
+
+    assert totals.mean() == pytest.approx(odds.mean, abs=5 * totals.std() / np.sqrt(SAMPLES))
+    assert odds.minimum <= totals.min() and totals.max() <= odds.maximum
+    for fraction in (0.1, 0.5, 0.9):
+        target = odds.percentile(fraction)
+        p = odds.at_least(target)
+        assert (totals >= target).mean() == pytest.approx(p, abs=5 * np.sqrt(p * (1 - p) / SAMPLES) + 1e-3)
+    # Total variation distance; sampling noise alone stays well below this at 20k rolls
+    exact = np.zeros(max(odds.maximum, offset + len(sampled) - 1) - odds.minimum + 1)
+    exact[:len(odds.probabilities)] = odds.probabilities
+    observed = np.zeros_like(exact)
+    observed[offset - odds.minimum:offset - odds.minimum + len(sampled)] = sampled
+    assert 0.5 * np.abs(exact - observed).sum() < 0.06
+
+
+def test_huge_keep_pool_is_sampled_and_close():
+    odds = dice.distribution('2000d6kh10')
+    assert not odds.exact
+    assert odds.mean == pytest.approx(60, abs=0.05)
+    assert odds.maximum == 60
+
+
+def test_distribution_cache_is_bounded_by_size(monkeypatch):
+    cache = dice.DistributionCache(max_bytes=dice.distribution('100d6').nbytes * 2)
+    monkeypatch.setattr(dice, 'distribution_cache', cache)
+    first = dice.distribution('100d6')
+    assert dice.distribution('100d6') is first
+    dice.distribution('101d6')
+    dice.distribution('102d6')
+    assert cache.size <= cache.max_bytes
+    assert '100d6' not in cache.entries and '102d6' in cache.entries
+    # Too big to keep at all, rather than flushing everything else out
+    dice.distribution('10000d199')
+    assert '10000d199' not in cache.entries and '102d6' in cache.entries
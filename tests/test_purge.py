@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+import discord
+
+import bot
+from loadtest import FakeWorld, HTTPStub, command_runner
+from purge import MessageIndex
+
+HISTORY = 'GET /channels/{id}/messages'
+BULK_DELETE = 'POST /channels/{id}/messages/bulk-delete'
+
+
+def snowflake():
+    time.sleep(0.005)
+    return discord.utils.time_snowflake(discord.utils.utcnow())
+
+
+def clear(world, index, monkeypatch):
+    monkeypatch.setattr(bot.client, 'message_index', index)
+    interaction = world.interaction(bot.client)
+    asyncio.run(command_runner(bot.client, 'clear-bot-posts')(interaction))
+    return interaction.channel
+
+
+def test_history_is_scanned_once_per_channel_even_when_indexed(tmp_path, monkeypatch):
+    http = HTTPStub(latency=0)
+    world = FakeWorld(guilds=1, members=3, http=http)
+    channel = world.guilds[0].channel
+    index = MessageIndex(str(tmp_path / 'index.json'))
+    # Posts seen since startup must not stop the older ones from being found
+    index.add(channel.id, channel.message_ids[0])
+
+    clear(world, index, monkeypatch)
+    assert http.calls[HISTORY] == 1
+    assert http.calls[BULK_DELETE] == 1
+    assert index.get(channel.id) == []
+
+    channel.message_ids = [snowflake() for _ in range(150)]
+    index.extend(channel.id, channel.message_ids)
+    clear(world, index, monkeypatch)
+    assert http.calls[HISTORY] == 1
+    assert http.calls[BULK_DELETE] == 3
+
+
+def test_clean_restart_skips_history(tmp_path, monkeypatch):
+    path = str(tmp_path / 'index.json')
+    http = HTTPStub(latency=0)
+    world = FakeWorld(guilds=1, members=3, http=http)
+    channel = world.guilds[0].channel
+    index = MessageIndex(path)
+    index.extend(channel.id, channel.message_ids)
+    index.mark_scanned(channel.id)
+    index.save(clean=True)
+
+    restarted = MessageIndex(path)
+    clear(world, restarted, monkeypatch)
+    assert HISTORY not in http.calls
+    assert http.calls[BULK_DELETE] == 1
+
+
+def test_posts_lost_in_a_crash_are_recovered(tmp_path, monkeypatch):
+    path = str(tmp_path / 'index.json')
+    http = HTTPStub(latency=0)
+    world = FakeWorld(guilds=1, members=3, http=http)
+    channel = world.guilds[0].channel
+    index = MessageIndex(path)
+    saved = [snowflake() for _ in range(3)]
+    index.extend(channel.id, saved)
+    index.mark_scanned(channel.id)
+    index.save()
+    # Posted after the last write-behind save, then the process died
+    lost = [snowflake() for _ in range(3)]
+    channel.message_ids = saved + lost
+    snowflake()
+
+    deleted = []
+
+    async def delete_messages(messages):
+        deleted.extend(message.id for message in messages)
+    monkeypatch.setattr(channel, 'delete_messages', delete_messages)
+
+    restarted = MessageIndex(path)
+    assert restarted.scan_window(channel.id)['after'] is not None
+    clear(world, restarted, monkeypatch)
+    assert http.calls[HISTORY] == 1
+    assert sorted(deleted) == saved + lost
+    assert restarted.get(channel.id) == []
+    assert restarted.scan_window(channel.id) is None
+
+
+def test_old_index_format_is_read_and_seeded(tmp_path):
+    path = tmp_path / 'index.json'
+    path.write_text('{"42": [1, 2, 3]}')
+    index = MessageIndex(str(path))
+    assert index.get(42) == [1, 2, 3]
+    assert index.scan_window(42) == {'limit': 250}
+
+
+def test_message_index_flush_survives_a_failed_save(tmp_path, monkeypatch):
+    index = MessageIndex(str(tmp_path / 'missing' / 'index.json'))
+    write = index.write
+    failures = [OSError("No space left on device")]
+
+    def flaky_write(data):
+        if failures:
+            raise failures.pop()
+        write(data)
+    monkeypatch.setattr(index, 'write', flaky_write)
+
+    async def scenario():
+        flusher = asyncio.create_task(index.flush_periodically(interval=0.01))
+        index.add(1, 2)
+        await asyncio.sleep(0.1)
+        assert not flusher.done()
+        flusher.cancel()
+    asyncio.run(scenario())
+    assert not index.dirty
+    assert MessageIndex(index.path).get(1) == [2]
+
+
+def test_message_index_saves_off_the_event_loop(tmp_path, monkeypatch):
+    index = MessageIndex(str(tmp_path / 'index.json'))
+    write = index.write
+    started = threading.Event()
+
+    def slow_write(data):
+        started.set()
+        time.sleep(0.2)
+        write(data)
+    monkeypatch.setattr(index, 'write', slow_write)
+
+    async def scenario():
+        flusher = asyncio.create_task(index.flush_periodically(interval=0.01))
+        index.add(1, 2)
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        # The loop keeps serving while the file is written
+        await asyncio.sleep(0.05)
+        assert not index.writing.done()
+        index.add(1, 3)
+        # Shutdown cancels the loop mid-write; the clean save must not race it
+        flusher.cancel()
+        await index.close()
+    asyncio.run(scenario())
+    restarted = MessageIndex(index.path)
+    assert restarted.get(1) == [2, 3]
+    assert restarted.scan_window(1) == {'limit': 250} and restarted.unsaved_since is None
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import testbot
+from loadtest import FakeWorld, HTTPStub
+
+
+class StubExtractor:
+    """Counts extractions and hands out googlevideo-style URLs with the given expiry."""
+
+    def __init__(self, expire=None):
+        self.expire = expire
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, youtube_url):
+        self.calls.append(youtube_url)
+        self.release.wait(5)
+        video = testbot.YouTubeResolver.video_key(youtube_url)
+        query = f"&expire={self.expire}" if self.expire is not None else ""
+        return f"https://rr1.googlevideo.com/videoplayback?id={video}{query}", f"title {video}", 212
+
+
+def video(i):
+    return f"https://www.youtube.com/watch?v={i:011d}"
+
+
+def test_concurrent_requests_share_one_extraction():
+    extract = StubExtractor()
+    extract.release.clear()
+    resolver = testbot.YouTubeResolver(extract=extract)
+    urls = [video(1), f"https://youtu.be/{1:011d}", f"{video(1)}&t=42"] * 4
+
+    async def scenario():
+        requests = [asyncio.ensure_future(resolver.resolve(url)) for url in urls]
+        await asyncio.sleep(0.05)
+        extract.release.set()
+        return await asyncio.gather(*requests)
+    results = asyncio.run(scenario())
+    assert len(extract.calls) == 1
+    assert len(set(results)) == 1
+    assert not resolver.pending
+
+
+def test_ttl_comes_from_the_signed_url():
+    expire = int(time.time()) + 1000
+    resolver = testbot.YouTubeResolver(extract=StubExtractor(expire=expire), expiry_margin=300)
+    asyncio.run(resolver.resolve(video(2)))
+    assert resolver.cache[f"{2:011d}"][2] == expire - 300
+    assert resolver.cached(video(2))
+
+    # Within the margin of expiry the URL is no longer handed out and gets re-extracted
+    extract = StubExtractor(expire=int(time.time()) + 100)
+    resolver = testbot.YouTubeResolver(extract=extract, expiry_margin=300)
+    asyncio.run(resolver.resolve(video(3)))
+    assert resolver.cached(video(3)) is None
+    asyncio.run(resolver.resolve(video(3)))
+    assert len(extract.calls) == 2
+    assert len(resolver.stream_keys) == 1
+
+
+def test_default_ttl_without_expire():
+    resolver = testbot.YouTubeResolver(extract=StubExtractor(), default_ttl=60)
+    before = time.time()
+    asyncio.run(resolver.resolve(video(4)))
+    assert before + 60 <= resolver.cache[f"{4:011d}"][2] <= time.time() + 60
+
+
+def test_cache_and_stream_keys_stay_bounded():
+    extract = StubExtractor(expire=int(time.time()) + 3600)
+    resolver = testbot.YouTubeResolver(extract=extract, max_entries=100)
+
+    async def scenario():
+        for i in range(1000):
+            await resolver.resolve(video(i))
+            if i % 10 == 0:
+                resolver.cached(video(0))  # kept warm, so it survives eviction
+    asyncio.run(scenario())
+    assert len(resolver.cache) <= 100
+    assert set(resolver.stream_keys.values()) == set(resolver.cache)
+    assert resolver.cached(video(0))
+    assert resolver.cached(video(999))
+
+
+def test_duration_comes_from_the_extractor():
+    resolver = testbot.YouTubeResolver(extract=StubExtractor())
+    audio_url, _ = asyncio.run(resolver.resolve(video(5)))
+    assert resolver.duration(audio_url) == 212
+    assert resolver.duration('https://example.com/other.mp3') is None
+
+
+def test_empty_playlist_from_the_panel_is_reported(monkeypatch):
+    async def no_entries(url):
+        return []
+    monkeypatch.setattr(testbot.youtube_resolver, 'expand_playlist', no_entries)
+    interaction = FakeWorld(guilds=1, members=1, http=HTTPStub(latency=0)).interaction(testbot.client)
+    sent = []
+
+    async def send(content=None, **kwargs):
+        sent.append(content)
+    monkeypatch.setattr(interaction.followup, 'send', send)
+    modal = testbot.AddYouTubeModal()
+    modal.url_input._value = "https://www.youtube.com/playlist?list=PL0000000000"
+
+    async def submit():
+        testbot.client.loop = asyncio.get_running_loop()
+        await modal.on_submit(interaction)
+    asyncio.run(submit())
+    assert sent == ["That playlist has no playable entries."]
+    assert not testbot.client.get_audio_player(interaction.guild.id).queue
@@ -0,0 +1,100 @@
+import random
+import time
+
+import pytest
+
+from loadtest import FakeRole
+from role_index import PLAYER_ROLES, RoleIndex
+
+LANGUAGES = ["Undercommon", "Celestial", "Giant", "Elvish", "Dwarvish", "Goblin", "Thieves' Cant",
+             "Common Sign Language", "Old Omuan"]
+
+
+class Member:
+    def __init__(self, member_id, roles):
+        self.id = member_id
+        self.roles = roles
+
+
+class Guild:
+    def __init__(self, members=10_000, seed=18):
+        rng = random.Random(seed)
+        names = ["Spiller", "Gm"] + LANGUAGES + [f"role {i}" for i in range(21)]
+        self.roles = [FakeRole(1000 + i, name) for i, name in enumerate(names)]
+        self.members = [Member(i, rng.sample(self.roles, 6)) for i in range(members)]
+
+
+def scan(guild, language):
+    """What LanguageSelect.callback did per message before the index: every member, every role."""
+    readers, others = set(), set()
+    for member in guild.members:
+        if not any(role.name.lower() in PLAYER_ROLES for role in member.roles):
+            continue
+        if any(role.name.lower() == language.lower() for role in member.roles):
+            readers.add(member.id)
+        else:
+            others.add(member.id)
+    return readers, others
+
+
+def best_of(runs, call):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def test_index_matches_the_scan_through_updates():
+    guild = Guild(members=2000)
+    index = RoleIndex.build(guild)
+    for language in LANGUAGES:
+        assert index.route(language) == scan(guild, language)
+
+    rng = random.Random(1)
+    spiller, elvish = guild.roles[0], guild.roles[5]
+    for member in rng.sample(guild.members, 200):
+        before = Member(member.id, list(member.roles))
+        if spiller in member.roles:
+            member.roles = [role for role in member.roles if role is not spiller]
+        else:
+            member.roles = [role for role in member.roles if role is not elvish] + [spiller, elvish]
+        index.update_member(before, member)
+    for member in guild.members[:50]:
+        index.remove_member(member.id)
+    guild.members = guild.members[50:]
+    joined = Member(99_999, [guild.roles[1], guild.roles[2]])
+    guild.members.append(joined)
+    index.add_member(joined)
+    elvish.name = "Old Elvish"
+    index.rename_role(elvish)
+    for language in LANGUAGES + ["Old Elvish"]:
+        assert index.route(language) == scan(guild, language)
+
+
+class Unscannable:
+    def __iter__(self):
+        raise AssertionError("routing walked the member list")
+
+
+def test_routing_never_walks_the_members():
+    guild = Guild()
+    index = RoleIndex.build(guild)
+    expected = {language: scan(guild, language) for language in LANGUAGES}
+    guild.members = Unscannable()
+    for language in LANGUAGES:
+        assert index.route(language) == expected[language]
+
+
+@pytest.mark.benchmark
+def test_index_routing_beats_scanning_at_10k_members():
+    guild = Guild()
+    build = best_of(1, lambda: RoleIndex.build(guild))
+    index = RoleIndex.build(guild)
+    scanned = best_of(3, lambda: scan(guild, "Elvish"))
+    routed = best_of(3, lambda: index.route("Elvish"))
+    print(f"10k members: scan {scanned * 1000:.2f} ms, index route {routed * 1000:.3f} ms, "
+          f"build {build * 1000:.1f} ms")
+    assert index.route("Elvish") == scan(guild, "Elvish")
+    assert routed * 10 < scanned
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from shards import ShardSupervisor, partition, shard_for_guild
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stands in for a bot worker: connects to a fake gateway that hands it the guilds routed to its shards,
+# reports health the way bot.py does, and crashes once on its first start.
+WORKER = """
+import asyncio, json, os, sys
+sys.path.insert(0, {root!r})
+from shards import report_health, shard_for_guild
+
+shard_count = int(os.environ['SHARD_COUNT'])
+shard_ids = [int(shard_id) for shard_id in os.environ['SHARD_IDS'].split(',')]
+with open({gateway!r}) as f:
+    gateway_guilds = json.load(f)
+
+
+class FakeClient:
+    guilds = [guild_id for guild_id in gateway_guilds if shard_for_guild(guild_id, shard_count) in shard_ids]
+    latencies = [(shard_id, 0.05) for shard_id in shard_ids]
+
+    def is_ready(self):
+        return True
+
+
+async def main():
+    reporter = asyncio.create_task(report_health(FakeClient(), interval=0.05))
+    await asyncio.sleep(0.2)
+    crashed = os.environ['WORKER_HEALTH_FILE'] + '.crashed'
+    if not os.path.exists(crashed):
+        open(crashed, 'w').close()
+        os._exit(1)
+    await reporter
+
+asyncio.run(main())
+"""
+
+
+def test_partition_covers_every_shard_once():
+    for shard_count, workers in [(16, 4), (10, 3), (3, 8), (1, 1)]:
+        ranges = partition(shard_count, workers)
+        assert [shard_id for shard_ids in ranges for shard_id in shard_ids] == list(range(shard_count))
+        sizes = [len(shard_ids) for shard_ids in ranges]
+        assert len(ranges) == min(shard_count, workers)
+        assert max(sizes) - min(sizes) <= 1
+
+
+def test_guilds_spread_over_workers():
+    rng = random.Random(16)
+    guild_ids = [rng.getrandbits(41) << 22 | rng.getrandbits(22) for _ in range(10_000)]
+    ranges = partition(16, 4)
+    owners = {shard_id: worker for worker, shard_ids in enumerate(ranges) for shard_id in shard_ids}
+    per_worker = [0] * len(ranges)
+    for guild_id in guild_ids:
+        shard_id = shard_for_guild(guild_id, 16)
+        assert 0 <= shard_id < 16
+        per_worker[owners[shard_id]] += 1
+    assert sum(per_worker) == len(guild_ids)
+    assert min(per_worker) > len(guild_ids) / len(ranges) * 0.9
+
+
+def test_supervisor_restarts_workers_and_aggregates_health(tmp_path):
+    rng = random.Random(17)
+    guild_ids = [rng.getrandbits(41) << 22 for _ in range(500)]
+    gateway = tmp_path / 'gateway.json'
+    gateway.write_text(json.dumps(guild_ids))
+    script = tmp_path / 'worker.py'
+    script.write_text(WORKER.format(root=ROOT, gateway=str(gateway)))
+    supervisor = ShardSupervisor(str(script), shard_count=8, workers=3, health_dir=str(tmp_path / 'health'),
+                                 command=[sys.executable, str(script)])
+
+    async def scenario():
+        runner = asyncio.create_task(supervisor.run())
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            health = supervisor.aggregate_health()
+            if all(worker['restarts'] == 1 and worker['running'] for worker in health['workers'].values()):
+                await asyncio.sleep(0.3)
+                break
+        health = supervisor.aggregate_health()
+        runner.cancel()
+        try:
+            await runner
+        except asyncio.CancelledError:
+            pass
+        for process in supervisor.processes.values():
+            await process.wait()
+        return health
+
+    health = asyncio.run(scenario())
+    assert health['shard_count'] == 8
+    assert health['workers_ready'] == 3
+    assert health['guilds'] == len(guild_ids)
+    assert sorted(int(shard_id) for worker in health['workers'].values() for shard_id in worker['latencies']) == list(range(8))
+    for worker in health['workers'].values():
+        assert worker['running']
+        assert worker['restarts'] == 1
+    # Cancelling the supervisor takes its workers down with it
+    assert all(process.returncode is not None for process in supervisor.processes.values())
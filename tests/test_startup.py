@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+import bot
+import testbot
+from command_sync import sync_if_changed
+from loadtest import FakeWorld, HTTPStub
+
+SYNC = 'PUT /applications/{id}/commands'
+CHUNK = 'GATEWAY request_guild_members'
+
+
+def stub_sync(tree, http, monkeypatch):
+    async def sync(*args, **kwargs):
+        await http.request(SYNC)
+    monkeypatch.setattr(tree, 'sync', sync)
+
+
+def boot(tree, application_id, path):
+    async def timed():
+        start = time.perf_counter()
+        synced = await sync_if_changed(tree, application_id, path)
+        return synced, time.perf_counter() - start
+    return asyncio.run(timed())
+
+
+def boot_twice(tmp_path, monkeypatch):
+    """Boot each bot on a fresh hash file, then again unchanged; returns the HTTP stub and the timings."""
+    http = HTTPStub(latency=0.25)
+    path = str(tmp_path / 'command_tree.json')
+    timings = {}
+    for name, client in (('bot', bot.client), ('testbot', testbot.client)):
+        stub_sync(client.tree, http, monkeypatch)
+        synced, first = boot(client.tree, 1001, path)
+        assert synced
+        synced, second = boot(client.tree, 1001, path)
+        assert not synced
+        timings[name] = first, second
+    print(', '.join(f"{name}: first boot {first * 1000:.0f} ms, unchanged {second * 1000:.2f} ms"
+                    for name, (first, second) in timings.items()))
+    return http, path, timings
+
+
+def test_command_sync_runs_only_when_the_tree_changes(tmp_path, monkeypatch):
+    http, path, _ = boot_twice(tmp_path, monkeypatch)
+    assert http.calls[SYNC] == 2
+    # A different application has never seen these commands
+    for client in (bot.client, testbot.client):
+        assert boot(client.tree, 1002, path)[0]
+    assert http.calls[SYNC] == 4
+
+
+def test_failed_sync_is_retried_on_the_next_boot(tmp_path, monkeypatch):
+    path = str(tmp_path / 'command_tree.json')
+    attempts = []
+
+    async def failing_sync(*args, **kwargs):
+        attempts.append(1)
+        raise RuntimeError("503 Service Unavailable")
+    monkeypatch.setattr(testbot.client.tree, 'sync', failing_sync)
+    with pytest.raises(RuntimeError):
+        boot(testbot.client.tree, 1003, path)
+    stub_sync(testbot.client.tree, HTTPStub(latency=0), monkeypatch)
+    assert boot(testbot.client.tree, 1003, path)[0]
+    assert len(attempts) == 1
+
+
+def ready_with_unchunked_guild(monkeypatch):
+    """Run on_ready for a 10k-member guild that still needs chunking, over a slow gateway."""
+    http = HTTPStub(latency=0.3)
+    world = FakeWorld(guilds=1, members=10_000, http=http)
+    guild = world.guilds[0]
+    guild.chunked = False
+    monkeypatch.setattr(bot, 'GUILD', guild.name)
+    monkeypatch.setattr(bot.MyBot, 'guilds', property(lambda self: world.guilds))
+    monkeypatch.setattr(bot.client, 'role_indexes', {})
+
+    async def scenario():
+        start = time.perf_counter()
+        await bot.on_ready()
+        ready = time.perf_counter() - start
+        indexed_when_ready = guild.id in bot.client.role_indexes
+        while guild.id not in bot.client.role_indexes:
+            await asyncio.sleep(0.01)
+        return ready, time.perf_counter() - start, indexed_when_ready
+
+    ready, warmed, indexed_when_ready = asyncio.run(scenario())
+    print(f"10k members: on_ready {ready * 1000:.2f} ms, role index warm after {warmed * 1000:.0f} ms")
+    return guild, http, ready, indexed_when_ready
+
+
+def test_on_ready_does_not_wait_for_members(monkeypatch):
+    guild, http, _, indexed_when_ready = ready_with_unchunked_guild(monkeypatch)
+    # on_ready returned before the members arrived; the index was built in the background
+    assert not indexed_when_ready
+    # Members arrive over one gateway chunk request, not REST paging
+    assert http.calls == {CHUNK: 1}
+    readers, others = bot.client.role_indexes[guild.id].route("Elvish")
+    assert len(readers) + len(others) > 0
+
+
+@pytest.mark.benchmark
+def test_boot_timings(tmp_path, monkeypatch):
+    _, _, timings = boot_twice(tmp_path, monkeypatch)
+    assert all(second < 0.02 for _, second in timings.values())
+    ready = ready_with_unchunked_guild(monkeypatch)[2]
+    assert ready < 0.05